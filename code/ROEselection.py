@@ -25,123 +25,322 @@ pip install akshare numpy
 -------------------------------------------------------------------------------
 '''
 
-import akshare as ak
+import argparse
+import heapq
 import time
+# 模块导入耗时（akshare 不在其中，第一次访问网络时才导入），写入运行指标
+_IMPORT_STARTED = time.perf_counter()
 import numpy as np
 import concurrent.futures
+import random
 import threading
 
-def get_ROE(date="20221231", max_retries=10):
+from roe_backtest import (run_backtest, fundamentals_from_yjbb, DEFAULT_BACKTEST_DIR,
+                          DEFAULT_BACKTEST_START, DEFAULT_BACKTEST_TOP_N, DEFAULT_HORIZONS)
+from roe_cache import ROECache, DEFAULT_CACHE_PATH, DEFAULT_TTL_HOURS
+from roe_datasource import (get_data_source, set_data_source, LiveDataSource, InstrumentedDataSource,
+                            OfflineDataSource, RecordingDataSource, ReplayDataSource,
+                            akshare_import_seconds, DEFAULT_RECORD_DIR)
+from roe_quotes import get_quote_snapshot, fetch_spot, spot_prices
+from roe_incremental import (RunState, StateEntry, same_values, rescale_metrics, compute_delta,
+                             write_delta_report, QUOTE_MAX_AGE_DAYS, DEFAULT_DELTA_PATH)
+from roe_http import (HTTPPool, install_http_pool, get_http_pool, DEFAULT_POOL_SIZE,
+                      DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+from roe_journal import RunJournal, DEFAULT_JOURNAL_PATH, DEFAULT_MAX_AGE_HOURS
+from roe_industry import load_industry_map, load_industry_map_bulk
+from roe_master import load_securities_master
+from roe_metrics import (get_run_metrics, progress, report_missing, set_progress_interval, peak_memory_mb,
+                         DEFAULT_METRICS_PATH, DEFAULT_PROGRESS_INTERVAL)
+from roe_output import (JsonLinesWriter, result_columns, result_rows, write_csv, write_columnar,
+                        write_text_report, DEFAULT_CSV_PATH)
+from roe_panel import ROEPanel
+from roe_rules import ScreenSpec, roe_env, top_k_indices
+from roe_service import (ScreenService, ServiceDataset, DEFAULT_SERVICE_HOST, DEFAULT_SERVICE_PORT,
+                         DEFAULT_REFRESH_MINUTES)
+from roe_stream import TopK, bounded_map
+from roe_sweep import (SweepGrid, run_sweep, sweep_columns, print_sweep_summary,
+                       DEFAULT_SWEEP_PATH, DEFAULT_SWEEP_TOP_N)
+from roe_throttle import RateController, Hedger, Deadline
+
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+
+# 报告期本地缓存，由 __main__ 根据命令行参数创建；为 None 时不使用缓存
+ROE_CACHE = None
+
+# 运行日志（断点续跑），由 __main__ 根据命令行参数创建；为 None 时不记录
+RUN_JOURNAL = None
+
+# 逐行输出打分结果的 JSON Lines 文件，由 __main__ 根据命令行参数创建；为 None 时不输出
+RESULT_STREAM = None
+
+# 要获取的报告期：前五年年报 + 最新一期三季报
+# REPORT_PERIODS = ["20201231", "20211231", "20221231", "20231231", "20241231", "20250630"]
+REPORT_PERIODS = ["20201231", "20211231", "20221231", "20231231", "20241231", "20250930"]
+
+# 选股规则（ROE 筛选、估值筛选、性价比公式），由 __main__ 根据 --screen-spec 替换
+SCREEN_SPEC = ScreenSpec()
+
+# 证券主表（代码 -> 交易所、板块、名称、上市状态），首次使用时加载
+SECURITIES_MASTER = None
+_master_lock = threading.Lock()
+
+# 估值数据来源：'bulk' 全市场快照 + 逐只补齐；'xq' 全部逐只查询雪球
+QUOTE_MODE = 'bulk'
+
+# 离线模式：只用本地缓存中的报告期、证券主表、估值和行业，不访问网络、不导入 akshare；
+# 由 __main__ 根据 --offline 设置
+OFFLINE = False
+
+# 逐只查询雪球的限速与并发：每秒最多 METRICS_RATE 个请求，
+# 在途请求数在 [MIN, MAX] 之间按错误率和延迟自适应调整
+METRICS_RATE = 20.0
+METRICS_INITIAL_WORKERS = 10
+METRICS_MIN_WORKERS = 2
+METRICS_MAX_WORKERS = 20
+METRICS_LATENCY_TARGET = 2.0
+# 失败股票的重试轮数
+METRICS_RETRY_PASSES = 2
+# 单次查询的超时（秒），超时按失败处理、进入重试队列
+METRICS_CALL_TIMEOUT = 20.0
+# 对冲请求：超过近期延迟的 p95 仍未返回时再发一个相同的请求，对冲请求不超过请求数的 5%；
+# 预算为 0 时不对冲（单次查询超时仍然有效）
+HEDGE_QUANTILE = 0.95
+HEDGE_BUDGET = 0.05
+# 对冲请求和单次超时依赖连接池的 socket 超时结束超时的请求；
+# 直连网络且不使用连接池（--no-http-pool）时由 __main__ 关闭
+HEDGING = True
+
+# 各阶段的截止时间（秒），由 __main__ 根据 --deadline 设置；没有设置的阶段不限时。
+# 截止时间已到时阶段用已有的结果结束，未完成的股票列在输出和运行指标中
+STAGE_DEADLINES = {}
+DEADLINE_STAGES = ('metric_fetch', 'industry_lookup')
+
+# 报告输出的名次数
+REPORT_TOP_N = 1500
+# 流式模式各阶段之间队列的容量
+STREAM_QUEUE_SIZE = 64
+
+# 报告期并发下载的线程数
+ROE_FETCH_WORKERS = 6
+# 重试退避：首次等待约 1 秒，逐次翻倍，单次最多 30 秒
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+# 单个报告期重试的总时长上限（秒）
+ROE_FETCH_TIME_LIMIT = 300
+
+
+def get_securities_master():
+    """
+    证券主表，首次调用时从本地缓存读取或刷新，多线程共享同一份
+    """
+    global SECURITIES_MASTER
+    with _master_lock:
+        if SECURITIES_MASTER is None:
+            refresh = ROE_CACHE is not None and ROE_CACHE.refresh
+            if OFFLINE:
+                # 离线时缓存的主表不论新旧都直接使用
+                SECURITIES_MASTER = load_securities_master(ROE_CACHE, max_age_days=float('inf'))
+            else:
+                SECURITIES_MASTER = load_securities_master(ROE_CACHE, refresh=refresh)
+        return SECURITIES_MASTER
+
+
+class ROEFetchError(RuntimeError):
+    """报告期ROE数据在重试后仍然获取失败"""
+
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """
+    第 attempt 次失败后的等待时间：指数退避 + 抖动
+    
+    在 [d/2, d] 之间随机取值，d = min(cap, base * 2 ** attempt)，
+    避免多个线程同时重试时集中打到上游
+    """
+    delay = min(cap, base * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def get_ROE(date="20221231", max_retries=6, cache=None, time_limit=ROE_FETCH_TIME_LIMIT, refresh=False):
     """
     获取指定日期的股票净资产收益率(ROE)数据
     
     Parameters:
     date (str): 财报日期，格式为YYYYMMDD
-    max_retries (int): 最大重试次数
+    max_retries (int): 最大尝试次数
+    cache (ROECache): 报告期缓存，默认使用全局 ROE_CACHE
+    time_limit (float): 重试的总时长上限（秒）
+    refresh (bool): 不读缓存，重新获取（结果仍写入缓存）
     
     Returns:
     dict: 股票代码为key，ROE为value的字典
+    
+    Raises:
+    ROEFetchError: 重试次数或总时长用完仍未获取到数据
     """
-    attempt = 0
+    cache = cache if cache is not None else ROE_CACHE
+    if cache is not None and not refresh:
+        roe_dict = cache.load_period(date)
+        if roe_dict is not None:
+            print(f"从本地缓存读取 {date} 的ROE数据，共 {len(roe_dict)} 只股票")
+            get_run_metrics().increment('roe_cache_hits')
+            return roe_dict
+    if RUN_JOURNAL is not None:
+        roe_dict = RUN_JOURNAL.get_period(date)
+        if roe_dict is not None:
+            print(f"从运行日志读取 {date} 的ROE数据，共 {len(roe_dict)} 只股票")
+            get_run_metrics().increment('roe_journal_hits')
+            return roe_dict
+    if OFFLINE:
+        raise ROEFetchError(f"离线模式下本地缓存中没有 {date} 的ROE数据，请先联网运行一次")
+    
+    start = time.monotonic()
+    last_error = None
     
-    while attempt < max_retries:
+    for attempt in range(max_retries):
         try:
             print(f"正在获取 {date} 的ROE数据，尝试第 {attempt + 1} 次...")
-            stock_yjbb_em_df = ak.stock_yjbb_em(date)
+            stock_yjbb_em_df = get_data_source().stock_yjbb_em(date)
+            if stock_yjbb_em_df is None or stock_yjbb_em_df.empty:
+                raise ValueError("返回数据为空")
             
             # 创建字典：股票代码为key，ROE为value
-            roe_dict = {}
-            for _, row in stock_yjbb_em_df.iterrows():
-                stock_code = row['股票代码']
-                roe_value = row['净资产收益率']  # 根据实际列名调整
-                roe_dict[stock_code] = roe_value
+            roe_dict = dict(zip(stock_yjbb_em_df['股票代码'],
+                                stock_yjbb_em_df['净资产收益率']))  # 根据实际列名调整
             
             print(f"成功获取 {len(roe_dict)} 只股票的ROE数据")
+            if cache is not None and roe_dict:
+                cache.save_period(date, roe_dict)
+                # 每股收益、每股净资产一并缓存，回测时不必重新获取
+                fundamentals = fundamentals_from_yjbb(stock_yjbb_em_df)
+                if fundamentals:
+                    cache.save_fundamentals(date, fundamentals)
+            if RUN_JOURNAL is not None:
+                RUN_JOURNAL.record_period(date, roe_dict)
             return roe_dict
             
         except Exception as e:
-            attempt += 1
-            print(f"第 {attempt} 次尝试失败，错误信息: {str(e)}")
+            last_error = e
+            print(f"{date} 第 {attempt + 1} 次尝试失败，错误信息: {str(e)}")
             
-            if attempt >= max_retries:
-                print(f"已达到最大重试次数 {max_retries}，获取数据失败")
-                return {}
+            if attempt + 1 >= max_retries:
+                break
             
-            # 等待一段时间后重试（指数退避策略）
-            wait_time = 1 ** attempt
-            print(f"等待 {wait_time} 秒后重试...")
+            # 指数退避 + 随机抖动，总耗时不超过 time_limit
+            wait_time = backoff_delay(attempt)
+            if time.monotonic() - start + wait_time > time_limit:
+                print(f"{date} 重试总时长将超过 {time_limit} 秒，停止重试")
+                break
+            print(f"等待 {wait_time:.1f} 秒后重试...")
+            get_run_metrics().record_retry('stock_yjbb_em')
             time.sleep(wait_time)
     
-    return {}
+    raise ROEFetchError(
+        f"获取 {date} 的ROE数据失败（尝试 {attempt + 1} 次，"
+        f"耗时 {time.monotonic() - start:.0f} 秒）: {last_error}"
+    ) from last_error
 
-def get_multi_year_ROE():
+def fetch_ROE_periods(years, max_workers=ROE_FETCH_WORKERS, refresh=()):
     """
-    获取过去五年的ROE数据并生成汇总字典
+    用有界线程池同时获取多个报告期的ROE数据
+    
+    Parameters:
+    years (list): 报告期列表，格式为YYYYMMDD
+    max_workers (int): 最大并发数
+    refresh (collection): 不读缓存、重新获取的报告期
     
     Returns:
-    dict: 股票代码为key，ROE列表为value的字典
+    dict: 报告期为key，get_ROE 返回的字典为value
+    
+    Raises:
+    ROEFetchError: 任一报告期最终获取失败，错误信息列出全部失败的报告期
     """
-    # 定义要获取的年份列表
-    # years = ["20201231", "20211231", "20221231", "20231231", "20241231", "20250630"]
-    years = ["20201231", "20211231", "20221231", "20231231", "20241231", "20250930"]
-    # 获取各年份的ROE数据
     roe_data_by_year = {}
-    for year in years:
-        roe_data = get_ROE(date=year, max_retries=10)
-        roe_data_by_year[year] = roe_data
-        print(f"已获取 {year} 年数据，包含 {len(roe_data)} 只股票")
+    errors = {}
+    metrics = get_run_metrics()
     
-    # 获取所有股票代码的全集
-    all_stock_codes = set()
-    for year_data in roe_data_by_year.values():
-        all_stock_codes.update(year_data.keys())
+    def fetch(year):
+        # 各报告期在线程池中并发下载，CPU 时间只统计本线程
+        with metrics.stage(f"roe_fetch/{year}", per_thread=True):
+            return get_ROE(date=year, refresh=year in refresh)
+    
+    workers = max(1, min(max_workers, len(years)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        future_to_year = {executor.submit(fetch, year): year for year in years}
+        for future in concurrent.futures.as_completed(future_to_year):
+            year = future_to_year[future]
+            try:
+                roe_data_by_year[year] = future.result()
+                print(f"已获取 {year} 年数据，包含 {len(roe_data_by_year[year])} 只股票")
+            except Exception as e:
+                errors[year] = e
     
-    print(f"总共找到 {len(all_stock_codes)} 只股票")
+    if errors:
+        detail = "; ".join(f"{year}: {errors[year]}" for year in sorted(errors))
+        raise ROEFetchError(f"{len(errors)} 个报告期获取失败 -> {detail}")
     
-    # 创建结果字典
-    result_dict = {}
+    return roe_data_by_year
+
+
+def get_multi_year_ROE_panel(years=None, refresh=()):
+    """
+    获取多年度ROE数据，返回面板形式
+    
+    Parameters:
+    years (list): 报告期列表，默认为 REPORT_PERIODS
+    refresh (collection): 不读缓存、重新获取的报告期
     
-    for stock_code in all_stock_codes:
-        roe_list = []
+    Returns:
+    ROEPanel: 最新一期已年化、已排除北交所/新三板/B股的ROE面板
+    list: 报告期列表
+    """
+    years = list(years or REPORT_PERIODS)
+    metrics = get_run_metrics()
+    # 并发获取各年份的ROE数据
+    with metrics.stage('roe_fetch'):
+        roe_data_by_year = fetch_ROE_periods(years, refresh=refresh)
+    
+    master = get_securities_master()
+    with metrics.stage('panel'):
+        panel = ROEPanel.from_period_dicts(roe_data_by_year, years)
+        print(f"总共找到 {len(panel)} 只股票")
         
-        # 按年份顺序获取ROE值
-        for year in years:
-            if stock_code in roe_data_by_year[year]:
-                roe_value = roe_data_by_year[year][stock_code]
-                roe_list.append(roe_value)
-            else:
-                roe_list.append(np.nan)  # 用NaN代替缺失数据
-                
         #修正第六个:半年报  三季度
-        roe_list[-1] = roe_list[-1] / 3 * 4
-        
-        # 计算平均值（忽略NaN）
-        valid_values = [x for x in roe_list if not np.isnan(x)]
-        if valid_values:
-            avg_roe = sum(valid_values) / len(valid_values)
-        else:
-            avg_roe = np.nan
+        panel = panel.annualize_last()
         
-        # 添加平均值到列表末尾  :第7个
-        roe_list.append(avg_roe)
-        
-        result_dict[stock_code] = roe_list
-    
-    result_dict_ = {}
-    for stock_code in result_dict:
-        # 舍弃 8开头的 新三板  
-        if stock_code.startswith('8'):
-            pass
-        elif stock_code.startswith('2'):
-            pass
-        elif stock_code.startswith('9'):
-            pass
-        elif stock_code.startswith('4'):
-            pass
-        else:
-            result_dict_[stock_code] = result_dict[stock_code]
-            
-    return result_dict_ , years
+        # 按证券主表的板块舍弃 北交所、新三板、B股，以及已退市的股票
+        panel = panel.select(master.board_mask(panel.codes))
+    return panel, years
+
+
+def get_multi_year_ROE():
+    """
+    获取过去五年的ROE数据并生成汇总字典
+    
+    Returns:
+    dict: 股票代码为key，ROE列表为value的字典（最后一个元素为平均值）
+    list: 报告期列表
+    """
+    panel, years = get_multi_year_ROE_panel()
+    return panel.to_dict(extra=[panel.mean()]), years
+
+
+def screen_ROE_panel(panel):
+    """
+    按平均值、最小值条件筛选ROE面板
+    
+    Parameters:
+    panel (ROEPanel): get_multi_year_ROE_panel 返回的面板
+    
+    Returns:
+    ROEPanel: 符合条件的子面板
+    np.ndarray: 对应的平均ROE
+    """
+    with get_run_metrics().stage('roe_screen'):
+        avg_roe = panel.mean()
+        min_roe = panel.min()
+        # 默认条件1：平均值必须大于1%；最小值必须大于-5%；条件2：最小值乘以80必须大于平均值
+        mask = SCREEN_SPEC.roe_mask(roe_env(panel.values, avg_roe, min_roe))
+        return panel.select(mask), avg_roe[mask]
 
   
 def clean_data_ROE_v2():
@@ -155,64 +354,24 @@ def clean_data_ROE_v2():
     int: 筛选后数据量
     """
     # 获取多年度ROE数据
-    multi_year_roe, year_list = get_multi_year_ROE()
+    panel, year_list = get_multi_year_ROE_panel()
     
     print(f"\n年份顺序: {year_list}")
-    print(f"总共处理了 {len(multi_year_roe)} 只股票")
+    print(f"总共处理了 {len(panel)} 只股票")
     
-    # 筛选符合条件的数据
-    filtered_data = {}
-    
-    for stock_code, roe_list in multi_year_roe.items():
-        # 获取前5年的有效数据（忽略NaN）
-        valid_values = [x for x in roe_list[:-1] if not np.isnan(x)]
-        
-        if not valid_values:  # 如果没有有效数据，跳过
-            continue
-        
-        # 重新计算平均值（使用所有可用年份）
-        avg_roe = sum(valid_values) / len(valid_values)
-        
-        '''# 条件1：平均值必须大于1%
-        '''
-        if avg_roe <= 1:
-            continue
-
-        
-        '''# 计算最小值  必须大于-5%
-        '''
-        min_roe = min(valid_values)
-        
-        if min_roe <= -5:
-            continue
-        
-        '''# 条件2：最小值乘以80必须大于平均值
-        '''
-        if abs(min_roe) * 80 > avg_roe or min_roe * 80 > avg_roe :
-            # 创建新的ROE列表，包含原始数据和重新计算的平均值
-            new_roe_list = roe_list.copy()
-            new_roe_list[-1] = avg_roe  # 更新平均值
-            filtered_data[stock_code] = new_roe_list
+    # 筛选符合条件的数据，最后一列为平均值
+    selected, avg_roe = screen_ROE_panel(panel)
+    filtered_data = selected.to_dict(extra=[avg_roe])
     
     print(f"\n筛选后数据统计信息:")
     print(f"筛选后股票数量: {len(filtered_data)}")
     
-    # 统计有效数据年数分布
-    # year_distribution = {}
-    # for roe_list in filtered_data.values():
-    #     valid_count = sum(1 for x in roe_list[:5] if not np.isnan(x))
-    #     year_distribution[valid_count] = year_distribution.get(valid_count, 0) + 1
-    
-    # print(f"\n有效数据年数分布:")
-    # for years, count in sorted(year_distribution.items()):
-    #     print(f"  {years}年有效数据: {count}只股票 ({count/len(filtered_data)*100:.1f}%)")
-    
-    return filtered_data, len(multi_year_roe), len(filtered_data)
+    return filtered_data, len(panel), len(filtered_data)
 
 
 def get_hangye(stock_code="000001"):#行业
     try:
-        stock_individual_info_em_df = ak.stock_individual_info_em(stock_code)
+        stock_individual_info_em_df = get_data_source().stock_individual_info_em(stock_code)
         # print(stock_individual_info_em_df)
         data_dict = dict(zip(stock_individual_info_em_df['item'], stock_individual_info_em_df['value']))
 
@@ -225,6 +384,37 @@ def get_hangye(stock_code="000001"):#行业
     return np.nan
     
 
+def cached_industries():
+    """
+    本地缓存中的行业映射，不访问网络；没有缓存时为空
+
+    Returns:
+    dict: 股票代码为key，行业为value
+    """
+    return ROE_CACHE.load_industries()[0] if ROE_CACHE is not None else {}
+
+
+def resolve_industries(stock_codes):
+    """
+    写报告前一次性准备好行业映射：先用行业板块成分股批量获取（带缓存），
+    缺失的再并发调用 get_hangye
+    
+    Returns:
+    dict: 股票代码为key，行业为value
+    """
+    refresh = ROE_CACHE is not None and ROE_CACHE.refresh
+    if OFFLINE:
+        cached = ROE_CACHE.load_industries()[0]
+        industry_map = {code: cached[code] for code in stock_codes if code in cached}
+        print(f"离线模式: 本地缓存中有 {len(industry_map)}/{len(stock_codes)} 只股票的行业信息")
+        return industry_map
+    with get_run_metrics().stage('industry_lookup'):
+        industry_map = load_industry_map(stock_codes, get_hangye, cache=ROE_CACHE, refresh=refresh,
+                                         deadline=stage_deadline('industry_lookup'))
+    print(f"已准备 {len(industry_map)}/{len(stock_codes)} 只股票的行业信息")
+    return industry_map
+
+
 def safe_convert(value, default=np.nan):
     """
     安全转换函数，处理None、字符串等非数值数据
@@ -236,150 +426,179 @@ def safe_convert(value, default=np.nan):
     except (ValueError, TypeError):
         return default
 
-def get_stock_metrics(stock_code):
+def query_stock_metrics(stock_code):
     """
-    获取单只股票的市盈率、股息率和市净率
-    
-    Parameters:
-    stock_code (str): 股票代码
+    请求雪球接口获取单只股票的市盈率、股息率、市净率和名称，网络错误原样抛出
     
     Returns:
-    tuple: (市盈率, 股息率, 市净率) 或 (np.nan, np.nan, np.nan) 如果获取失败
-    
-    例如 get_stock_metrics('002202') = (17.226, 1.154, 1.371)
-    """
-    symbols_to_try = []
-    
-    # 根据股票代码判断可能的交易所
-    if stock_code.startswith('6'):
-        symbols_to_try.append(f"SH{stock_code}")
-        symbols_to_try.append(f"SZ{stock_code}")
-        symbols_to_try.append(f"SH{stock_code}")
-        symbols_to_try.append(f"SZ{stock_code}")
-    elif stock_code.startswith(('0', '3')):
-        symbols_to_try.append(f"SZ{stock_code}")
-        symbols_to_try.append(f"SH{stock_code}")
-        symbols_to_try.append(f"SZ{stock_code}")
-        symbols_to_try.append(f"SH{stock_code}")
-    elif stock_code.startswith('8'):
-        symbols_to_try.append(f"BJ{stock_code}")
-        symbols_to_try.append(f"SZ{stock_code}")
-        symbols_to_try.append(f"SH{stock_code}")
-    else:
-        symbols_to_try.append(f"SH{stock_code}")
-        # symbols_to_try.append(f"SZ{stock_code}")
-        # symbols_to_try.append(f"BJ{stock_code}")
+    tuple: (市盈率, 股息率, 市净率, 名称)，字段缺失时为 np.nan
+    """
+    # 由证券主表确定交易所，只请求一次正确的代码
+    symbol = get_securities_master().symbol(stock_code)
     
-    # 尝试获取股票指标数据
-    for symbol in symbols_to_try:
-        try:
-            print(f"当前尝试 {symbol}  ")
-            stock_individual_spot_xq_df = ak.stock_individual_spot_xq(symbol=symbol)
-            data_dict = dict(zip(stock_individual_spot_xq_df['item'], stock_individual_spot_xq_df['value']))
-            
-            # 使用安全转换函数处理数据
-            pe_ratio = safe_convert(data_dict.get('市盈率(动)', np.nan))
-            dividend_yield = safe_convert(data_dict.get('股息率(TTM)', np.nan))
-            pb_ratio = safe_convert(data_dict.get('市净率', np.nan))
-            
-            # 处理股票名称
-            stockname = data_dict.get('名称', '')
-            if stockname in [None, 'None', '']:
-                stockname = np.nan
-            else:
-                stockname = str(stockname)
-            
-            time.sleep(0.1)
-            return pe_ratio, dividend_yield, pb_ratio, stockname
-            
-        except Exception as e:
-            continue
-        
-        # 添加短暂延迟
-        time.sleep(1)
+    stock_individual_spot_xq_df = get_data_source().stock_individual_spot_xq(symbol=symbol)
+    data_dict = dict(zip(stock_individual_spot_xq_df['item'], stock_individual_spot_xq_df['value']))
+    
+    # 使用安全转换函数处理数据
+    pe_ratio = safe_convert(data_dict.get('市盈率(动)', np.nan))
+    dividend_yield = safe_convert(data_dict.get('股息率(TTM)', np.nan))
+    pb_ratio = safe_convert(data_dict.get('市净率', np.nan))
+    
+    # 处理股票名称
+    stockname = data_dict.get('名称', '')
+    if stockname in [None, 'None', '']:
+        stockname = np.nan
+    else:
+        stockname = str(stockname)
     
-    return np.nan, np.nan, np.nan, np.nan
+    return pe_ratio, dividend_yield, pb_ratio, stockname
 
 
-def get_stock_metrics_wrapper(stock_code):
+def new_metrics_controller(maximum=METRICS_MAX_WORKERS):
     """
-    包装函数，用于线程池调用
+    按 METRICS_* / HEDGE_* 参数新建逐只查询的请求控制器（限速、自适应并发、对冲请求、单次超时），
+    用完后调用 close()；HEDGING 为 False 时不对冲、不加单次超时
     """
-    return stock_code, get_stock_metrics(stock_code)
+    hedger = (Hedger(timeout=METRICS_CALL_TIMEOUT, quantile=HEDGE_QUANTILE, budget=HEDGE_BUDGET,
+                     max_workers=maximum * 2 + 4) if HEDGING else None)
+    return RateController(
+        rate=METRICS_RATE, initial=METRICS_INITIAL_WORKERS,
+        minimum=METRICS_MIN_WORKERS, maximum=maximum,
+        latency_target=METRICS_LATENCY_TARGET, hedger=hedger,
+    )
 
 
-def append_pb():
+def stage_deadline(stage):
+    """按 STAGE_DEADLINES 从现在开始计时的截止时间"""
+    return Deadline(STAGE_DEADLINES.get(stage))
+
+
+def _run_metrics_pass(stock_codes, controller, results, reporter, deadline=None):
     """
-    在ROE数据基础上添加市净率、市盈率、股息率和性价比指标
+    一轮并发查询，成功的写入 results
     
     Returns:
-    dict: 包含PB、PE、股息率和性价比指标的增强数据字典
-    int: 原始股票数量
-    int: 成功获取指标数据的股票数量
+    list: 本轮失败的股票代码
+    list: 截止时间已到、没有完成的股票代码
     """
-    # 首先获取清洗后的ROE数据
-    filtered_data, original_count, filtered_count = clean_data_ROE_v2()
-    
-    if not filtered_data:
-        print("没有可处理的ROE数据")
-        return {}, 0, 0
+    failed, unfinished = [], []
+    # 线程数取并发上限，实际同时在途的请求数由 controller 自适应控制
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=controller.max_workers)
+    future_to_stock = {executor.submit(controller.call, query_stock_metrics, code, deadline=deadline): code
+                       for code in stock_codes}
+    remaining = dict(future_to_stock)
+    try:
+        timeout = deadline.remaining() if deadline is not None else None
+        for future in concurrent.futures.as_completed(future_to_stock, timeout=timeout):
+            stock_code = remaining.pop(future)
+            try:
+                results[stock_code] = future.result()
+                if RUN_JOURNAL is not None:
+                    RUN_JOURNAL.record_metrics(stock_code, results[stock_code])
+                reporter.update()
+            except Exception as e:
+                # 截止时间到了才超时的请求不算失败，不再重试
+                if isinstance(e, TimeoutError) and deadline is not None and deadline.expired():
+                    unfinished.append(stock_code)
+                else:
+                    failed.append(stock_code)
+                reporter.update(failed=1)
+    except concurrent.futures.TimeoutError:
+        # 截止时间已到：排队的请求取消，在途的请求不再等待
+        unfinished.extend(remaining.values())
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
     
-    print(f"\n开始为 {len(filtered_data)} 只股票获取市净率、市盈率和股息率数据...")
+    reporter.close()
+    return failed, unfinished
+
+
+def fetch_stock_metrics(stock_codes, controller=None, retry_passes=METRICS_RETRY_PASSES, deadline=None):
+    """
+    逐只查询股票指标：令牌桶限速 + AIMD 自适应并发，失败的股票放入重试队列再查
     
-    # 创建增强数据字典
-    enhanced_data = {}
-    success_count = 0
-    fail_count = 0
+    Parameters:
+    stock_codes (list): 股票代码
+    controller (RateController): 请求控制器，默认由 new_metrics_controller 新建，返回前关闭
+    retry_passes (int): 重试队列最多再跑几轮
+    deadline (Deadline): 截止时间，默认取 STAGE_DEADLINES['metric_fetch']，从现在开始计时；
+                         到期后不再发新请求、不再重试，未完成的股票记入运行指标
     
-    # 使用线程池并发获取股票指标
-    stock_codes = list(filtered_data.keys())
+    Returns:
+    dict: 股票代码为key，(市盈率, 股息率, 市净率, 名称) 为value；
+          最终仍失败或未完成的股票为 (np.nan, np.nan, np.nan, np.nan)
+    """
+    if controller is None:
+        controller = new_metrics_controller()
+        try:
+            return fetch_stock_metrics(stock_codes, controller, retry_passes, deadline)
+        finally:
+            controller.close()
+    deadline = deadline or stage_deadline('metric_fetch')
     results = {}
     
-    # 创建线程池，最大线程数为20
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor: # 太多 ， 20个， 会丢股票， 失败
-        # 提交所有任务
-        future_to_stock = {executor.submit(get_stock_metrics_wrapper, code): code for code in stock_codes}
-        
-        # 处理完成的任务
-        for future in concurrent.futures.as_completed(future_to_stock):
-            stock_code = future_to_stock[future]
-            try:
-                result_code, metrics = future.result()
+    # 续跑时运行日志中已有的结果不再请求
+    if RUN_JOURNAL is not None:
+        for stock_code in stock_codes:
+            metrics = RUN_JOURNAL.get_metrics(stock_code)
+            if metrics is not None:
                 results[stock_code] = metrics
-                print(f"已获取 {len(results)}/{len(stock_codes)} 只股票数据")
-                
-            except Exception as e:
-                print(f"处理股票 {stock_code} 时出错: {str(e)}")
-                results[stock_code] = (np.nan, np.nan, np.nan, np.nan)
+        if results:
+            print(f"运行日志命中 {len(results)}/{len(stock_codes)} 只股票")
+            stock_codes = [code for code in stock_codes if code not in results]
     
-    # 处理获取到的指标数据
-    success_count = 0
-    for stock_code, roe_list in filtered_data.items():
-        if stock_code not in results:
-            continue
-            
-        pe_ratio, dividend_yield, pb_ratio, stockname = results[stock_code]
-        
-        # 检查数据有效性 - 修复：使用更安全的方式检查
-        def is_valid_numeric(value):
-            """检查数值是否有效"""
-            try:
-                return not np.isnan(float(value)) and float(value) > 0
-            except (ValueError, TypeError):
-                return False
-        
-        def is_valid_string(value):
-            """检查字符串是否有效"""
-            return value is not np.nan and value not in [None, 'None', ''] and isinstance(value, str)
-        
-        # 使用安全的检查方式
-        if (not is_valid_numeric(pe_ratio) or 
-            not is_valid_numeric(dividend_yield) or 
-            not is_valid_numeric(pb_ratio) or 
-            not is_valid_string(stockname)):
-            continue
+    hedges_before = controller.hedger.stats() if controller.hedger is not None else None
+    reporter = progress("逐只查询估值", total=len(stock_codes))
+    pending, unfinished = _run_metrics_pass(stock_codes, controller, results, reporter, deadline)
+    first_failed = len(pending)
+    
+    for retry in range(retry_passes):
+        if not pending or deadline.expired():
+            break
+        # 等上游缓一缓再重试，此时 AIMD 已把并发降下来；不等到截止时间之后
+        wait_time = deadline.cap(backoff_delay(retry + 1))
+        print(f"{len(pending)} 只股票获取失败，{wait_time:.1f} 秒后第 {retry + 1} 轮重试...")
+        get_run_metrics().record_retry('stock_individual_spot_xq', len(pending))
+        time.sleep(wait_time)
+        reporter = progress(f"第 {retry + 1} 轮重试", total=len(pending))
+        pending, more = _run_metrics_pass(pending, controller, results, reporter, deadline)
+        unfinished += more
+    
+    for stock_code in pending + unfinished:
+        results[stock_code] = (np.nan, np.nan, np.nan, np.nan)
+    
+    print(f"逐只查询完成: 首轮失败 {first_failed} 只，重试找回 {first_failed - len(pending)} 只，"
+          f"最终丢失 {len(pending)} 只；{controller.summary()}")
+    if pending:
+        print(f"丢失的股票: {', '.join(sorted(pending))}")
+    report_missing('metric_fetch', unfinished)
+    record_hedge_stats(controller, hedges_before)
+    return results
+
+
+def record_hedge_stats(controller, before=None):
+    """把请求控制器的对冲次数、超时次数（相对 before 的增量）记入运行指标"""
+    if controller.hedger is None:
+        return
+    run_metrics = get_run_metrics()
+    for name, value in controller.hedger.stats().items():
+        if name != 'requests':
+            run_metrics.increment(f"metrics_{name}", value - (before or {}).get(name, 0))
+
+
+def is_valid_numeric(value):
+    """检查数值是否有效"""
+    try:
+        return not np.isnan(float(value)) and float(value) > 0
+    except (ValueError, TypeError):
+        return False
+
+
+def is_valid_string(value):
+    """检查字符串是否有效"""
+    return value is not np.nan and value not in [None, 'None', ''] and isinstance(value, str)
+
 
-            
 #  ak.stock_individual_spot_xq('SZ002681')
 # Out[8]: 
 #         item                value
@@ -420,111 +639,913 @@ def append_pb():
 # 34  市盈率(TTM)              485.968
 # 35        时间  2025-09-11 15:04:09
 # 36        今开                 7.39   
+
+
+def score_stocks(roe_lists, metrics_list):
+    """
+    批量计算性价比并做估值筛选，规则见 SCREEN_SPEC（默认：市盈率小于200、股息率大于0.1%、市净率小于33，
+    性价比 = (平均ROE/12) / 市净率 + (100/市盈率) / 12）
     
+    Parameters:
+    roe_lists (list): 每只股票的 各期ROE + 平均ROE
+    metrics_list (list): 对应的 (市盈率, 股息率, 市净率, 名称)
     
-        try:
-            # 提取所需指标
-            # pe_ratio = float(data_dict.get('市盈率(动)', np.nan))  # 市盈率(动)
-            # dividend_yield = float(data_dict.get('股息率(TTM)', np.nan))  # 股息率(TTM)
-            # pb_ratio = float(data_dict.get('市净率', np.nan))  # 市净率
-            
-            # 获取平均ROE（原列表的第7个元素）
-            avg_roe = roe_list[-1]
-            # recent_roe = roe_list[-2]
+    Returns:
+    list: 每只股票的 原ROE数据 + [市盈率, 股息率, 市净率, 性价比, 名称]；数据无效或未通过筛选时为 None。
+          各期ROE的个数随报告期数变化，取后面的字段要从末尾数：平均ROE 为 [-6]，性价比为 [-2]，名称为 [-1]
+    """
+    if not roe_lists:
+        return []
+    roe = np.array(roe_lists, dtype=np.float64)
+    quotes = np.array([[safe_convert(value) for value in metrics[:3]] for metrics in metrics_list],
+                      dtype=np.float64)
+    env = roe_env(roe[:, :-1], avg_roe=roe[:, -1])
+    env.update(pe=quotes[:, 0], dividend_yield=quotes[:, 1], pb=quotes[:, 2])
+    passed, value_ratio = SCREEN_SPEC.evaluate(env)
+    
+    results = []
+    for i, (roe_list, metrics) in enumerate(zip(roe_lists, metrics_list)):
+        pe_ratio, dividend_yield, pb_ratio, stockname = metrics
+        if not passed[i] or not is_valid_string(stockname):
+            results.append(None)
+            continue
+        # 创建新的数据列表（原ROE数据 + 新指标）
+        enhanced_list = list(roe_list)
+        enhanced_list.extend([pe_ratio, dividend_yield, pb_ratio, float(value_ratio[i]), stockname])
+        results.append(enhanced_list)
+    return results
+
+
+def score_stock(roe_list, metrics):
+    """
+    计算一只股票的性价比并做估值筛选（流式、增量模式逐只打分时使用）
+    
+    Parameters:
+    roe_list (list): 各期ROE + 平均ROE
+    metrics (tuple): (市盈率, 股息率, 市净率, 名称)
+    
+    Returns:
+    list: 原ROE数据 + [市盈率, 股息率, 市净率, 性价比, 名称]；数据无效或未通过筛选时返回 None
+    """
+    return score_stocks([roe_list], [metrics])[0]
+
+
+def get_quotes(stock_codes):
+    """
+    获取估值数据：先用全市场快照一次取回，快照中没有的股票再逐只查询
+    
+    Parameters:
+    stock_codes (list): 股票代码
+    
+    Returns:
+    dict: 股票代码为key，(市盈率, 股息率, 市净率, 名称) 为value
+    """
+    if OFFLINE:
+        return load_stored_quotes(stock_codes)
+    results = {}
+    snapshot = {}
+    metrics = get_run_metrics()
+    
+    if QUOTE_MODE == 'bulk':
+        with metrics.stage('quote_snapshot'):
+            snapshot = get_quote_snapshot()
+        results = {code: snapshot[code] for code in stock_codes if code in snapshot}
+        print(f"快照命中 {len(results)}/{len(stock_codes)} 只股票")
+        metrics.increment('snapshot_hits', len(results))
+        stock_codes = [code for code in stock_codes if code not in results]
+    
+    if stock_codes:
+        print(f"逐只查询 {len(stock_codes)} 只股票...")
+        with metrics.stage('metric_fetch'):
+            results.update(fetch_stock_metrics(stock_codes))
+    # 保存到本地缓存供离线模式使用；整个快照都保存，离线时换用更宽的规则也有估值可用
+    if ROE_CACHE is not None:
+        ROE_CACHE.save_quotes({**snapshot, **results})
+    return results
+
+
+def load_stored_quotes(stock_codes):
+    """
+    离线模式的估值：本地缓存中最近一次获取的估值，缓存中没有的股票不在结果中
+    
+    Returns:
+    dict: 股票代码为key，(市盈率, 股息率, 市净率, 名称) 为value
+    """
+    stored, fetched_at = ROE_CACHE.load_quotes()
+    results = {code: stored[code] for code in stock_codes if code in stored}
+    since = (time.strftime('%Y-%m-%d %H:%M', time.localtime(fetched_at))
+             if fetched_at is not None else "无")
+    print(f"离线模式: 本地缓存中有 {len(results)}/{len(stock_codes)} 只股票的估值（最早获取于 {since}）")
+    if len(results) < len(stock_codes):
+        get_run_metrics().increment('offline_quote_misses', len(stock_codes) - len(results))
+    return results
+
+
+def append_pb():
+    """
+    在ROE数据基础上添加市净率、市盈率、股息率和性价比指标
+    
+    Returns:
+    dict: 包含PB、PE、股息率和性价比指标的增强数据字典
+    int: 原始股票数量
+    int: 成功获取指标数据的股票数量
+    """
+    # 首先获取清洗后的ROE数据
+    filtered_data, original_count, filtered_count = clean_data_ROE_v2()
+    
+    if not filtered_data:
+        print("没有可处理的ROE数据")
+        return {}, 0, 0
+    
+    print(f"\n开始为 {len(filtered_data)} 只股票获取市净率、市盈率和股息率数据...")
+    
+    # 创建增强数据字典
+    enhanced_data = {}
+    
+    results = get_quotes(list(filtered_data.keys()))
+    metrics = get_run_metrics()
+    
+    # 逐行输出的结果带上本地缓存中已知的行业
+    industries = cached_industries() if RESULT_STREAM is not None else {}
+    
+    # 处理获取到的指标数据
+    with metrics.stage('scoring'):
+        scored_codes = [code for code in filtered_data if code in results]
+        scored = score_stocks([filtered_data[code] for code in scored_codes],
+                              [results[code] for code in scored_codes])
+        for stock_code, enhanced_list in zip(scored_codes, scored):
+            if enhanced_list is not None:
+                enhanced_data[stock_code] = enhanced_list
+                if RESULT_STREAM is not None:
+                    RESULT_STREAM.write(stock_code, enhanced_list, industry=industries.get(stock_code))
+
+    success_count = len(enhanced_data)
+    print(f"累计 {success_count} 只股票符合估值标准")
+    return enhanced_data, len(filtered_data), success_count
+
+
+def rank_stocks(enhanced_data, top_k=None):
+    """
+    按性价比从高到低排序，同分按原顺序
+    
+    Parameters:
+    enhanced_data (dict): 股票代码 -> 增强数据列表
+    top_k (int): 只取前 top_k 名（部分选择，不对全部股票排序），为 None 时全部排序
+    
+    Returns:
+    list: [(股票代码, 增强数据列表), ...]
+    """
+    items = list(enhanced_data.items())
+    # 增强数据列表的长度随报告期数变化，性价比固定在倒数第 2 个
+    scores = np.array([data[-2] for _, data in items], dtype=np.float64)
+    return [items[i] for i in top_k_indices(scores, top_k)]
+
+
+def run_stream_pipeline(top_k=REPORT_TOP_N, workers=METRICS_MAX_WORKERS, queue_size=STREAM_QUEUE_SIZE,
+                        keep_all=False):
+    """
+    流式版本的 append_pb + 排序 + 行业查询，各阶段重叠执行：
+      - 行情快照、行业板块映射与报告期下载同时开始
+      - 通过ROE筛选的股票立即进入估值查询队列（有界队列，快照命中的不发请求）
+      - 打分后的股票进入增量前 K 名结构，不保留全部结果（keep_all 时保留）
+      - 流结束后，最终前 K 名中不在行业映射中的股票逐只查询行业（中途进入又被挤出的不查）
+      - 取得的估值与全市场快照一起写入本地缓存，供离线模式使用
+    
+    Parameters:
+    top_k (int): 保留并输出的名次数
+    workers (int): 估值查询线程数（实际在途请求数由 RateController 控制）
+    queue_size (int): 各阶段之间队列的容量
+    keep_all (bool): 保留全部通过估值筛选的股票（--full-results / 列式文件用），行业仍只查前 top_k 名
+    
+    Returns:
+    list: 前 top_k 名 [(股票代码, 增强数据列表), ...]，keep_all 时为全部
+    int: 通过 ROE 数据清洗的股票数量
+    int: 通过估值筛选的股票数量
+    dict: 前 top_k 名的 股票代码 -> 行业
+    """
+    refresh = ROE_CACHE is not None and ROE_CACHE.refresh
+    run_metrics = get_run_metrics()
+    background = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    enrich_pool = concurrent.futures.ThreadPoolExecutor(max_workers=10)
+    controller = None
+    
+    def timed(stage, func, *args, **kwargs):
+        # 后台阶段与主流程重叠，CPU 时间只统计本线程
+        with run_metrics.stage(stage, per_thread=True):
+            return func(*args, **kwargs)
+    
+    try:
+        snapshot_future = (background.submit(timed, 'quote_snapshot', get_quote_snapshot)
+                           if QUOTE_MODE == 'bulk' else None)
+        industry_future = background.submit(timed, 'industry_lookup/bulk', load_industry_map_bulk,
+                                            ROE_CACHE, refresh=refresh)
+        
+        panel, year_list = get_multi_year_ROE_panel()
+        selected, avg_roe = screen_ROE_panel(panel)
+        print(f"通过ROE筛选 {len(selected)}/{len(panel)} 只股票，开始流式获取估值数据...")
+        
+        snapshot = snapshot_future.result() if snapshot_future is not None else {}
+        cached = cached_industries() if RESULT_STREAM is not None else {}
+        controller = new_metrics_controller(maximum=workers)
+        deadline = stage_deadline('metric_fetch')
+        
+        def roe_rows():
+            for order, code in enumerate(selected.codes.tolist()):
+                yield order, code, selected.values[order].tolist() + [float(avg_roe[order])]
+        
+        def fetch(row):
+            code = row[1]
+            if code in snapshot:
+                return snapshot[code]
+            if RUN_JOURNAL is not None:
+                metrics = RUN_JOURNAL.get_metrics(code)
+                if metrics is not None:
+                    return metrics
+            metrics = controller.call(query_stock_metrics, code, deadline=deadline)
+            if RUN_JOURNAL is not None:
+                RUN_JOURNAL.record_metrics(code, metrics)
+            return metrics
+        
+        top = TopK(len(selected) if keep_all else top_k)
+        passed_count = 0
+        reporter = progress("流式估值查询", total=len(selected))
+        quotes = {}
+        failed_rows = []
+        unfinished = []
+        
+        def accept(order, code, roe_list, metrics):
+            nonlocal passed_count
+            enhanced_list = score_stock(roe_list, metrics)
+            if enhanced_list is None:
+                return
+            passed_count += 1
+            if RESULT_STREAM is not None:
+                # 行业板块映射就绪前用本地缓存中已知的行业
+                industries = industry_future.result() if industry_future.done() else cached
+                RESULT_STREAM.write(code, enhanced_list, industry=industries.get(code))
+            top.push(enhanced_list[-2], order, (code, enhanced_list))
+        
+        # 估值查询与打分、排名重叠执行，合并为一个阶段
+        with run_metrics.stage('metric_fetch'):
+            for (order, code, roe_list), stock_metrics, error in bounded_map(
+                    fetch, roe_rows(), workers=workers, queue_size=queue_size):
+                if error is not None:
+                    # 截止时间已到后剩余的股票不再请求（立即返回 DeadlineExceeded），也不重试
+                    if isinstance(error, TimeoutError) and deadline.expired():
+                        unfinished.append(code)
+                    else:
+                        failed_rows.append((order, code, roe_list))
+                    reporter.update(failed=1)
+                    continue
+                quotes[code] = stock_metrics
+                accept(order, code, roe_list, stock_metrics)
+                reporter.update()
+            reporter.close()
+            report_missing('metric_fetch', unfinished)
+            # 重试队列的对冲次数由 fetch_stock_metrics 另外记录
+            record_hedge_stats(controller)
             
-            '''# 计算性价比指标（平均ROE/6% / 市净率）+  动态市盈率的倒数 / 6%'''
+            # 流式阶段失败的股票走重试队列，与流式阶段共用截止时间
+            if failed_rows:
+                retried = fetch_stock_metrics([code for _, code, _ in failed_rows], controller=controller,
+                                              deadline=deadline)
+                quotes.update(retried)
+                for order, code, roe_list in failed_rows:
+                    accept(order, code, roe_list, retried[code])
+            # 与 get_quotes 相同：整个快照和逐只查询的结果都保存
+            if ROE_CACHE is not None:
+                ROE_CACHE.save_quotes({**snapshot, **quotes})
+        
+        ranked = top.ranked()
+        with run_metrics.stage('industry_lookup'):
+            deadline = stage_deadline('industry_lookup')
+            try:
+                industry_map = industry_future.result(timeout=deadline.remaining())
+            except concurrent.futures.TimeoutError:
+                industry_map = {}
+            # 行业映射就绪后，只为最终前 K 名中映射里没有的股票发起逐只查询
+            reported = ranked[:top_k]
+            industry_requests = {}
+            if industry_future.done():
+                industry_requests = {code: enrich_pool.submit(get_hangye, code)
+                                     for code, _ in reported if code not in industry_map}
             
+            ranked_industries = {}
+            unfinished = []
+            for code, _ in reported:
+                if code in industry_map:
+                    ranked_industries[code] = industry_map[code]
+                elif code in industry_requests:
+                    try:
+                        industry = industry_requests[code].result(timeout=deadline.remaining())
+                    except concurrent.futures.TimeoutError:
+                        unfinished.append(code)
+                        continue
+                    if isinstance(industry, str) and industry not in ('', 'nan', 'None'):
+                        ranked_industries[code] = industry
+                elif not industry_future.done():
+                    unfinished.append(code)
+            report_missing('industry_lookup', unfinished)
             
-            if pb_ratio > 0:
-                # value_ratio = ( (avg_roe + recent_roe) /12 ) / pb_ratio
-                value_ratio = (avg_roe /12 )/ pb_ratio + (100 / pe_ratio) / 12
-            else:
-                value_ratio = np.nan
-                
-            # 创建新的数据列表（原ROE数据 + 新指标）
-            enhanced_list = roe_list.copy()
-            enhanced_list.extend([pe_ratio, dividend_yield, pb_ratio, value_ratio, stockname])
+            if ROE_CACHE is not None:
+                found = {code: ranked_industries[code] for code in industry_requests if code in ranked_industries}
+                if found:
+                    ROE_CACHE.save_industries(found)
+        
+        print(f"流式处理完成: 通过估值筛选 {passed_count} 只，输出前 {len(ranked)} 名；{controller.summary()}")
+        return ranked, len(selected), passed_count, ranked_industries
+    finally:
+        background.shutdown(wait=False)
+        # 截止时间已到时排队的行业查询取消，在途的不再等待
+        enrich_pool.shutdown(wait=False, cancel_futures=True)
+        if controller is not None:
+            controller.close()
+
+
+def refresh_quotes(codes, state, max_age_days=QUOTE_MAX_AGE_DAYS):
+    """
+    增量模式下刷新估值：全市场快照 -> 按最新价换算上次的估值 -> 逐只查询
+    
+    Parameters:
+    codes (list): 股票代码
+    state (RunState): 上次运行状态，为 None 时全部按快照或逐只查询获取
+    max_age_days (float): 逐只查询的估值最多按股价换算多少天
+    
+    Returns:
+    dict: 股票代码为key，(市盈率, 股息率, 市净率, 名称) 为value
+    dict: 股票代码为key，(最新价, 估值获取时间) 为value，用于保存运行状态
+    """
+    run_metrics = get_run_metrics()
+    spot = fetch_spot()
+    prices = spot_prices(spot)
+    snapshot = get_quote_snapshot(spot=spot) if QUOTE_MODE == 'bulk' and spot is not None else {}
+    
+    now = time.time()
+    quotes, quote_info = {}, {}
+    from_snapshot = rescaled = reused = 0
+    to_fetch = []
+    for code in codes:
+        if code in snapshot:
+            quotes[code] = snapshot[code]
+            quote_info[code] = (prices.get(code), now)
+            from_snapshot += 1
+            continue
+        
+        previous = state.get(code) if state is not None else None
+        new_price = prices.get(code)
+        if (previous is None or previous.metrics is None or previous.quoted_at is None
+                or now - previous.quoted_at > max_age_days * 86400):
+            to_fetch.append(code)
+        elif new_price is None:
+            # 停牌等没有最新价的股票，估值与上次相同
+            quotes[code] = previous.metrics
+            quote_info[code] = (previous.price, previous.quoted_at)
+            reused += 1
+        elif previous.price:
+            quotes[code] = rescale_metrics(previous.metrics, previous.price, new_price)
+            quote_info[code] = (new_price, previous.quoted_at)
+            rescaled += 1
+        else:
+            to_fetch.append(code)
+    
+    print(f"估值刷新: 快照 {from_snapshot} 只，"
+          f"按股价换算 {rescaled} 只，沿用 {reused} 只，逐只查询 {len(to_fetch)} 只")
+    run_metrics.increment('quotes_rescaled', rescaled)
+    run_metrics.increment('quotes_reused', reused)
+    run_metrics.increment('quotes_fetched', len(to_fetch))
+    
+    if to_fetch:
+        fetched = fetch_stock_metrics(to_fetch)
+        for code in to_fetch:
+            metrics = fetched[code]
+            quotes[code] = metrics
+            # 查询失败的下次重新查询
+            ok = not all(isinstance(value, float) and np.isnan(value) for value in metrics)
+            quote_info[code] = (prices.get(code), now if ok else None)
+    if ROE_CACHE is not None:
+        ROE_CACHE.save_quotes(quotes)
+    return quotes, quote_info
+
+
+def run_incremental_pipeline(cache, top_n=REPORT_TOP_N, delta_path=DEFAULT_DELTA_PATH,
+                             max_quote_age_days=QUOTE_MAX_AGE_DAYS):
+    """
+    增量运行：读取上次运行状态，只重新获取最新一期ROE和估值，只为变化的股票重新打分，
+    排名后保存新的运行状态，并输出排名变化报告
+    
+    Parameters:
+    cache (ROECache): 本地缓存，运行状态保存在其中
+    top_n (int): 报告输出的名次数，排名变化也只比较前 top_n 名
+    delta_path (str): 排名变化报告路径，为空时不输出
+    max_quote_age_days (float): 逐只查询的估值最多按股价换算多少天
+    
+    Returns:
+    list: [(股票代码, 增强数据列表), ...]，按性价比从高到低
+    int: 通过 ROE 数据清洗的股票数量
+    int: 通过估值筛选的股票数量
+    """
+    run_metrics = get_run_metrics()
+    state = RunState.load(cache)
+    if state is None:
+        print("没有上次运行状态，本次全部重新获取")
+    else:
+        print(f"读取上次运行状态: {len(state)} 只股票，"
+              f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(state.finished_at))}")
+    rules = SCREEN_SPEC.fingerprint()
+    reuse_scores = state is not None and state.rules == rules
+    if state is not None and not reuse_scores:
+        print("选股规则与上次运行不同，全部重新打分")
+    
+    # 已结束披露的报告期（包括最新一期）由缓存提供，仍在披露中的按缓存 TTL 重新获取
+    years = list(REPORT_PERIODS)
+    panel, year_list = get_multi_year_ROE_panel(years)
+    selected, avg_roe = screen_ROE_panel(panel)
+    codes = selected.codes.tolist()
+    print(f"通过ROE筛选 {len(codes)}/{len(panel)} 只股票")
+    
+    with run_metrics.stage('quote_refresh'):
+        quotes, quote_info = refresh_quotes(codes, state, max_age_days=max_quote_age_days)
+    # 逐行输出的结果带上本地缓存中已知的行业
+    industries = cached_industries() if RESULT_STREAM is not None else {}
+    
+    # ROE 和估值都没变的股票沿用上次的性价比和名次，其余重新打分
+    with run_metrics.stage('scoring'):
+        entries = {}
+        unchanged, changed = [], []
+        rescored = 0
+        for order, code in enumerate(codes):
+            roe_list = selected.values[order].tolist() + [float(avg_roe[order])]
+            metrics = quotes[code]
+            previous = state.get(code) if state is not None else None
+            price, quoted_at = quote_info[code]
+            entry = StateEntry(roe_list, metrics, price, quoted_at)
+            entries[code] = entry
             
-            # 添加到结果字典
-            if not np.isnan(value_ratio):
-                '''       
-                # 市盈率 小于 200 
-                # 股息率 大于 0.1%  
-                # 市净率 小于33   '''    
-                
-                if pe_ratio < 200 and dividend_yield > 0.1 and pb_ratio < 33:
-                    enhanced_data[stock_code] = enhanced_list
-                    print(f"累计 {len(enhanced_data)} 符合标准: 最新的是{stockname}")
-                    
-                    # if success_count > 20:
-                    #     return enhanced_data, len(filtered_data), success_count
+            if (reuse_scores and previous is not None and same_values(previous.roe, roe_list)
+                    and same_values(previous.metrics, metrics)):
+                if previous.score is not None:
+                    entry.score = previous.score
+                    enhanced_list = roe_list + [*metrics[:3], previous.score, metrics[3]]
+                    unchanged.append((previous.rank, order, code, enhanced_list))
+                    if RESULT_STREAM is not None:
+                        RESULT_STREAM.write(code, enhanced_list, industry=industries.get(code))
+                continue
             
-        except Exception as e:
-            print(f"处理股票 {stock_code} 时出错: {str(e)}")
-            continue
+            rescored += 1
+            enhanced_list = score_stock(roe_list, metrics)
+            if enhanced_list is not None:
+                entry.score = enhanced_list[-2]
+                changed.append((order, code, enhanced_list))
+                if RESULT_STREAM is not None:
+                    RESULT_STREAM.write(code, enhanced_list, industry=industries.get(code))
+        print(f"重新打分 {rescored} 只，其余 {len(codes) - rescored} 只ROE和估值未变，沿用上次结果")
+        run_metrics.increment('scores_reused', len(codes) - rescored)
+    
+    # 上次的名次本身有序，只对变化的股票排序后归并；同分时按代码顺序，与 rank_stocks 一致
+    with run_metrics.stage('ranking'):
+        unchanged.sort(key=lambda item: item[0])
+        # 增强数据列表从末尾数：性价比为 [-2]，名称为 [-1]（长度随报告期数变化）
+        changed.sort(key=lambda item: (-item[2][-2], item[0]))
+        merged = heapq.merge(
+            ((-item[3][-2], item[1], item[2], item[3]) for item in unchanged),
+            ((-item[2][-2], item[0], item[1], item[2]) for item in changed),
+        )
+        ranked = [(code, enhanced_list) for _, _, code, enhanced_list in merged]
+        ranks = {}
+        for rank, (code, _) in enumerate(ranked, start=1):
+            entries[code].rank = rank
+            ranks[code] = rank
+    
+    if state is not None and delta_path:
+        delta = compute_delta(state.ranks(), ranks, set(codes), top_n)
+        names = {code: entry.metrics[3] for code, entry in state.entries.items() if entry.metrics}
+        names.update({code: data[-1] for code, data in ranked})
+        write_delta_report(delta, names, state.finished_at, delta_path, top_n=top_n)
+    
+    RunState(years, entries, rules=rules).save(cache)
+    print(f"已保存运行状态: {len(entries)} 只股票")
+    return ranked, len(codes), len(ranked)
 
-    success_count = len(enhanced_data)
-    return enhanced_data, len(filtered_data), success_count
+
+def run_sweep_pipeline(grid, top_n=DEFAULT_SWEEP_TOP_N, workers=None, output_filename=DEFAULT_SWEEP_PATH):
+    """
+    参数扫描：ROE 和估值只获取一次，对参数网格中的每个组合筛选、打分，并与 SCREEN_SPEC 比较
+    
+    Parameters:
+    grid (SweepGrid): 参数组合
+    top_n (int): 比较前几名
+    workers (int): 进程数，为 None 时取 CPU 核数
+    output_filename (str): 结果 CSV 路径，为空时不输出
+    
+    Returns:
+    list: 每个组合一行 dict，见 roe_sweep.run_sweep
+    """
+    run_metrics = get_run_metrics()
+    panel, year_list = get_multi_year_ROE_panel()
+    
+    # 任一组合（含基准）下通过ROE筛选的股票都需要估值，其余股票不参与扫描
+    with run_metrics.stage('sweep_prepare'):
+        env = roe_env(panel.values, panel.mean(), panel.min())
+        needed = SCREEN_SPEC.roe_mask(env)
+        for _, spec in grid.configs():
+            needed |= ScreenSpec(spec).roe_mask(env)
+    codes = panel.codes[needed].tolist()
+    print(f"{len(grid)} 个参数组合中任一组合通过ROE筛选的股票: {len(codes)}/{len(panel)} 只")
+    
+    quotes = get_quotes(codes)
+    missing = (np.nan,) * 4
+    env = {name: values[needed] for name, values in env.items()}
+    env.update(
+        pe=np.array([safe_convert(quotes.get(code, missing)[0]) for code in codes], dtype=np.float64),
+        dividend_yield=np.array([safe_convert(quotes.get(code, missing)[1]) for code in codes], dtype=np.float64),
+        pb=np.array([safe_convert(quotes.get(code, missing)[2]) for code in codes], dtype=np.float64),
+    )
+    eligible = np.array([is_valid_string(quotes.get(code, missing)[3]) for code in codes], dtype=bool)
+    
+    with run_metrics.stage('sweep'):
+        rows, base_result = run_sweep(env, eligible, SCREEN_SPEC, grid, top_n=top_n, workers=workers)
+    print_sweep_summary(rows, base_result, grid, top_n)
+    if output_filename:
+        write_csv(rows, sweep_columns(grid), output_filename)
+    return rows
+
+
+def load_service_dataset():
+    """
+    常驻服务的数据：ROE 面板（最新一期已年化、已按板块过滤）、估值和行业映射
+    
+    报告期按缓存规则更新（已完成的报告期读缓存，最新一期超过有效期后重新获取），
+    估值每次重新获取；快照中没有的股票只为通过当前ROE规则的逐只补齐。
+    
+    Returns:
+    ServiceDataset: 全部股票的数据
+    """
+    panel, year_list = get_multi_year_ROE_panel()
+    roe_mask = SCREEN_SPEC.roe_mask(roe_env(panel.values, panel.mean(), panel.min()))
+    quotes = get_quote_snapshot() if QUOTE_MODE == 'bulk' else {}
+    missing = [code for code in panel.codes[roe_mask].tolist() if code not in quotes]
+    if missing:
+        print(f"逐只查询 {len(missing)} 只股票...")
+        quotes.update(fetch_stock_metrics(missing))
+    industry_map = load_industry_map_bulk(ROE_CACHE)
+    return ServiceDataset(panel.codes.tolist(), year_list, panel.values, quotes, industry_map)
+
+
+def parse_args(argv=None):
+    """
+    命令行参数
+    """
+    parser = argparse.ArgumentParser(description="沪深A股 ROE + 估值 选股")
+    parser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH,
+                        help="报告期缓存文件路径")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_TTL_HOURS,
+                        help="未完成报告期的缓存有效时长（小时）")
+    parser.add_argument("--refresh-cache", action="store_true",
+                        help="忽略已有缓存，重新获取全部报告期并覆盖缓存")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help="运行前清空缓存")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="不使用本地缓存")
+    parser.add_argument("--offline", action="store_true",
+                        help="离线模式：只用本地缓存中的报告期、证券主表、估值和行业做筛选、排名和报告，"
+                             "不访问网络、不导入 akshare（可与 --sweep、--screen-spec 一起使用）")
+    parser.add_argument("--stream", action="store_true",
+                        help="流式模式：ROE筛选、估值查询、排名和行业查询重叠执行；"
+                             "只保留前 REPORT_TOP_N 名，指定 --full-results 或 --parquet-out 时保留全部打分结果")
+    parser.add_argument("--resume", action="store_true",
+                        help="读回上次的运行日志，只请求缺失或已过期的数据")
+    parser.add_argument("--journal-path", default=DEFAULT_JOURNAL_PATH,
+                        help="运行日志路径")
+    parser.add_argument("--journal-max-age", type=float, default=DEFAULT_MAX_AGE_HOURS,
+                        help="续跑时运行日志中估值数据的有效时长（小时）")
+    parser.add_argument("--no-journal", action="store_true",
+                        help="不写运行日志")
+    parser.add_argument("--data-source", choices=["live", "record", "replay"], default="live",
+                        help="live 直接调用akshare；record 调用akshare并录制返回；replay 从录制文件回放")
+    parser.add_argument("--record-dir", default=DEFAULT_RECORD_DIR,
+                        help="录制/回放文件目录")
+    parser.add_argument("--replay-latency", type=float, default=0.0,
+                        help="回放时每次调用的基础延迟（秒）")
+    parser.add_argument("--replay-jitter", type=float, default=0.0,
+                        help="回放时附加的随机延迟上限（秒）")
+    parser.add_argument("--replay-error-rate", type=float, default=0.0,
+                        help="回放时每次调用模拟网络错误的概率")
+    parser.add_argument("--replay-rate-limit", type=float, default=None,
+                        help="回放时每秒最多处理的请求数，超出按 --replay-throttle 处理")
+    parser.add_argument("--replay-max-concurrency", type=int, default=None,
+                        help="回放时同时在途的请求数上限")
+    parser.add_argument("--replay-throttle", choices=["error", "delay"], default="error",
+                        help="回放超限时抛出限流错误还是排队等待")
+    parser.add_argument("--replay-seed", type=int, default=None,
+                        help="回放随机数种子，用于复现同一错误序列")
+    parser.add_argument("--http-pool-size", type=int, default=DEFAULT_POOL_SIZE,
+                        help="每个主机保留的 keep-alive 连接数")
+    parser.add_argument("--http-connect-timeout", type=float, default=DEFAULT_CONNECT_TIMEOUT,
+                        help="HTTP 连接超时（秒），akshare 接口自身指定超时时不使用")
+    parser.add_argument("--http-read-timeout", type=float, default=DEFAULT_READ_TIMEOUT,
+                        help="HTTP 读取超时（秒），akshare 接口自身指定超时时不使用")
+    parser.add_argument("--no-http-pool", action="store_true",
+                        help="不使用共享连接池，每次请求新建连接（akshare 原来的行为）")
+    parser.add_argument("--quote-mode", choices=["bulk", "xq"], default=QUOTE_MODE,
+                        help="估值数据来源：bulk 全市场快照（缺失的逐只补齐），xq 全部逐只查询雪球")
+    parser.add_argument("--call-timeout", type=float, default=METRICS_CALL_TIMEOUT,
+                        help="逐只查询估值时单次请求的超时（秒），超时按失败处理并进入重试队列")
+    parser.add_argument("--hedge-budget", type=float, default=HEDGE_BUDGET,
+                        help="对冲请求数占请求数的比例上限，为 0 时不发对冲请求")
+    parser.add_argument("--hedge-quantile", type=float, default=HEDGE_QUANTILE,
+                        help="请求超过近期延迟的这一分位数仍未返回时发出对冲请求")
+    parser.add_argument("--deadline", action="append", default=[], metavar="STAGE=SECONDS",
+                        help=f"阶段截止时间，可重复，阶段为 {' / '.join(DEADLINE_STAGES)}；"
+                             f"到期后用已有结果结束该阶段，未完成的股票写入输出和运行指标")
+    parser.add_argument("--incremental", action="store_true",
+                        help="增量模式：读取上次运行状态，只重新获取最新一期ROE和估值，并输出排名变化（需要本地缓存）")
+    parser.add_argument("--delta-out", default=DEFAULT_DELTA_PATH,
+                        help="增量模式下排名变化报告的输出路径，为空时不输出")
+    parser.add_argument("--quote-max-age", type=float, default=QUOTE_MAX_AGE_DAYS,
+                        help="增量模式下逐只查询的估值最多按股价换算多少天，超过后重新查询")
+    parser.add_argument("--backtest", action="store_true",
+                        help="历史回测：在每个季度末按当时可得的数据重放选股，输出排名和前瞻收益")
+    parser.add_argument("--backtest-start", default=DEFAULT_BACKTEST_START,
+                        help="回测开始年份 YYYY 或日期 YYYYMMDD")
+    parser.add_argument("--backtest-end", default=None,
+                        help="回测结束日期 YYYYMMDD，默认为今天")
+    parser.add_argument("--backtest-top-n", type=int, default=DEFAULT_BACKTEST_TOP_N,
+                        help="回测每个日期输出的名次数")
+    parser.add_argument("--backtest-horizons", default=",".join(str(h) for h in DEFAULT_HORIZONS),
+                        help="前瞻收益的持有期（季度），逗号分隔")
+    parser.add_argument("--backtest-out", default=DEFAULT_BACKTEST_DIR,
+                        help="回测结果输出目录")
+    parser.add_argument("--screen-spec", default=None,
+                        help="选股规则 JSON 文件（roe_filter / value_filter / score 表达式），默认使用内置规则")
+    parser.add_argument("--sweep", action="store_true",
+                        help="参数扫描：数据只获取一次，对参数网格中的每个组合筛选、打分，并与当前规则比较")
+    parser.add_argument("--sweep-spec", default=None,
+                        help="参数扫描的规则模板和参数网格 JSON 文件，默认使用内置网格")
+    parser.add_argument("--sweep-param", action="append", default=[], metavar="NAME=V1,V2,...",
+                        help="替换参数网格中的一个参数，可重复，例如 --sweep-param pe_max=50,100,200")
+    parser.add_argument("--sweep-top-n", type=int, default=DEFAULT_SWEEP_TOP_N,
+                        help="参数扫描时比较前几名")
+    parser.add_argument("--sweep-workers", type=int, default=None,
+                        help="参数扫描的进程数，默认为 CPU 核数，为 1 时不启动进程池")
+    parser.add_argument("--sweep-out", default=DEFAULT_SWEEP_PATH,
+                        help="参数扫描结果 CSV 路径")
+    parser.add_argument("--serve", action="store_true",
+                        help="常驻服务：数据加载到内存并在后台定时刷新，通过本地 HTTP/JSON 接口查询排名")
+    parser.add_argument("--serve-host", default=DEFAULT_SERVICE_HOST,
+                        help="服务监听地址")
+    parser.add_argument("--serve-port", type=int, default=DEFAULT_SERVICE_PORT,
+                        help="服务监听端口")
+    parser.add_argument("--serve-refresh", type=float, default=DEFAULT_REFRESH_MINUTES,
+                        help="服务后台刷新数据的间隔（分钟），为 0 时不刷新")
+    parser.add_argument("--csv-out", default=DEFAULT_CSV_PATH,
+                        help="排名结果写入标准 CSV，为空时不输出；默认为报告的前 REPORT_TOP_N 名，"
+                             "指定 --full-results 或 --parquet-out 时为全部通过筛选的股票")
+    parser.add_argument("--parquet-out", default=None,
+                        help="全部通过筛选的股票写入带类型的列式文件（.parquet 或 .arrow，需要 pyarrow）")
+    parser.add_argument("--full-results", action="store_true",
+                        help="保留全部通过筛选的股票并写入 CSV（默认只保留报告需要的前 REPORT_TOP_N 名：部分排序，"
+                             "流式模式内存有界）")
+    parser.add_argument("--jsonl-out", default=None,
+                        help="每只股票打分完成时追加一行的 JSON Lines 文件，运行中即可读取")
+    parser.add_argument("--metrics-out", default=DEFAULT_METRICS_PATH,
+                        help="运行指标（各阶段耗时、接口调用统计）的 JSON 输出路径，为空时不输出")
+    parser.add_argument("--progress-interval", type=float, default=DEFAULT_PROGRESS_INTERVAL,
+                        help="逐只查询时进度输出的最小间隔（秒）")
+    args = parser.parse_args(argv)
+    if args.incremental and args.no_cache:
+        parser.error("--incremental 需要本地缓存，不能与 --no-cache 同时使用")
+    if args.offline:
+        for flag in ("no_cache", "refresh_cache", "clear_cache", "stream", "incremental", "backtest", "serve"):
+            if getattr(args, flag):
+                parser.error(f"--offline 不能与 --{flag.replace('_', '-')} 同时使用")
+        if args.data_source != "live":
+            parser.error("--offline 不能与 --data-source 同时使用")
+    deadlines = {}
+    for item in args.deadline:
+        stage, _, seconds = item.partition('=')
+        try:
+            deadlines[stage.strip()] = float(seconds)
+        except ValueError:
+            parser.error(f"--deadline 格式应为 STAGE=SECONDS: {item}")
+        if stage.strip() not in DEADLINE_STAGES:
+            parser.error(f"--deadline 不支持的阶段: {stage}（可用: {', '.join(DEADLINE_STAGES)}）")
+    args.deadline = deadlines
+    return args
+
+
+def setup_cache(args):
+    """
+    根据命令行参数创建全局报告期缓存
+    """
+    global ROE_CACHE
+    if args.no_cache:
+        ROE_CACHE = None
+        return None
+    # 离线时未完成的报告期超过有效期也直接使用
+    ttl_hours = float('inf') if args.offline else args.cache_ttl
+    ROE_CACHE = ROECache(args.cache_path, ttl_hours=ttl_hours, refresh=args.refresh_cache)
+    if args.clear_cache:
+        ROE_CACHE.clear()
+        print(f"已清空缓存: {args.cache_path}")
+    return ROE_CACHE
+
+
+def write_report(ranked, original_count, passed_count, industry_map,
+                 output_filename="stock_analysis_results.txt", top_n=REPORT_TOP_N):
+    """
+    把排名结果写入文本报告
+    
+    Parameters:
+    ranked (list): 按名次排好的 [(股票代码, 增强数据列表), ...]
+    original_count (int): 通过ROE清洗的股票数量
+    passed_count (int): 通过估值筛选的股票数量
+    industry_map (dict): 股票代码 -> 行业，写入过程不访问网络
+    """
+    value_rules = None if SCREEN_SPEC.is_default() else SCREEN_SPEC.describe_value_filter()
+    write_text_report(ranked, original_count, passed_count, industry_map, output_filename, top_n,
+                      value_rules=value_rules, periods=REPORT_PERIODS)
+
+
+def write_full_results(ranked, industry_map, csv_path=None, columnar_path=None, periods=None):
+    """
+    ranked 中的股票写入 CSV / Parquet（保留全部结果时不限于报告的前 REPORT_TOP_N 名）
+    
+    Parameters:
+    ranked (list): 按名次排好的 [(股票代码, 增强数据列表), ...]
+    industry_map (dict): 股票代码 -> 行业；报告之外的股票用本地缓存的行业板块映射补充
+    csv_path (str): CSV 输出路径，为空时不输出
+    columnar_path (str): .parquet / .arrow 输出路径，为空时不输出
+    periods (list): 报告期列表，默认为 REPORT_PERIODS
+    """
+    periods = list(periods or REPORT_PERIODS)
+    if len(ranked) > len(industry_map):
+        # 只用本地缓存，不为报告之外的股票逐只查询行业
+        industry_map = {**cached_industries(), **industry_map}
+    columns = result_columns(periods)
+    if csv_path:
+        write_csv(result_rows(ranked, periods, industry_map), columns, csv_path)
+    if columnar_path:
+        write_columnar(result_rows(ranked, periods, industry_map), columns, columnar_path)
+
+
+def setup_data_source(args):
+    """
+    根据命令行参数设置全局数据源
+    """
+    if args.offline:
+        source = OfflineDataSource()
+    elif args.data_source == "record":
+        source = RecordingDataSource(LiveDataSource(), args.record_dir)
+    elif args.data_source == "replay":
+        source = ReplayDataSource(
+            args.record_dir, latency=args.replay_latency, jitter=args.replay_jitter,
+            error_rate=args.replay_error_rate, rate_limit=args.replay_rate_limit,
+            max_concurrency=args.replay_max_concurrency, throttle_mode=args.replay_throttle,
+            seed=args.replay_seed,
+        )
+    else:
+        source = LiveDataSource()
+    # 访问网络时，akshare 的请求走共享的 keep-alive 连接池
+    if args.data_source != "replay" and not args.offline and not args.no_http_pool:
+        install_http_pool(HTTPPool(pool_size=args.http_pool_size, connect_timeout=args.http_connect_timeout,
+                                   read_timeout=args.http_read_timeout))
+    # 所有接口调用都记入运行指标
+    set_data_source(InstrumentedDataSource(source, get_run_metrics()))
+    return source
+
+
+def setup_result_stream(args):
+    """
+    根据命令行参数创建 JSON Lines 结果输出
+    """
+    global RESULT_STREAM
+    RESULT_STREAM = JsonLinesWriter(args.jsonl_out, REPORT_PERIODS) if args.jsonl_out else None
+    return RESULT_STREAM
+
+
+def setup_journal(args):
+    """
+    根据命令行参数创建全局运行日志
+    """
+    global RUN_JOURNAL
+    # 离线时不请求数据，也就没有要记录的
+    if args.no_journal or args.offline:
+        RUN_JOURNAL = None
+        return None
+    RUN_JOURNAL = RunJournal(args.journal_path, resume=args.resume, max_age_hours=args.journal_max_age)
+    return RUN_JOURNAL
 
 
 # 使用示例 - 详细版本
 if __name__ == "__main__":
-    enhanced_data, original_count, success_count = append_pb()
-    
-    if enhanced_data:
-        # 可以按性价比排序
-        sorted_stocks = sorted(
-            [(code, data[10]) for code, data in enhanced_data.items() if not np.isnan(data[10])],
-            key=lambda x: x[1],
-            reverse=True
-        )
-        
-        print(f"\n性价比最高的前100只股票:")
-        for i, (code, value_ratio) in enumerate(sorted_stocks[:100]):
-            print(f"{i+1}. {code}: {value_ratio:.3f}")
-        
-        # 输出到txt文件
-        output_filename = "stock_analysis_results.txt"
+    args = parse_args()
+    set_progress_interval(args.progress_interval)
+    data_source = setup_data_source(args)
+    setup_cache(args)
+    setup_journal(args)
+    setup_result_stream(args)
+    QUOTE_MODE = args.quote_mode
+    OFFLINE = args.offline
+    METRICS_CALL_TIMEOUT = args.call_timeout
+    HEDGE_BUDGET = args.hedge_budget
+    HEDGE_QUANTILE = args.hedge_quantile
+    if args.no_http_pool and args.data_source != "replay" and not args.offline:
+        HEDGING = False
+        print("未使用连接池，逐只查询不发对冲请求、不加单次超时")
+    STAGE_DEADLINES = args.deadline
+    if args.screen_spec:
+        SCREEN_SPEC = ScreenSpec.from_file(args.screen_spec)
+        print(f"选股规则: {args.screen_spec}")
+    run_status = 'failed'
+    # 保留全部结果需要显式指定（列式文件总是输出全部）；否则只保留报告需要的前 REPORT_TOP_N 名，
+    # CSV 也只有这些行
+    full_output = bool(args.full_results or args.parquet_out)
+    try:
+        try:
+            if args.backtest:
+                master = get_securities_master()
+                run_backtest(
+                    args.backtest_start, args.backtest_end, top_n=args.backtest_top_n,
+                    horizons=tuple(int(h) for h in args.backtest_horizons.split(",") if h),
+                    cache=ROE_CACHE, out_dir=args.backtest_out,
+                    names={code: record[2] for code, record in master.records.items()},
+                    spec=SCREEN_SPEC,
+                )
+                ranked = []
+            elif args.serve:
+                service = ScreenService(load_service_dataset, SCREEN_SPEC,
+                                        refresh_interval=args.serve_refresh * 60)
+                service.serve(args.serve_host, args.serve_port)
+                ranked = []
+            elif args.sweep:
+                try:
+                    grid = SweepGrid.from_file(args.sweep_spec) if args.sweep_spec else SweepGrid()
+                    grid.override(args.sweep_param)
+                    grid.validate()
+                except ValueError as e:
+                    print(f"参数扫描设置有误: {e}")
+                    raise SystemExit(2)
+                run_sweep_pipeline(grid, top_n=args.sweep_top_n,
+                                   workers=args.sweep_workers, output_filename=args.sweep_out)
+                ranked = []
+            elif args.incremental:
+                ranked, original_count, passed_count = run_incremental_pipeline(
+                    ROE_CACHE, delta_path=args.delta_out, max_quote_age_days=args.quote_max_age)
+                industry_map = None
+            elif args.stream:
+                ranked, original_count, passed_count, industry_map = run_stream_pipeline(keep_all=full_output)
+            else:
+                enhanced_data, original_count, success_count = append_pb()
+                # 可以按性价比排序；不输出全部结果时只选出报告需要的前 REPORT_TOP_N 名
+                ranked = rank_stocks(enhanced_data, top_k=None if full_output else REPORT_TOP_N)
+                passed_count = len(enhanced_data)
+                industry_map = None
+        except ROEFetchError as e:
+            print(f"ROE数据获取失败，终止运行: {e}")
+            raise SystemExit(1)
         
-        with open(output_filename, 'w', encoding='utf-8') as f:
-            # 写入文件头信息
-            f.write("=" * 80 + "\n")
-            f.write("股票分析结果 - 按性价比排序\n")
-            f.write("=" * 80 + "\n")
-            f.write(f"分析时间: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"总股票数量: {original_count} (沪深: 持续五年盈利， 平均ROE大于3% )  \n")
-            f.write(f"筛选后股票数量: {len(enhanced_data)} (市盈率 小于 200 ; 股息率 大于 0.1% ;  市净率 小于33  ) \n")   
-            f.write(f"输出排名1500只股票\n")
-            f.write("=" * 80 + "\n\n")
+        if ranked:
+            print(f"\n性价比最高的前100只股票:")
+            for i, (code, data) in enumerate(ranked[:100]):
+                print(f"{i+1}. {code}: {data[-2]:.3f}")
             
-            # 写入表头
-            f.write("排名,代码,公司名称,行业,ROE20年报,ROE21年报,ROE22年报,ROE23年报,ROE24年报,ROE25半年报,,平均ROE,,市盈率动,,股息率TTM,,市净率,,性价比\n")
+            # 写文件前批量准备行业信息，写入过程不再访问网络
+            if industry_map is None:
+                industry_map = resolve_industries([code for code, _ in ranked[:REPORT_TOP_N]])
             
-            # 写入前1500个结果
-            for i, (code, value_ratio) in enumerate(sorted_stocks[:1500]):
-                if code in enhanced_data:
-                    data = enhanced_data[code]
-                    company_name = data[11] if len(data) > 11 else "未知公司"
-                    company_hangye = get_hangye(code)
-                    
-                    # 格式化数据行
-                    row_data = [
-                        f"{i+1}",  # 排名
-                        "'"+str(code),  # 代码
-                        str(company_name),  # 公司名称
-                        str(company_hangye),  # 公司行业
-                        *[f"{x:.2f}" if not np.isnan(x) else "NaN" for x in data[:6]],  # ROE2020-ROE2024 + 2025
-                        f"平均,{data[6]:.2f}" if not np.isnan(data[6]) else "NaN",  # 平均ROE
-                        f"市盈,{data[7]:.2f}" if not np.isnan(data[7]) else "NaN",  # 市盈率
-                        f"股息,{data[8]:.2f}" if not np.isnan(data[8]) else "NaN",  # 股息率
-                        f"市净,{data[9]:.2f}" if not np.isnan(data[9]) else "NaN",  # 市净率
-                        f"价值,{data[10]:.3f}" if not np.isnan(data[10]) else "NaN"   # 性价比
-                    ]
-                    
-                    # 写入文件
-                    f.write(",".join(row_data) + "\n")
-        
-        print(f"\n结果已保存到文件: {output_filename}")
+            # 输出到txt文件
+            with get_run_metrics().stage('report_write'):
+                write_report(ranked, original_count, passed_count, industry_map)
+                write_full_results(ranked, industry_map, csv_path=args.csv_out,
+                                   columnar_path=args.parquet_out)
+        run_status = 'ok'
+    finally:
+        if RESULT_STREAM is not None:
+            RESULT_STREAM.close()
+        if RUN_JOURNAL is not None:
+            RUN_JOURNAL.close()
+        # 失败的运行也写出指标，便于排查卡在哪个阶段
+        print(get_run_metrics().summary())
+        http_pool = get_http_pool()
+        if http_pool is not None:
+            print(http_pool.summary())
+        # 启动开销：模块导入、akshare 导入（离线或只读缓存时不导入）和峰值内存
+        ak_seconds, peak_mb = akshare_import_seconds(), peak_memory_mb()
+        print(f"模块导入 {IMPORT_SECONDS:.2f}s，"
+              + ("未导入 akshare" if ak_seconds is None else f"akshare 导入 {ak_seconds:.2f}s")
+              + ("" if peak_mb is None else f"，峰值内存 {peak_mb:.0f} MB"))
+        startup = {'import_seconds': IMPORT_SECONDS, 'akshare_import_seconds': ak_seconds,
+                   'peak_memory_mb': peak_mb}
+        if args.metrics_out:
+            get_run_metrics().write_json(
+                args.metrics_out, status=run_status, args=vars(args),
+                replay=data_source.summary() if isinstance(data_source, ReplayDataSource) else None,
+                http=http_pool.stats() if http_pool is not None else None,
+                startup=startup,
+            )
+    
+    if isinstance(data_source, ReplayDataSource):
+        print(data_source.summary())
 
         
 # if __name__ == "__main__":   # 调试用
@@ -0,0 +1,466 @@
+# -*- coding: utf-8 -*-
+"""
+历史回测（按时点）
+
+在回测区间内的每个季度末，用当时已经可以获得的数据重放 ROE + 估值 选股：
+  - 报告期以法定披露截止日为准：截止日之前的报告期才视为可用
+    （例如 6月30日 可用 一季报和上一年年报，9月30日 可用 半年报）
+  - ROE 取当时最新一期报告 + 之前 5 个年报，最新一期按报告期换算成全年
+    （一季报 / 1 * 4，半年报 / 2 * 4，三季报 / 3 * 4）
+  - 市盈率 = 月末收盘价 / 最新一期年化每股收益，市净率 = 收盘价 / 最新一期每股净资产，
+    股息率 = 该日之前一年内除权除息的每股现金分红 / 收盘价
+  - 前瞻收益用后复权月线收盘价计算
+
+数据只获取一次并保存在本地缓存中：各报告期业绩报表（与选股共用缓存）、分红方案、
+通过过ROE筛选的股票的月线。筛选和排名对 股票 x 日期 的矩阵一次完成，
+不按日期逐只重跑。
+"""
+
+import concurrent.futures
+import datetime
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from roe_cache import period_deadline
+from roe_datasource import get_data_source
+from roe_master import classify_code, EXCLUDED_BOARDS
+from roe_metrics import get_run_metrics, progress
+from roe_output import write_csv
+from roe_panel import ROEPanel, annualize, reported_quarters
+from roe_rules import ScreenSpec, roe_env, top_k_indices
+from roe_quotes import fetch_with_retry, FHPS_CODE, FHPS_CASH, FHPS_EX_DATE
+from roe_throttle import RateController
+
+DEFAULT_BACKTEST_DIR = "backtest"
+DEFAULT_BACKTEST_START = "2010"
+DEFAULT_BACKTEST_TOP_N = 50
+# 前瞻收益的持有期（季度）
+DEFAULT_HORIZONS = (1, 2, 4)
+# 与最新一期一起参与筛选的年报数
+ANNUAL_COUNT = 5
+
+# 业绩报表的列名
+YJBB_CODE = '股票代码'
+YJBB_ROE = '净资产收益率'
+YJBB_EPS = '每股收益'
+YJBB_BVPS = '每股净资产'
+
+# 月线的列名
+HIST_DATE = '日期'
+HIST_CLOSE = '收盘'
+
+# 月线下载的限速与并发
+PRICE_RATE = 10.0
+PRICE_WORKERS = 8
+
+
+def fundamentals_from_yjbb(df):
+    """
+    业绩报表中的每股收益、每股净资产
+
+    Returns:
+    dict: 股票代码为key，(每股收益, 每股净资产) 为value；缺少相应列时返回空字典
+    """
+    if df is None or df.empty or YJBB_EPS not in df or YJBB_BVPS not in df:
+        return {}
+    eps = pd.to_numeric(df[YJBB_EPS], errors='coerce')
+    bvps = pd.to_numeric(df[YJBB_BVPS], errors='coerce')
+    return {str(code): (float(e), float(b)) for code, e, b in zip(df[YJBB_CODE], eps, bvps)}
+
+
+def _to_date(value):
+    return datetime.datetime.strptime(str(value), "%Y%m%d").date()
+
+
+def quarter_end_dates(start, end=None):
+    """
+    [start, end] 内的季度末日期
+
+    Parameters:
+    start (str): 开始年份 YYYY 或日期 YYYYMMDD
+    end (str): 结束日期 YYYYMMDD，默认为今天
+
+    Returns:
+    list: ['20100331', '20100630', ...]
+    """
+    start = _to_date(start + "0101" if len(start) == 4 else start)
+    end = _to_date(end) if end else datetime.date.today()
+    dates = []
+    for year in range(start.year, end.year + 1):
+        for month_day in ('0331', '0630', '0930', '1231'):
+            date = _to_date(f"{year}{month_day}")
+            if start <= date <= end:
+                dates.append(f"{year}{month_day}")
+    return dates
+
+
+def latest_available_period(date):
+    """
+    date 时已过披露截止日的最新报告期
+
+    例如 '20250630' -> '20250331'，'20250930' -> '20250630'，'20251231' -> '20250930'
+    """
+    day = _to_date(date)
+    year = day.year
+    for candidate in (f"{year}0930", f"{year}0630", f"{year}0331", f"{year - 1}1231",
+                      f"{year - 1}0930", f"{year - 1}0630"):
+        if period_deadline(candidate) <= day:
+            return candidate
+    raise ValueError(f"无法确定 {date} 时的最新报告期")
+
+
+def point_in_time_periods(date, annual_count=ANNUAL_COUNT):
+    """
+    date 时参与筛选的报告期：之前的 annual_count 个年报 + 最新一期
+
+    例如 '20251231' -> ['20201231', ..., '20241231', '20250930']，与 REPORT_PERIODS 一致
+    """
+    latest = latest_available_period(date)
+    last_annual_year = int(latest[:4]) - 1
+    return [f"{year}1231" for year in range(last_annual_year - annual_count + 1, last_annual_year + 1)] + [latest]
+
+
+def load_period(period, cache=None):
+    """
+    报告期的 ROE 和 每股收益/每股净资产，优先读缓存，缺失时获取业绩报表并写入缓存
+
+    Returns:
+    dict: 股票代码 -> ROE
+    dict: 股票代码 -> (每股收益, 每股净资产)
+    """
+    roe = cache.load_period(period) if cache is not None else None
+    fundamentals = cache.load_fundamentals(period) if cache is not None else None
+    if roe is not None and fundamentals is not None:
+        return roe, fundamentals
+
+    df = fetch_with_retry(get_data_source().stock_yjbb_em, period)
+    if df is None or df.empty:
+        print(f"{period} 业绩报表为空")
+        return {}, {}
+    roe = dict(zip(df[YJBB_CODE].astype(str), df[YJBB_ROE]))
+    fundamentals = fundamentals_from_yjbb(df)
+    if cache is not None:
+        cache.save_period(period, roe)
+        cache.save_fundamentals(period, fundamentals)
+    return roe, fundamentals
+
+
+def load_dividend_plans(period, cache=None):
+    """
+    报告期的分红方案，优先读缓存
+
+    Returns:
+    list: [(股票代码, 每10股派现, 除权除息日 YYYY-MM-DD 或 None), ...]
+    """
+    plans = cache.load_dividend_plans(period) if cache is not None else None
+    if plans is not None:
+        return plans
+    try:
+        df = fetch_with_retry(get_data_source().stock_fhps_em, period)
+    except Exception as e:
+        print(f"获取 {period} 分红方案失败: {e}")
+        return []
+    plans = []
+    if df is not None and not df.empty and FHPS_CASH in df and FHPS_EX_DATE in df:
+        cash = pd.to_numeric(df[FHPS_CASH], errors='coerce')
+        ex_dates = pd.to_datetime(df[FHPS_EX_DATE], errors='coerce')
+        plans = [(str(code), None if np.isnan(c) else float(c),
+                  None if pd.isna(ex) else ex.strftime('%Y-%m-%d'))
+                 for code, c, ex in zip(df[FHPS_CODE], cash, ex_dates)]
+    if cache is not None:
+        cache.save_dividend_plans(period, plans)
+    return plans
+
+
+def _fetch_monthly(code, start_month, controller):
+    """一只股票的月线：不复权收盘价（算估值）和后复权收盘价（算收益）"""
+    start_date = f"{start_month}01"
+    end_date = datetime.date.today().strftime("%Y%m%d")
+    closes = {}
+    for adjust in ('', 'hfq'):
+        df = controller.call(get_data_source().stock_zh_a_hist, code, 'monthly', start_date, end_date, adjust)
+        if df is None or df.empty:
+            continue
+        months = pd.to_datetime(df[HIST_DATE], errors='coerce').dt.strftime('%Y%m')
+        for month, close in zip(months, pd.to_numeric(df[HIST_CLOSE], errors='coerce')):
+            if isinstance(month, str):
+                closes.setdefault(month, [np.nan, np.nan])[0 if adjust == '' else 1] = float(close)
+    return [(month, close, close_adj) for month, (close, close_adj) in sorted(closes.items())]
+
+
+def load_monthly_prices(codes, start_month, end_month, cache=None, max_workers=PRICE_WORKERS):
+    """
+    月线收盘价；缓存中已覆盖到 end_month、或在 TTL 内获取过的股票不再请求
+
+    Returns:
+    dict: 股票代码为key，[(月份 YYYYMM, 收盘价, 后复权收盘价), ...] 为value；获取失败的股票不包含在内
+    """
+    cached = cache.load_monthly_prices() if cache is not None else {}
+    now = time.time()
+    prices, to_fetch = {}, []
+    for code in codes:
+        entry = cached.get(code)
+        if entry is not None and not cache.refresh:
+            fetched_at, last_month, rows = entry
+            if (last_month or '') >= end_month or now - fetched_at < cache.ttl_hours * 3600:
+                prices[code] = rows
+                continue
+        to_fetch.append(code)
+    print(f"月线: 缓存命中 {len(prices)} 只，需要获取 {len(to_fetch)} 只")
+    if not to_fetch:
+        return prices
+
+    controller = RateController(rate=PRICE_RATE, initial=max_workers, minimum=2, maximum=max_workers)
+    reporter = progress("获取月线", total=len(to_fetch))
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_fetch_monthly, code, start_month, controller): code for code in to_fetch}
+        for future in concurrent.futures.as_completed(futures):
+            code = futures[future]
+            try:
+                rows = future.result()
+            except Exception:
+                failed.append(code)
+                reporter.update(failed=1)
+                continue
+            prices[code] = rows
+            if cache is not None and rows:
+                cache.save_monthly_prices(code, rows)
+            reporter.update()
+    reporter.close()
+    if failed:
+        print(f"{len(failed)} 只股票的月线获取失败，这些股票的估值和收益为 NaN；{controller.summary()}")
+    return prices
+
+
+def _month_index(month, first_month):
+    return (int(month[:4]) - int(first_month[:4])) * 12 + int(month[4:6]) - int(first_month[4:6])
+
+
+def _align(panel, codes):
+    """把面板的行对齐到 codes（已排序），缺失的股票为 NaN"""
+    out = np.full((len(codes), len(panel.periods)), np.nan)
+    if len(panel):
+        pos = np.searchsorted(panel.codes, codes)
+        pos = np.minimum(pos, len(panel.codes) - 1)
+        found = panel.codes[pos] == codes
+        out[found] = panel.values[pos[found]]
+    return out
+
+
+def _nan_mean_min(values, axis):
+    """忽略 NaN 的均值和最小值，与 ROEPanel.mean / min 一致"""
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=axis)
+    total = np.where(valid, values, 0.0).sum(axis=axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, total / np.maximum(count, 1), np.nan)
+    minimum = np.where(valid, values, np.inf).min(axis=axis)
+    return mean, np.where(count > 0, minimum, np.nan)
+
+
+def dividend_ttm_matrix(plans, codes, dates):
+    """
+    每个日期之前一年内除权除息的每股现金分红
+
+    Parameters:
+    plans (list): [(股票代码, 每10股派现, 除权除息日), ...]，同一方案可重复出现
+    codes (np.ndarray): 已排序的股票代码
+    dates (list): 日期 YYYYMMDD，已排序
+
+    Returns:
+    np.ndarray: 形状 (股票数, 日期数)
+    """
+    day_index = np.array([np.datetime64(_to_date(date)) for date in dates])
+    plans = {(code, ex_date): cash for code, cash, ex_date in plans
+             if cash is not None and ex_date is not None and not np.isnan(cash)}
+    diff = np.zeros((len(codes), len(dates) + 1))
+    if not plans:
+        return diff[:, :-1]
+    plan_codes = np.array([code for code, _ in plans], dtype=str)
+    ex_dates = np.array([np.datetime64(ex_date) for _, ex_date in plans])
+    cash = np.array(list(plans.values())) / 10
+
+    rows = np.minimum(np.searchsorted(codes, plan_codes), max(len(codes) - 1, 0))
+    known = (codes[rows] == plan_codes) if len(codes) else np.zeros(len(plan_codes), dtype=bool)
+    # 方案计入 ex_date <= 日期 < ex_date + 365 天 的各日期
+    start = np.searchsorted(day_index, ex_dates, side='left')
+    end = np.searchsorted(day_index, ex_dates + np.timedelta64(365, 'D'), side='left')
+    np.add.at(diff, (rows[known], start[known]), cash[known])
+    np.add.at(diff, (rows[known], end[known]), -cash[known])
+    return np.cumsum(diff, axis=1)[:, :-1]
+
+
+def run_backtest(start=DEFAULT_BACKTEST_START, end=None, top_n=DEFAULT_BACKTEST_TOP_N,
+                 horizons=DEFAULT_HORIZONS, cache=None, out_dir=DEFAULT_BACKTEST_DIR, names=None,
+                 spec=None):
+    """
+    在每个季度末按时点重放选股，输出排名和前瞻收益
+
+    Parameters:
+    start (str): 开始年份 YYYY 或日期 YYYYMMDD
+    end (str): 结束日期 YYYYMMDD，默认为今天
+    top_n (int): 每个日期输出的名次数
+    horizons (tuple): 前瞻收益的持有期（季度）
+    cache (ROECache): 本地缓存
+    out_dir (str): 输出目录
+    names (dict): 股票代码 -> 名称，只用于输出
+    spec (ScreenSpec): 选股规则，与 score_stock 使用同一份；默认为内置规则
+
+    Returns:
+    dict: 持有期（季度）为key，(前 top_n 名平均收益, 通过ROE筛选的股票平均收益) 在各日期上的均值
+    """
+    run_metrics = get_run_metrics()
+    names = names or {}
+    spec = spec or ScreenSpec()
+    dates = quarter_end_dates(start, end)
+    if not dates:
+        raise ValueError(f"回测区间内没有季度末: {start} ~ {end}")
+    date_periods = [point_in_time_periods(date) for date in dates]
+    periods = sorted({period for item in date_periods for period in item})
+    print(f"回测 {dates[0]} ~ {dates[-1]}，共 {len(dates)} 个日期，需要 {len(periods)} 个报告期")
+
+    with run_metrics.stage('backtest_periods'):
+        roe_by_period, eps_by_period, bvps_by_period = {}, {}, {}
+        for period in periods:
+            roe, fundamentals = load_period(period, cache)
+            roe_by_period[period] = roe
+            eps_by_period[period] = {code: eps for code, (eps, _) in fundamentals.items()}
+            bvps_by_period[period] = {code: bvps for code, (_, bvps) in fundamentals.items()}
+        dividend_periods = sorted({f"{year}{month_day}"
+                                   for year in range(int(dates[0][:4]) - 2, int(dates[-1][:4]) + 1)
+                                   for month_day in ('0630', '1231')
+                                   if _to_date(f"{year}{month_day}") <= _to_date(dates[-1])})
+        plans = [plan for period in dividend_periods for plan in load_dividend_plans(period, cache)]
+
+    with run_metrics.stage('backtest_screen'):
+        roe_panel = ROEPanel.from_period_dicts(roe_by_period, periods)
+        codes = roe_panel.codes
+        eps = _align(ROEPanel.from_period_dicts(eps_by_period, periods), codes)
+        bvps = _align(ROEPanel.from_period_dicts(bvps_by_period, periods), codes)
+        boards = np.array([classify_code(code)[1] for code in codes.tolist()], dtype=object)
+        # 不按当前证券主表剔除已退市股票，避免幸存者偏差
+        board_mask = ~np.isin(boards, list(EXCLUDED_BOARDS))
+
+        column = {period: i for i, period in enumerate(periods)}
+        columns = np.array([[column[period] for period in item] for item in date_periods])   # (日期, 6)
+        quarters = np.array([reported_quarters(item[-1]) for item in date_periods])           # (日期,)
+
+        roe = roe_panel.values[:, columns]                                  # (股票, 日期, 6)
+        roe[:, :, -1] = annualize(roe[:, :, -1], quarters[None, :])
+        avg_roe, min_roe = _nan_mean_min(roe, axis=2)                        # (股票, 日期)
+        env = roe_env(roe, avg_roe, min_roe)
+        roe_mask = spec.roe_mask(env)
+        roe_mask &= board_mask[:, None]
+        print(f"通过ROE筛选: 每个日期平均 {roe_mask.sum(axis=0).mean():.0f} 只，"
+              f"合计 {roe_mask.any(axis=1).sum()} 只不同的股票")
+
+    # 只为曾经通过ROE筛选的股票获取月线
+    first_month = dates[0][:6]
+    last_month = datetime.date.today().strftime('%Y%m')
+    universe = codes[roe_mask.any(axis=1)].tolist()
+    with run_metrics.stage('backtest_prices'):
+        monthly = load_monthly_prices(universe, first_month, last_month, cache)
+    n_months = _month_index(last_month, first_month) + 1
+    close = np.full((len(codes), n_months), np.nan)
+    close_adj = np.full((len(codes), n_months), np.nan)
+    row_of = {code: i for i, code in enumerate(codes.tolist())}
+    for code, rows in monthly.items():
+        for month, price, price_adj in rows:
+            index = _month_index(month, first_month)
+            if 0 <= index < n_months:
+                close[row_of[code], index] = np.nan if price is None else price
+                close_adj[row_of[code], index] = np.nan if price_adj is None else price_adj
+
+    with run_metrics.stage('backtest_screen'):
+        month_index = np.array([_month_index(date[:6], first_month) for date in dates])
+        price = close[:, month_index]
+        latest = columns[:, -1]
+        eps_annual = annualize(eps[:, latest], quarters[None, :])
+        cash = dividend_ttm_matrix(plans, codes, dates)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pe_ratio = price / eps_annual
+            pb_ratio = price / bvps[:, latest]
+            dividend_yield = cash / price * 100
+        env.update(pe=pe_ratio, dividend_yield=dividend_yield, pb=pb_ratio)
+        value_passed, value_ratio = spec.evaluate(env)
+        passed = roe_mask & value_passed & np.isfinite(value_ratio)
+
+        # 每个日期按性价比从高到低取前 top_n 名，同分按代码顺序（与 rank_stocks 一致）
+        order = [top_k_indices(value_ratio[:, t], top_n, passed[:, t]) for t in range(len(dates))]
+        forward = {}
+        for horizon in horizons:
+            target = month_index + 3 * horizon
+            future = np.full((len(codes), len(dates)), np.nan)
+            ok = target < n_months
+            with np.errstate(invalid='ignore', divide='ignore'):
+                future[:, ok] = close_adj[:, target[ok]] / close_adj[:, month_index[ok]] - 1
+            forward[horizon] = future
+
+    with run_metrics.stage('backtest_write'):
+        os.makedirs(out_dir, exist_ok=True)
+        ranking_rows, summary_rows = [], []
+        results = {horizon: ([], []) for horizon in horizons}
+        for t, date in enumerate(dates):
+            count = int(passed[:, t].sum())
+            top = order[t]
+            for rank, row in enumerate(top.tolist(), start=1):
+                item = {
+                    'date': date, 'rank': rank, 'code': codes[row], 'name': names.get(codes[row]),
+                    'latest_period': date_periods[t][-1], 'avg_roe': avg_roe[row, t],
+                    'pe': pe_ratio[row, t], 'dividend_yield': dividend_yield[row, t],
+                    'pb': pb_ratio[row, t], 'value_ratio': value_ratio[row, t],
+                }
+                for horizon in horizons:
+                    item[f"fwd_{horizon}q"] = forward[horizon][row, t]
+                ranking_rows.append(item)
+
+            summary = {'date': date, 'latest_period': date_periods[t][-1],
+                       'universe': int((board_mask & ~np.isnan(roe[:, t, -1])).sum()),
+                       'roe_passed': int(roe_mask[:, t].sum()), 'passed': count}
+            for horizon in horizons:
+                top_return = np.nanmean(forward[horizon][top, t]) if len(top) and \
+                    np.isfinite(forward[horizon][top, t]).any() else np.nan
+                roe_returns = forward[horizon][roe_mask[:, t], t]
+                base_return = np.nanmean(roe_returns) if np.isfinite(roe_returns).any() else np.nan
+                summary[f"top_fwd_{horizon}q"] = top_return
+                summary[f"roe_fwd_{horizon}q"] = base_return
+                if not np.isnan(top_return) and not np.isnan(base_return):
+                    results[horizon][0].append(top_return)
+                    results[horizon][1].append(base_return)
+            summary_rows.append(summary)
+
+        fwd_columns = [(f"fwd_{horizon}q", 'float') for horizon in horizons]
+        ranking_columns = [('date', 'str'), ('rank', 'int'), ('code', 'str'), ('name', 'str'),
+                           ('latest_period', 'str'), ('avg_roe', 'float'), ('pe', 'float'),
+                           ('dividend_yield', 'float'), ('pb', 'float'), ('value_ratio', 'float')] + fwd_columns
+        summary_columns = [('date', 'str'), ('latest_period', 'str'), ('universe', 'int'),
+                           ('roe_passed', 'int'), ('passed', 'int')]
+        for horizon in horizons:
+            summary_columns += [(f"top_fwd_{horizon}q", 'float'), (f"roe_fwd_{horizon}q", 'float')]
+        write_csv((_clean(row) for row in ranking_rows), ranking_columns,
+                  os.path.join(out_dir, "backtest_rankings.csv"))
+        write_csv((_clean(row) for row in summary_rows), summary_columns,
+                  os.path.join(out_dir, "backtest_summary.csv"))
+
+    averages = {}
+    print(f"\n回测结果（前 {top_n} 名等权 vs 通过ROE筛选的股票等权，各日期平均）:")
+    for horizon in horizons:
+        top_returns, base_returns = results[horizon]
+        if not top_returns:
+            print(f"  {horizon} 个季度: 无可用收益数据")
+            continue
+        averages[horizon] = (float(np.mean(top_returns)), float(np.mean(base_returns)))
+        wins = sum(a > b for a, b in zip(top_returns, base_returns))
+        print(f"  {horizon} 个季度: 前{top_n}名 {averages[horizon][0]:+.2%}，"
+              f"ROE筛选 {averages[horizon][1]:+.2%}，跑赢 {wins}/{len(top_returns)} 个日期")
+    return averages
+
+
+def _clean(row):
+    """NaN 写成空值"""
+    return {key: (None if isinstance(value, float) and np.isnan(value) else value)
+            for key, value in row.items()}
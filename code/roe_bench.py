@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+"""
+选股流程的基准测试
+
+用合成的全市场数据（stock_yjbb_em 形状的业绩表、行情快照、分红表、雪球个股行情）
+替换数据源，分别计时各阶段并测量峰值内存：
+  roe_fetch       fetch_ROE_periods：取回各报告期并转成字典
+  panel           ROEPanel 构建 + 年化 + 板块过滤（get_multi_year_ROE 的计算部分）
+  roe_screen      screen_ROE_panel + 转回字典（clean_data_ROE_v2 的计算部分）
+  quote_snapshot  get_quote_snapshot：全市场快照 + 股息率(TTM)
+  metric_fetch    fetch_stock_metrics：逐只查询（零延迟，衡量线程池/限速器本身的开销）
+  scoring         score_stocks + rank_stocks（append_pb 的计算部分）
+  report_write    write_report：写出前 REPORT_TOP_N 名
+另有模拟延迟模式，测量不同线程数下逐只查询的吞吐量；以及启动开销（各自在新的解释器中运行）：
+  startup_import  import ROEselection 的耗时和峰值常驻内存（不导入 akshare）
+  startup_akshare 同上，再加上第一次访问网络时导入 akshare（未安装 akshare 时跳过）
+  offline_run     用合成数据写好本地缓存后，--offline 完整运行一次（筛选、排名、写报告）
+
+结果写入 JSON 文件；指定 --baseline 时与上次结果比较，耗时变慢超过阈值则返回非零。
+
+用法：
+  python code/roe_bench.py                          # 5k/50k/500k 只股票 x 6/20/80 个报告期
+  python code/roe_bench.py --codes 5000 --periods 6 --latency-workers 5 10 20 40
+  python code/roe_bench.py --baseline bench_results.json --out bench_new.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import ROEselection as roe
+from roe_cache import ROECache
+from roe_datasource import DataSource, set_data_source
+from roe_master import SecuritiesMaster
+from roe_panel import ROEPanel
+from roe_throttle import RateController
+
+DEFAULT_CODES = [5000, 50000, 500000]
+DEFAULT_PERIODS = [6, 20, 80]
+# 单个组合的 股票数 x 报告期数 上限，超过的组合跳过（500k x 80 的字典接口需要数 GB 内存）
+DEFAULT_MAX_CELLS = 20_000_000
+# metric_fetch 阶段最多逐只查询的股票数
+DEFAULT_FETCH_SAMPLE = 20000
+# offline_run 合成市场的股票数
+DEFAULT_STARTUP_CODES = 5000
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 在新的解释器中导入 ROEselection（argv[1] 为 'akshare' 时再导入 akshare），最后一行输出 JSON
+_IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import ROEselection, roe_datasource
+import_seconds = time.perf_counter() - start
+if sys.argv[1] == 'akshare':
+    roe_datasource.load_akshare()
+from roe_metrics import peak_memory_mb
+print(json.dumps({'seconds': time.perf_counter() - start, 'import_seconds': import_seconds,
+                  'akshare_loaded': 'akshare' in sys.modules, 'peak_rss_mb': peak_memory_mb()}))
+"""
+
+
+def quarter_ends(count, last="20250930"):
+    """以 last 结尾的 count 个季度末报告期，旧的在前"""
+    year, month = int(last[:4]), int(last[4:6])
+    periods = []
+    for _ in range(count):
+        day = 31 if month in (3, 12) else 30
+        periods.append(f"{year}{month:02d}{day}")
+        month -= 3
+        if month <= 0:
+            month += 12
+            year -= 1
+    return periods[::-1]
+
+
+class SyntheticMarket:
+    """
+    合成的全市场数据，所有表在构造时生成好，数据源调用时只做查表
+
+    Parameters:
+    n_codes (int): 股票数量
+    periods (list): 报告期
+    seed (int): 随机数种子
+    """
+
+    def __init__(self, n_codes, periods, seed=0):
+        rng = np.random.default_rng(seed)
+        self.codes = np.char.zfill(np.arange(n_codes).astype(str), 6)
+        self.periods = periods
+
+        # ROE：每只股票一个长期水平 + 各期波动，约 5% 缺失
+        level = rng.normal(8, 6, n_codes)
+        roe = level[:, None] + rng.normal(0, 4, (n_codes, len(periods)))
+        roe[rng.random(roe.shape) < 0.05] = np.nan
+        self.yjbb = {
+            period: pd.DataFrame({'股票代码': self.codes, '净资产收益率': roe[:, i]})
+            for i, period in enumerate(periods)
+        }
+
+        self.names = np.char.add('股票', self.codes)
+        self.pe = rng.lognormal(3, 0.6, n_codes)
+        self.pb = rng.lognormal(0.7, 0.6, n_codes)
+        self.price = rng.uniform(3, 80, n_codes)
+        self.dividend = np.where(rng.random(n_codes) < 0.7, rng.uniform(0, 4, n_codes), 0.0)
+        self.spot = pd.DataFrame({
+            '代码': self.codes, '名称': self.names, '最新价': self.price,
+            '市盈率-动态': self.pe, '市净率': self.pb,
+        })
+        ex_date = (datetime.date.today() - datetime.timedelta(days=90)).isoformat()
+        self.fhps = pd.DataFrame({
+            '代码': self.codes,
+            '现金分红-现金分红比例': self.dividend / 100 * self.price * 10,
+            '除权除息日': ex_date,
+        })
+        self._index = {code: i for i, code in enumerate(self.codes.tolist())}
+
+    def xq_payload(self, symbol):
+        i = self._index[symbol[2:]]
+        return pd.DataFrame({
+            'item': ['名称', '市盈率(动)', '股息率(TTM)', '市净率'],
+            'value': [self.names[i], self.pe[i], self.dividend[i], self.pb[i]],
+        })
+
+    def industry_map(self):
+        return {code: f"行业{int(code) % 80}" for code in self.codes.tolist()}
+
+
+class SyntheticDataSource(DataSource):
+    """
+    基于 SyntheticMarket 的数据源，可设置每次调用的固定延迟
+    """
+
+    def __init__(self, market, latency=0.0):
+        self.market = market
+        self.latency = latency
+
+    def call(self, endpoint, *args):
+        if self.latency:
+            time.sleep(self.latency)
+        if endpoint == 'stock_yjbb_em':
+            return self.market.yjbb[args[0]]
+        if endpoint == 'stock_zh_a_spot_em':
+            return self.market.spot
+        if endpoint == 'stock_fhps_em':
+            return self.market.fhps
+        if endpoint == 'stock_individual_spot_xq':
+            return self.market.xq_payload(args[0])
+        raise LookupError(f"合成数据源不支持 {endpoint}")
+
+
+def _measure(func, memory=True):
+    """
+    计时运行 func，memory 为 True 时再用 tracemalloc 单独运行一次测峰值内存
+    （tracemalloc 会明显拖慢执行，不与计时放在同一次运行中）
+
+    Returns:
+    tuple: (func 的返回值, 结果字典)
+    """
+    gc.collect()
+    with contextlib.redirect_stdout(io.StringIO()):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        result = func()
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+    record = {'seconds': round(wall, 6), 'cpu_seconds': round(cpu, 6)}
+    if memory:
+        del result
+        gc.collect()
+        tracemalloc.start()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = func()
+            record['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 3)
+        finally:
+            tracemalloc.stop()
+    return result, record
+
+
+def _prepare_module(market):
+    """把 ROEselection 的全局状态换成基准测试用的：无缓存、无日志、不限速"""
+    set_data_source(SyntheticDataSource(market))
+    roe.ROE_CACHE = None
+    roe.RUN_JOURNAL = None
+    roe.SECURITIES_MASTER = SecuritiesMaster({})
+    roe.METRICS_RATE = 1e9
+    roe.METRICS_RETRY_PASSES = 0
+
+
+def bench_stages(n_codes, n_periods, memory=True, fetch_sample=DEFAULT_FETCH_SAMPLE, seed=0):
+    """
+    对一个 股票数 x 报告期数 组合逐阶段计时
+
+    Returns:
+    list: 每个阶段一条结果
+    """
+    periods = quarter_ends(n_periods)
+    market = SyntheticMarket(n_codes, periods, seed=seed)
+    _prepare_module(market)
+    base = {'codes': n_codes, 'periods': n_periods}
+    results = []
+
+    def add(stage, record, **extra):
+        results.append({'stage': stage, **base, **extra, **record})
+        print(f"  {stage:<15} {record['seconds']:>9.3f}s  cpu {record['cpu_seconds']:>8.3f}s"
+              + (f"  peak {record['peak_mb']:>9.1f} MB" if 'peak_mb' in record else ""))
+
+    roe_data_by_year, record = _measure(lambda: roe.fetch_ROE_periods(periods), memory)
+    add('roe_fetch', record)
+
+    def build_panel():
+        panel = ROEPanel.from_period_dicts(roe_data_by_year, periods).annualize_last()
+        return panel.select(roe.get_securities_master().board_mask(panel.codes))
+    panel, record = _measure(build_panel, memory)
+    add('panel', record)
+
+    def screen():
+        selected, avg_roe = roe.screen_ROE_panel(panel)
+        return selected.to_dict(extra=[avg_roe])
+    filtered_data, record = _measure(screen, memory)
+    add('roe_screen', record, survivors=len(filtered_data))
+
+    snapshot, record = _measure(roe.get_quote_snapshot, memory)
+    add('quote_snapshot', record)
+
+    sample = list(filtered_data)[:fetch_sample]
+    _, record = _measure(lambda: roe.fetch_stock_metrics(sample), memory)
+    add('metric_fetch', record, fetched=len(sample))
+
+    def scoring():
+        codes = list(filtered_data)
+        scored = roe.score_stocks([filtered_data[code] for code in codes],
+                                  [snapshot.get(code, (np.nan,) * 4) for code in codes])
+        enhanced = {code: enhanced_list for code, enhanced_list in zip(codes, scored)
+                    if enhanced_list is not None}
+        return enhanced, roe.rank_stocks(enhanced)
+    (enhanced, ranked), record = _measure(scoring, memory)
+    check_ranking(ranked, filtered_data, snapshot)
+    add('scoring', record, passed=len(enhanced))
+
+    industry_map = market.industry_map()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'report.txt')
+        _, record = _measure(
+            lambda: roe.write_report(ranked, len(filtered_data), len(enhanced), industry_map, path), memory)
+        check_report(path, ranked, n_periods)
+    add('report_write', record, rows=min(len(ranked), roe.REPORT_TOP_N))
+    return results
+
+
+def check_ranking(ranked, filtered_data, snapshot):
+    """
+    与按默认公式独立计算的性价比排序比较，不一致时抛出 RuntimeError（计时结果不可信）
+
+    Parameters:
+    ranked (list): rank_stocks 的结果
+    filtered_data (dict): 股票代码 -> 各期ROE + 平均ROE
+    snapshot (dict): 股票代码 -> (市盈率, 股息率, 市净率, 名称)
+    """
+    codes = [code for code, _ in ranked]
+    avg_roe = np.array([filtered_data[code][-1] for code in codes], dtype=np.float64)
+    pe = np.array([snapshot[code][0] for code in codes], dtype=np.float64)
+    pb = np.array([snapshot[code][2] for code in codes], dtype=np.float64)
+    value_ratio = (avg_roe / 12) / pb + (100 / pe) / 12
+    # 同分按原顺序
+    order = {code: i for i, code in enumerate(filtered_data)}
+    expected = sorted(range(len(codes)), key=lambda i: (-value_ratio[i], order[codes[i]]))
+    if not np.allclose([data[-2] for _, data in ranked], value_ratio) or expected != list(range(len(codes))):
+        raise RuntimeError("排名与独立计算的性价比排序不一致")
+
+
+def check_report(path, ranked, n_periods):
+    """文本报告的第一行数据：ROE 列数与报告期数一致，性价比与排名结果一致"""
+    if not ranked:
+        return
+    with open(path, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    header = next(i for i, line in enumerate(lines) if line.startswith("排名,"))
+    fields = lines[header + 1].split(",")
+    # 排名、代码、名称、行业 + 各期ROE + 5 个 "标签,数值"
+    if len(fields) != 4 + n_periods + 10 or fields[-1] != f"{ranked[0][1][-2]:.3f}":
+        raise RuntimeError(f"文本报告的列与 {n_periods} 个报告期不一致: {lines[header + 1]}")
+
+
+def _write_offline_cache(market, path):
+    """把合成市场写入本地缓存：各报告期ROE、证券主表、行业和估值"""
+    cache = ROECache(path)
+    try:
+        for period in market.periods:
+            df = market.yjbb[period]
+            cache.save_period(period, dict(zip(df['股票代码'], df['净资产收益率'])))
+        cache.save_securities(SecuritiesMaster.from_spot(market.spot).records)
+        cache.save_industries(market.industry_map())
+        cache.save_quotes({code: (market.pe[i], market.dividend[i], market.pb[i], market.names[i])
+                           for i, code in enumerate(market.codes.tolist())})
+    finally:
+        cache.close()
+
+
+def bench_startup(n_codes=DEFAULT_STARTUP_CODES, seed=0):
+    """
+    启动开销：模块导入、导入 akshare、离线完整运行，各自在新的解释器中测量
+
+    Returns:
+    list: 每项一条结果，peak_rss_mb 为进程峰值常驻内存（含解释器本身）
+    """
+    results = []
+
+    def report(stage, record):
+        print(f"  {stage:<15} {record['seconds']:>9.3f}s  导入 {record['import_seconds']:.3f}s"
+              f"  akshare {'已导入' if record['akshare_loaded'] else '未导入'}"
+              + (f"  peak {record['peak_rss_mb']:>7.1f} MB" if record.get('peak_rss_mb') else ""))
+
+    for stage, mode in (('startup_import', 'module'), ('startup_akshare', 'akshare')):
+        proc = subprocess.run([sys.executable, '-c', _IMPORT_PROBE, mode], cwd=CODE_DIR,
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"  {stage:<15} 跳过: {proc.stderr.strip().splitlines()[-1]}")
+            continue
+        record = {'stage': stage, **json.loads(proc.stdout.strip().splitlines()[-1])}
+        results.append(record)
+        report(stage, record)
+
+    market = SyntheticMarket(n_codes, list(roe.REPORT_PERIODS), seed=seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_path = os.path.join(tmp, 'roe_cache.sqlite')
+        metrics_path = os.path.join(tmp, 'run_metrics.json')
+        _write_offline_cache(market, cache_path)
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, os.path.join(CODE_DIR, 'ROEselection.py'), '--offline',
+             '--cache-path', cache_path, '--metrics-out', metrics_path, '--csv-out', ''],
+            cwd=tmp, capture_output=True, text=True)
+        seconds = time.perf_counter() - start
+        if proc.returncode != 0:
+            raise RuntimeError(f"离线运行失败:\n{proc.stdout[-2000:]}{proc.stderr[-2000:]}")
+        with open(metrics_path, encoding='utf-8') as f:
+            startup = json.load(f)['startup']
+    record = {'stage': 'offline_run', 'codes': n_codes, 'seconds': round(seconds, 6),
+              'import_seconds': startup['import_seconds'],
+              'akshare_loaded': startup['akshare_import_seconds'] is not None,
+              'peak_rss_mb': startup['peak_memory_mb']}
+    results.append(record)
+    report('offline_run', record)
+    return results
+
+
+def bench_latency(n_stocks, latency, worker_counts, seed=0):
+    """
+    模拟延迟下逐只查询的吞吐量
+
+    Parameters:
+    n_stocks (int): 查询的股票数
+    latency (float): 每次调用的固定延迟（秒）
+    worker_counts (list): 要比较的并发上限
+
+    Returns:
+    list: 每个并发上限一条结果
+    """
+    market = SyntheticMarket(n_stocks, quarter_ends(6), seed=seed)
+    _prepare_module(market)
+    set_data_source(SyntheticDataSource(market, latency=latency))
+    codes = market.codes.tolist()
+
+    results = []
+    for workers in worker_counts:
+        controller = RateController(rate=1e9, initial=workers, minimum=workers, maximum=workers,
+                                    latency_target=max(1.0, latency * 10))
+        _, record = _measure(lambda: roe.fetch_stock_metrics(codes, controller=controller), memory=False)
+        throughput = n_stocks / record['seconds']
+        results.append({'stage': 'metric_fetch_latency', 'codes': n_stocks, 'latency': latency,
+                        'workers': workers, 'stocks_per_second': round(throughput, 2), **record})
+        print(f"  workers {workers:>3}: {record['seconds']:>8.3f}s  {throughput:>9.1f} 只/秒")
+    return results
+
+
+def compare(results, baseline_path, threshold):
+    """
+    与基准结果比较耗时
+
+    Returns:
+    list: 变慢超过 threshold 的条目说明
+    """
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    def key(item):
+        return (item['stage'], item.get('codes'), item.get('periods'), item.get('workers'))
+
+    previous = {key(item): item for item in baseline.get('results', [])}
+    regressions = []
+    for item in results:
+        old = previous.get(key(item))
+        if old is None or not old.get('seconds'):
+            continue
+        change = item['seconds'] / old['seconds'] - 1
+        line = f"{key(item)}: {old['seconds']:.3f}s -> {item['seconds']:.3f}s ({change:+.1%})"
+        print(line)
+        if change > threshold:
+            regressions.append(line)
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="选股流程各阶段的基准测试")
+    parser.add_argument("--codes", type=int, nargs="+", default=DEFAULT_CODES,
+                        help="合成市场的股票数量")
+    parser.add_argument("--periods", type=int, nargs="+", default=DEFAULT_PERIODS,
+                        help="报告期数量")
+    parser.add_argument("--max-cells", type=int, default=DEFAULT_MAX_CELLS,
+                        help="跳过 股票数 x 报告期数 超过该值的组合")
+    parser.add_argument("--fetch-sample", type=int, default=DEFAULT_FETCH_SAMPLE,
+                        help="metric_fetch 阶段最多逐只查询的股票数")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="不测量峰值内存（省去每个阶段的第二次运行）")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="模拟延迟模式下每次调用的延迟（秒）")
+    parser.add_argument("--latency-stocks", type=int, default=500,
+                        help="模拟延迟模式下查询的股票数")
+    parser.add_argument("--latency-workers", type=int, nargs="*", default=[5, 10, 20, 40],
+                        help="模拟延迟模式下比较的并发上限，为空时跳过该模式")
+    parser.add_argument("--startup-codes", type=int, default=DEFAULT_STARTUP_CODES,
+                        help="离线完整运行时合成市场的股票数")
+    parser.add_argument("--no-startup", action="store_true",
+                        help="不测量启动开销（模块导入、akshare 导入、离线运行）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench_results.json",
+                        help="结果文件")
+    parser.add_argument("--baseline", default=None,
+                        help="用于比较的上次结果文件")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="耗时变慢超过该比例视为性能回退")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    skipped = []
+
+    for n_codes in args.codes:
+        for n_periods in args.periods:
+            if n_codes * n_periods > args.max_cells:
+                print(f"跳过 {n_codes} 只股票 x {n_periods} 个报告期（超过 --max-cells）")
+                skipped.append({'codes': n_codes, 'periods': n_periods})
+                continue
+            print(f"{n_codes} 只股票 x {n_periods} 个报告期:")
+            results.extend(bench_stages(n_codes, n_periods, memory=not args.no_memory,
+                                        fetch_sample=args.fetch_sample, seed=args.seed))
+
+    if not args.no_startup:
+        print("启动开销:")
+        results.extend(bench_startup(args.startup_codes, seed=args.seed))
+
+    if args.latency_workers:
+        print(f"模拟延迟 {args.latency * 1000:.0f} ms，{args.latency_stocks} 只股票:")
+        results.extend(bench_latency(args.latency_stocks, args.latency, args.latency_workers, seed=args.seed))
+
+    output = {
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': vars(args),
+        'skipped': skipped,
+        'results': results,
+    }
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到文件: {args.out}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} 项耗时变慢超过 {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,497 @@
+# -*- coding: utf-8 -*-
+"""
+财报数据本地缓存
+
+ak.stock_yjbb_em(date) 每次返回全市场的业绩报表，已过披露截止日的报告期
+数据基本不会再变化，因此按报告期缓存到本地 SQLite 文件中：
+  - 已完成的报告期直接从磁盘读取，不再访问网络
+  - 仍在披露期内的报告期按 TTL 过期后重新获取
+同一文件中还保存证券主表、行业映射、增量模式使用的上次运行状态、
+最近一次获取的估值（离线模式使用），以及回测用的每股收益/每股净资产、分红方案和月线收盘价。
+"""
+
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(".roe_cache", "roe_cache.sqlite")
+DEFAULT_TTL_HOURS = 24
+
+# 各报告期的法定披露截止日: 报告期月日 -> (月, 日, 跨年数)
+_DISCLOSURE_DEADLINES = {
+    "0331": (4, 30, 0),    # 一季报  4月30日前
+    "0630": (8, 31, 0),    # 半年报  8月31日前
+    "0930": (10, 31, 0),   # 三季报 10月31日前
+    "1231": (4, 30, 1),    # 年报   次年4月30日前
+}
+
+# 截止日之后再留一段时间给延期披露、更正公告的公司
+_GRACE_DAYS = 15
+
+# 分红方案在报告期结束后约一年内实施完毕，之后不再变化
+_DIVIDEND_FINAL_DAYS = 480
+
+
+def period_deadline(date):
+    """
+    报告期的披露截止日
+
+    Parameters:
+    date (str): 报告期，格式为YYYYMMDD
+
+    Returns:
+    datetime.date: 披露截止日；非标准报告期返回 None
+    """
+    rule = _DISCLOSURE_DEADLINES.get(date[4:])
+    if rule is None:
+        return None
+    month, day, year_offset = rule
+    return datetime.date(int(date[:4]) + year_offset, month, day)
+
+
+def is_period_finished(date, today=None):
+    """
+    判断报告期是否已结束披露（数据不再变化）
+
+    Parameters:
+    date (str): 报告期，格式为YYYYMMDD
+    today (datetime.date): 当前日期，默认为今天
+
+    Returns:
+    bool: 已过披露截止日 + 宽限期返回 True
+    """
+    deadline = period_deadline(date)
+    if deadline is None:
+        return False
+    today = today or datetime.date.today()
+    return today > deadline + datetime.timedelta(days=_GRACE_DAYS)
+
+
+def is_dividend_period_finished(period, today=None):
+    """
+    判断报告期的分红方案是否已全部实施（除权除息日不再变化）
+
+    Parameters:
+    period (str): 报告期，格式为YYYYMMDD
+    today (datetime.date): 当前日期，默认为今天
+    """
+    end = datetime.datetime.strptime(period, "%Y%m%d").date()
+    today = today or datetime.date.today()
+    return today > end + datetime.timedelta(days=_DIVIDEND_FINAL_DAYS)
+
+
+def _to_real(value):
+    """转换为 SQLite REAL，无法转换的值（None、'-' 等）存为 NULL"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ROECache:
+    """
+    按报告期保存 股票代码 -> ROE 的 SQLite 缓存
+
+    Parameters:
+    path (str): 缓存文件路径
+    ttl_hours (float): 未完成报告期的有效时长（小时）
+    refresh (bool): 为 True 时忽略已有缓存，重新获取并覆盖
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_hours=DEFAULT_TTL_HOURS, refresh=False):
+        self.path = path
+        self.ttl_hours = ttl_hours
+        self.refresh = refresh
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS periods (
+                date       TEXT PRIMARY KEY,
+                fetched_at REAL NOT NULL,
+                rows       INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS roe (
+                date  TEXT NOT NULL,
+                code  TEXT NOT NULL,
+                roe   REAL,
+                PRIMARY KEY (date, code)
+            );
+            CREATE TABLE IF NOT EXISTS securities (
+                code       TEXT PRIMARY KEY,
+                exchange   TEXT NOT NULL,
+                board      TEXT NOT NULL,
+                name       TEXT,
+                status     TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS industries (
+                code       TEXT PRIMARY KEY,
+                industry   TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS run_state (
+                code       TEXT PRIMARY KEY,
+                roe        TEXT NOT NULL,
+                metrics    TEXT,
+                price      REAL,
+                quoted_at  REAL,
+                score      REAL,
+                rank       INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS quotes (
+                code           TEXT PRIMARY KEY,
+                pe             REAL,
+                dividend_yield REAL,
+                pb             REAL,
+                name           TEXT,
+                fetched_at     REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS run_meta (
+                key   TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS fundamental_periods (
+                date       TEXT PRIMARY KEY,
+                fetched_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS fundamentals (
+                date  TEXT NOT NULL,
+                code  TEXT NOT NULL,
+                eps   REAL,
+                bvps  REAL,
+                PRIMARY KEY (date, code)
+            );
+            CREATE TABLE IF NOT EXISTS dividend_periods (
+                period     TEXT PRIMARY KEY,
+                fetched_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS dividend_plans (
+                period   TEXT NOT NULL,
+                code     TEXT NOT NULL,
+                cash     REAL,
+                ex_date  TEXT
+            );
+            CREATE INDEX IF NOT EXISTS dividend_plans_period ON dividend_plans (period);
+            CREATE TABLE IF NOT EXISTS price_series (
+                code       TEXT PRIMARY KEY,
+                fetched_at REAL NOT NULL,
+                last_month TEXT
+            );
+            CREATE TABLE IF NOT EXISTS monthly_prices (
+                code       TEXT NOT NULL,
+                month      TEXT NOT NULL,
+                close      REAL,
+                close_adj  REAL,
+                PRIMARY KEY (code, month)
+            );
+            """
+        )
+        self._conn.commit()
+
+    def is_fresh(self, date, fetched_at, now=None):
+        """已完成的报告期永久有效，未完成的按 TTL 判断"""
+        if is_period_finished(date):
+            return True
+        now = time.time() if now is None else now
+        return now - fetched_at < self.ttl_hours * 3600
+
+    def load_period(self, date):
+        """
+        读取报告期缓存
+
+        Returns:
+        dict: 股票代码为key，ROE为value的字典；缓存不存在、已过期或要求刷新时返回 None
+        """
+        if self.refresh:
+            return None
+        with self._lock:
+            meta = self._conn.execute(
+                "SELECT fetched_at FROM periods WHERE date = ?", (date,)
+            ).fetchone()
+            if meta is None or not self.is_fresh(date, meta[0]):
+                return None
+            rows = self._conn.execute(
+                "SELECT code, roe FROM roe WHERE date = ?", (date,)
+            ).fetchall()
+        return {code: (float("nan") if roe is None else roe) for code, roe in rows}
+
+    def save_period(self, date, roe_dict):
+        """覆盖写入一个报告期的数据"""
+        rows = [(date, str(code), _to_real(roe)) for code, roe in roe_dict.items()]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM roe WHERE date = ?", (date,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO roe (date, code, roe) VALUES (?, ?, ?)", rows
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO periods (date, fetched_at, rows) VALUES (?, ?, ?)",
+                (date, time.time(), len(rows)),
+            )
+
+    def load_securities(self):
+        """
+        读取证券主表
+
+        Returns:
+        dict: 股票代码为key，(交易所, 板块, 名称, 上市状态) 为value
+        float: 刷新时间，无数据时为 None
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT code, exchange, board, name, status, updated_at FROM securities"
+            ).fetchall()
+        if not rows:
+            return {}, None
+        records = {code: (exchange, board, name, status)
+                   for code, exchange, board, name, status, _ in rows}
+        return records, min(row[5] for row in rows)
+
+    def save_securities(self, records):
+        """整表替换证券主表"""
+        now = time.time()
+        rows = [(code, *record, now) for code, record in records.items()]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM securities")
+            self._conn.executemany(
+                "INSERT INTO securities (code, exchange, board, name, status, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def load_industries(self):
+        """
+        读取行业映射
+
+        Returns:
+        dict: 股票代码为key，行业为value
+        float: 最早的刷新时间，无数据时为 None
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT code, industry, updated_at FROM industries"
+            ).fetchall()
+        if not rows:
+            return {}, None
+        return {code: industry for code, industry, _ in rows}, min(row[2] for row in rows)
+
+    def save_industries(self, industry_map, replace=False):
+        """写入行业映射；replace 为 True 时先清空旧数据"""
+        now = time.time()
+        rows = [(code, industry, now) for code, industry in industry_map.items()]
+        with self._lock, self._conn:
+            if replace:
+                self._conn.execute("DELETE FROM industries")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO industries (code, industry, updated_at) VALUES (?, ?, ?)",
+                rows,
+            )
+
+    def load_quotes(self):
+        """
+        读取最近一次获取的估值
+
+        Returns:
+        dict: 股票代码为key，(市盈率, 股息率, 市净率, 名称) 为value，缺失的字段为 NaN
+        float: 最早的获取时间，无数据时为 None
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT code, pe, dividend_yield, pb, name, fetched_at FROM quotes"
+            ).fetchall()
+        if not rows:
+            return {}, None
+        nan = float("nan")
+        quotes = {code: (nan if pe is None else pe, nan if dy is None else dy, nan if pb is None else pb,
+                         nan if name is None else name)
+                  for code, pe, dy, pb, name, _ in rows}
+        return quotes, min(row[5] for row in rows)
+
+    def save_quotes(self, quotes):
+        """
+        写入估值，同一股票覆盖旧值；全部字段缺失（获取失败）的股票不写入，保留上次的估值
+
+        Parameters:
+        quotes (dict): 股票代码为key，(市盈率, 股息率, 市净率, 名称) 为value
+        """
+        now = time.time()
+        rows = []
+        for code, (pe, dividend_yield, pb, name) in quotes.items():
+            name = name if isinstance(name, str) else None
+            values = [_to_real(pe), _to_real(dividend_yield), _to_real(pb)]
+            if name is None and all(value is None for value in values):
+                continue
+            rows.append((str(code), *values, name, now))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO quotes (code, pe, dividend_yield, pb, name, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def load_run_state(self):
+        """
+        读取上次运行状态
+
+        Returns:
+        dict: 运行信息（报告期列表、完成时间等），无状态时为 None
+        list: [(代码, ROE列表, 估值列表或 None, 价格, 估值获取时间, 性价比, 名次), ...]
+        """
+        with self._lock:
+            meta = self._conn.execute("SELECT key, value FROM run_meta").fetchall()
+            rows = self._conn.execute(
+                "SELECT code, roe, metrics, price, quoted_at, score, rank FROM run_state"
+            ).fetchall()
+        if not meta:
+            return None, []
+        entries = [(code, json.loads(roe), json.loads(metrics) if metrics else None,
+                    price, quoted_at, score, rank)
+                   for code, roe, metrics, price, quoted_at, score, rank in rows]
+        return {key: json.loads(value) for key, value in meta}, entries
+
+    def save_run_state(self, meta, entries):
+        """
+        整表替换上次运行状态
+
+        Parameters:
+        meta (dict): 运行信息，值需可 JSON 序列化
+        entries (list): 与 load_run_state 返回格式相同，NaN 存为 null
+        """
+        rows = [(code, json.dumps([_to_real(x) for x in roe]),
+                 json.dumps([x if isinstance(x, str) else _to_real(x) for x in metrics])
+                 if metrics is not None else None,
+                 _to_real(price), quoted_at, _to_real(score), rank)
+                for code, roe, metrics, price, quoted_at, score, rank in entries]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM run_state")
+            self._conn.execute("DELETE FROM run_meta")
+            self._conn.executemany(
+                "INSERT INTO run_state (code, roe, metrics, price, quoted_at, score, rank) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._conn.executemany(
+                "INSERT INTO run_meta (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value, ensure_ascii=False)) for key, value in meta.items()],
+            )
+
+    def load_fundamentals(self, date):
+        """
+        读取报告期的每股收益、每股净资产
+
+        Returns:
+        dict: 股票代码为key，(每股收益, 每股净资产) 为value；缓存不存在、已过期或要求刷新时返回 None
+        """
+        if self.refresh:
+            return None
+        with self._lock:
+            meta = self._conn.execute(
+                "SELECT fetched_at FROM fundamental_periods WHERE date = ?", (date,)
+            ).fetchone()
+            if meta is None or not self.is_fresh(date, meta[0]):
+                return None
+            rows = self._conn.execute(
+                "SELECT code, eps, bvps FROM fundamentals WHERE date = ?", (date,)
+            ).fetchall()
+        nan = float("nan")
+        return {code: (nan if eps is None else eps, nan if bvps is None else bvps)
+                for code, eps, bvps in rows}
+
+    def save_fundamentals(self, date, fundamentals):
+        """覆盖写入一个报告期的 股票代码 -> (每股收益, 每股净资产)"""
+        rows = [(date, str(code), _to_real(eps), _to_real(bvps))
+                for code, (eps, bvps) in fundamentals.items()]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM fundamentals WHERE date = ?", (date,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO fundamentals (date, code, eps, bvps) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO fundamental_periods (date, fetched_at) VALUES (?, ?)",
+                (date, time.time()),
+            )
+
+    def load_dividend_plans(self, period):
+        """
+        读取报告期的分红方案
+
+        Returns:
+        list: [(股票代码, 每10股派现, 除权除息日 YYYY-MM-DD 或 None), ...]；
+              缓存不存在、已过期或要求刷新时返回 None
+        """
+        if self.refresh:
+            return None
+        with self._lock:
+            meta = self._conn.execute(
+                "SELECT fetched_at FROM dividend_periods WHERE period = ?", (period,)
+            ).fetchone()
+            if meta is None:
+                return None
+            if not is_dividend_period_finished(period) and time.time() - meta[0] >= self.ttl_hours * 3600:
+                return None
+            return self._conn.execute(
+                "SELECT code, cash, ex_date FROM dividend_plans WHERE period = ?", (period,)
+            ).fetchall()
+
+    def save_dividend_plans(self, period, plans):
+        """覆盖写入一个报告期的分红方案 [(股票代码, 每10股派现, 除权除息日), ...]"""
+        rows = [(period, str(code), _to_real(cash), ex_date) for code, cash, ex_date in plans]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM dividend_plans WHERE period = ?", (period,))
+            self._conn.executemany(
+                "INSERT INTO dividend_plans (period, code, cash, ex_date) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dividend_periods (period, fetched_at) VALUES (?, ?)",
+                (period, time.time()),
+            )
+
+    def load_monthly_prices(self):
+        """
+        读取全部月线收盘价
+
+        Returns:
+        dict: 股票代码为key，(获取时间, 最后月份, [(月份 YYYYMM, 收盘价, 后复权收盘价), ...]) 为value
+        """
+        with self._lock:
+            series = self._conn.execute(
+                "SELECT code, fetched_at, last_month FROM price_series"
+            ).fetchall()
+            rows = self._conn.execute(
+                "SELECT code, month, close, close_adj FROM monthly_prices ORDER BY code, month"
+            ).fetchall()
+        result = {code: (fetched_at, last_month, []) for code, fetched_at, last_month in series}
+        for code, month, close, close_adj in rows:
+            if code in result:
+                result[code][2].append((month, close, close_adj))
+        return result
+
+    def save_monthly_prices(self, code, prices):
+        """覆盖写入一只股票的月线 [(月份 YYYYMM, 收盘价, 后复权收盘价), ...]"""
+        rows = [(code, month, _to_real(close), _to_real(close_adj)) for month, close, close_adj in prices]
+        last_month = max((month for month, _, _ in prices), default=None)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM monthly_prices WHERE code = ?", (code,))
+            self._conn.executemany(
+                "INSERT INTO monthly_prices (code, month, close, close_adj) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO price_series (code, fetched_at, last_month) VALUES (?, ?, ?)",
+                (code, time.time(), last_month),
+            )
+
+    def clear(self):
+        """清空全部缓存"""
+        with self._lock, self._conn:
+            for table in ("roe", "periods", "securities", "industries", "run_state", "run_meta",
+                          "fundamentals", "fundamental_periods", "dividend_plans", "dividend_periods",
+                          "monthly_prices", "price_series", "quotes"):
+                self._conn.execute(f"DELETE FROM {table}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+数据源
+
+脚本用到的所有 akshare 接口都经过这里，便于替换：
+  - LiveDataSource:      直接调用 akshare；akshare 在第一次实际调用时才导入
+  - OfflineDataSource:   离线模式，不导入 akshare，任何调用都抛出 OfflineError
+  - RecordingDataSource: 包装另一个数据源，把每次成功的返回保存到本地文件
+  - ReplayDataSource:    从录制的文件返回数据，可设置每次调用的延迟、出错率和限流，
+                         离线复现并发、重试相关的问题
+  - InstrumentedDataSource: 包装另一个数据源，把每次调用的耗时和成败记入运行指标
+
+录制文件按 <目录>/<接口名>/<参数>.json 保存，内容为 DataFrame.to_json(orient='split')。
+"""
+
+import os
+import random
+import threading
+import time
+
+import pandas as pd
+
+DEFAULT_RECORD_DIR = os.path.join(".roe_cache", "recordings")
+
+# 脚本使用的接口
+ENDPOINTS = (
+    'stock_yjbb_em',                  # 业绩报表（按报告期，全市场）
+    'stock_individual_spot_xq',       # 雪球个股行情
+    'stock_individual_info_em',       # 东方财富个股信息（行业）
+    'stock_zh_a_spot_em',             # 东方财富全市场行情
+    'stock_fhps_em',                  # 分红送配（按报告期，全市场）
+    'stock_board_industry_name_em',   # 行业板块列表
+    'stock_board_industry_cons_em',   # 行业板块成分股
+    'stock_zh_a_hist',                # 个股历史行情（回测用月线）
+)
+
+
+class ThrottledError(ConnectionError):
+    """回放数据源模拟的上游限流"""
+
+
+class ReplayMissError(LookupError):
+    """回放数据源中没有这次调用的录制数据"""
+
+
+class OfflineError(LookupError):
+    """离线模式下发生了需要访问网络的调用"""
+
+
+# akshare 导入时会加载数百个子模块，耗时数秒、占用上百 MB 内存，
+# 因此推迟到第一次实际调用接口时才导入；只读本地数据的运行不导入
+_akshare = None
+_akshare_import_seconds = None
+_akshare_lock = threading.Lock()
+
+
+def load_akshare():
+    """
+    返回 akshare 模块，第一次调用时导入
+    """
+    global _akshare, _akshare_import_seconds
+    with _akshare_lock:
+        if _akshare is None:
+            start = time.perf_counter()
+            import akshare
+            _akshare_import_seconds = time.perf_counter() - start
+            _akshare = akshare
+            print(f"已导入 akshare，耗时 {_akshare_import_seconds:.2f}s")
+        return _akshare
+
+
+def akshare_import_seconds():
+    """akshare 的导入耗时（秒），尚未导入时为 None"""
+    return _akshare_import_seconds
+
+
+class DataSource:
+    """
+    数据源基类，子类实现 call(endpoint, *args)
+    """
+
+    def call(self, endpoint, *args):
+        raise NotImplementedError
+
+    def stock_yjbb_em(self, date):
+        return self.call('stock_yjbb_em', date)
+
+    def stock_individual_spot_xq(self, symbol):
+        return self.call('stock_individual_spot_xq', symbol)
+
+    def stock_individual_info_em(self, symbol):
+        return self.call('stock_individual_info_em', symbol)
+
+    def stock_zh_a_spot_em(self):
+        return self.call('stock_zh_a_spot_em')
+
+    def stock_fhps_em(self, date):
+        return self.call('stock_fhps_em', date)
+
+    def stock_board_industry_name_em(self):
+        return self.call('stock_board_industry_name_em')
+
+    def stock_board_industry_cons_em(self, symbol):
+        return self.call('stock_board_industry_cons_em', symbol)
+
+    def stock_zh_a_hist(self, symbol, period='monthly', start_date='19700101', end_date='20500101', adjust=''):
+        return self.call('stock_zh_a_hist', symbol, period, start_date, end_date, adjust)
+
+
+class LiveDataSource(DataSource):
+    """直接调用 akshare"""
+
+    # akshare 中这些接口的参数名，按位置对应 call 的参数
+    _ARG_NAMES = {
+        'stock_yjbb_em': ('date',),
+        'stock_fhps_em': ('date',),
+        'stock_individual_spot_xq': ('symbol',),
+        'stock_individual_info_em': ('symbol',),
+        'stock_board_industry_cons_em': ('symbol',),
+        'stock_zh_a_hist': ('symbol', 'period', 'start_date', 'end_date', 'adjust'),
+    }
+
+    def call(self, endpoint, *args):
+        func = getattr(load_akshare(), endpoint)
+        if args:
+            return func(**dict(zip(self._ARG_NAMES[endpoint], args)))
+        return func()
+
+
+class OfflineDataSource(DataSource):
+    """离线模式：不导入 akshare，任何接口调用都抛出 OfflineError"""
+
+    def call(self, endpoint, *args):
+        raise OfflineError(f"离线模式不访问网络: {endpoint}{args}")
+
+
+def _record_path(directory, endpoint, args):
+    key = "_".join(str(arg) for arg in args) or "all"
+    key = key.replace(os.sep, "_").replace("/", "_")
+    return os.path.join(directory, endpoint, f"{key}.json")
+
+
+class RecordingDataSource(DataSource):
+    """
+    包装另一个数据源，把成功的返回写入录制目录（同一调用重复录制时覆盖）
+
+    Parameters:
+    source (DataSource): 实际获取数据的数据源
+    directory (str): 录制目录
+    """
+
+    def __init__(self, source, directory=DEFAULT_RECORD_DIR):
+        self.source = source
+        self.directory = directory
+
+    def call(self, endpoint, *args):
+        df = self.source.call(endpoint, *args)
+        path = _record_path(self.directory, endpoint, args)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        df.to_json(tmp_path, orient='split', force_ascii=False, date_format='iso')
+        os.replace(tmp_path, path)
+        return df
+
+
+class InstrumentedDataSource(DataSource):
+    """
+    包装另一个数据源，按接口记录调用次数、失败次数和延迟
+
+    Parameters:
+    source (DataSource): 实际获取数据的数据源
+    metrics (RunMetrics): 运行指标，需提供 record_call(endpoint, latency, error)
+    """
+
+    def __init__(self, source, metrics):
+        self.source = source
+        self.metrics = metrics
+
+    def call(self, endpoint, *args):
+        start = time.perf_counter()
+        try:
+            result = self.source.call(endpoint, *args)
+        except Exception as e:
+            self.metrics.record_call(endpoint, time.perf_counter() - start, error=e)
+            raise
+        self.metrics.record_call(endpoint, time.perf_counter() - start)
+        return result
+
+    def __getattr__(self, name):
+        # summary() 等被包装数据源特有的方法
+        return getattr(self.source, name)
+
+
+class ReplayDataSource(DataSource):
+    """
+    从录制目录返回数据，并模拟上游的延迟、错误和限流
+
+    Parameters:
+    directory (str): 录制目录
+    latency (float or dict): 每次调用的基础延迟（秒）；dict 时按接口名配置，缺省为 0
+    jitter (float): 在基础延迟上再加 [0, jitter] 秒的随机延迟
+    error_rate (float): 每次调用以该概率抛出 ConnectionError
+    rate_limit (float): 所有接口合计每秒最多处理的请求数，为 None 时不限
+    max_concurrency (int): 同时在途的请求数上限，为 None 时不限
+    throttle_mode (str): 超限时 'error' 抛出 ThrottledError，'delay' 排队等待
+    seed (int): 随机数种子，相同种子的错误序列可复现
+    """
+
+    def __init__(self, directory=DEFAULT_RECORD_DIR, latency=0.0, jitter=0.0, error_rate=0.0,
+                 rate_limit=None, max_concurrency=None, throttle_mode='error', seed=None):
+        self.directory = directory
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.max_concurrency = max_concurrency
+        self.throttle_mode = throttle_mode
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._recent = []   # 最近 1 秒内的请求时间
+
+    def _base_latency(self, endpoint):
+        if isinstance(self.latency, dict):
+            return self.latency.get(endpoint, 0.0)
+        return self.latency
+
+    def _admit(self):
+        """按限流规则放行一个请求；'error' 模式下超限返回 False"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._recent = [t for t in self._recent if now - t < 1.0]
+                over_rate = self.rate_limit is not None and len(self._recent) >= self.rate_limit
+                over_concurrency = self.max_concurrency is not None and self._in_flight >= self.max_concurrency
+                if not over_rate and not over_concurrency:
+                    self._recent.append(now)
+                    self._in_flight += 1
+                    return True
+                if self.throttle_mode == 'error':
+                    self.throttled += 1
+                    return False
+                wait = 1.0 - (now - self._recent[0]) if over_rate else None
+                self._cond.wait(timeout=wait)
+
+    def _load(self, endpoint, args):
+        path = _record_path(self.directory, endpoint, args)
+        if not os.path.exists(path):
+            raise ReplayMissError(f"没有录制数据: {endpoint}{args}")
+        return pd.read_json(path, orient='split', dtype=False)
+
+    def call(self, endpoint, *args):
+        with self._lock:
+            self.calls += 1
+            delay = self._base_latency(endpoint) + self._random.uniform(0, self.jitter)
+            fail = self._random.random() < self.error_rate
+
+        if not self._admit():
+            time.sleep(delay)
+            raise ThrottledError(f"模拟限流: {endpoint}{args}")
+        try:
+            time.sleep(delay)
+            if fail:
+                with self._lock:
+                    self.errors += 1
+                raise ConnectionError(f"模拟网络错误: {endpoint}{args}")
+            return self._load(endpoint, args)
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def summary(self):
+        return f"回放调用 {self.calls} 次，模拟错误 {self.errors} 次，模拟限流 {self.throttled} 次"
+
+
+_data_source = None
+_data_source_lock = threading.Lock()
+
+
+def get_data_source():
+    """当前数据源，默认为 LiveDataSource"""
+    global _data_source
+    with _data_source_lock:
+        if _data_source is None:
+            _data_source = LiveDataSource()
+        return _data_source
+
+
+def set_data_source(source):
+    """替换全局数据源，返回原来的数据源"""
+    global _data_source
+    with _data_source_lock:
+        previous, _data_source = _data_source, source
+    return previous
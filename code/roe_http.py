@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP 连接池
+
+akshare 的接口通过 requests.get / requests.post 发请求，每次调用都新建 Session 和连接池，
+同一主机的数千次请求都要重新建立 TCP / TLS 连接。install_http_pool 把 requests 的模块级
+请求函数替换为走共享连接池的版本：
+  - 每个主机一个 keep-alive 连接池（urllib3），所有线程共享，线程安全
+  - 每个线程一个 Session（Session 本身不保证线程安全），都挂载同一个 HTTPAdapter；
+    每次请求前清空 cookies，与原来每次新建 Session 的行为一致
+  - 调用方没有指定 timeout 时使用默认的连接、读取超时（原来没有超时，可能一直挂起）
+  - 统计每个主机的请求数、新建连接数和连接复用率
+不改变接口参数和返回值，重试仍由调用方负责（适配器本身不重试）。
+"""
+
+import threading
+from urllib.parse import urlsplit
+
+import requests
+import requests.api
+from requests.adapters import HTTPAdapter
+
+# 连接池缓存的主机数、每个主机保留的连接数（不小于并发线程数，否则多出的连接用完即关闭）
+DEFAULT_POOL_HOSTS = 32
+DEFAULT_POOL_SIZE = 32
+# 默认的连接、读取超时（秒），调用方指定 timeout 时不使用
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 30.0
+
+_original_request = requests.api.request
+_installed_pool = None
+_install_lock = threading.Lock()
+
+
+class HTTPPool:
+    """
+    共享的 keep-alive 连接池
+
+    Parameters:
+    pool_size (int): 每个主机保留的连接数
+    pool_hosts (int): 缓存连接池的主机数
+    connect_timeout (float): 默认连接超时（秒）
+    read_timeout (float): 默认读取超时（秒）
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, pool_hosts=DEFAULT_POOL_HOSTS,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT):
+        self.pool_size = pool_size
+        self.pool_hosts = pool_hosts
+        self.timeout = (connect_timeout, read_timeout)
+        self.adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size, max_retries=0)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # 被挤出缓存的主机连接池的统计
+        self._retired = {}
+        self._errors = {}
+
+        pools = self.adapter.poolmanager.pools
+        dispose = pools.dispose_func
+
+        def retire(pool):
+            self._retire(pool)
+            if dispose is not None:
+                dispose(pool)
+        pools.dispose_func = retire
+
+    def session(self):
+        """当前线程的 Session"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            self._local.session = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        """与 requests.request 参数相同"""
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        session = self.session()
+        session.cookies.clear()
+        try:
+            return session.request(method=method, url=url, **kwargs)
+        except requests.RequestException:
+            host = urlsplit(url).netloc
+            with self._lock:
+                self._errors[host] = self._errors.get(host, 0) + 1
+            raise
+
+    @staticmethod
+    def _host(pool):
+        default_port = {'http': 80, 'https': 443}.get(pool.scheme)
+        return pool.host if pool.port in (None, default_port) else f"{pool.host}:{pool.port}"
+
+    def _retire(self, pool):
+        with self._lock:
+            requests_, connections = self._retired.get(self._host(pool), (0, 0))
+            self._retired[self._host(pool)] = (requests_ + pool.num_requests,
+                                               connections + pool.num_connections)
+
+    def stats(self):
+        """
+        每个主机的连接统计
+
+        Returns:
+        dict: 主机 -> {'requests': 请求数, 'connections': 新建连接数,
+                       'reused': 复用已有连接的请求数, 'reuse_ratio': 复用比例, 'errors': 失败的请求数}
+        """
+        with self._lock:
+            totals = dict(self._retired)
+            errors = dict(self._errors)
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_, connections = totals.get(self._host(pool), (0, 0))
+            totals[self._host(pool)] = (requests_ + pool.num_requests, connections + pool.num_connections)
+
+        result = {}
+        for host in sorted(set(totals) | set(errors)):
+            requests_, connections = totals.get(host, (0, 0))
+            reused = max(0, requests_ - connections)
+            result[host] = {
+                'requests': requests_,
+                'connections': connections,
+                'reused': reused,
+                'reuse_ratio': round(reused / requests_, 4) if requests_ else None,
+                'errors': errors.get(host, 0),
+            }
+        return result
+
+    def summary(self):
+        """一行文字的连接复用统计"""
+        stats = self.stats()
+        if not stats:
+            return "HTTP 连接池: 无请求"
+        parts = [f"{host} {item['requests']} 次请求/{item['connections']} 个连接"
+                 for host, item in stats.items()]
+        requests_ = sum(item['requests'] for item in stats.values())
+        connections = sum(item['connections'] for item in stats.values())
+        ratio = (requests_ - connections) / requests_ if requests_ else 0.0
+        return f"HTTP 连接池: 复用率 {ratio:.1%}（{'; '.join(parts)}）"
+
+    def close(self):
+        self.adapter.close()
+
+
+def _pooled_request(method, url, **kwargs):
+    pool = _installed_pool
+    if pool is None:
+        return _original_request(method, url, **kwargs)
+    return pool.request(method, url, **kwargs)
+
+
+def install_http_pool(pool=None):
+    """
+    让 requests.get / requests.post 等模块级函数（akshare 使用的方式）走共享连接池
+
+    Parameters:
+    pool (HTTPPool): 连接池，为 None 时按默认参数创建
+
+    Returns:
+    HTTPPool: 正在使用的连接池
+    """
+    global _installed_pool
+    with _install_lock:
+        _installed_pool = pool or HTTPPool()
+        # requests.get 等调用的是 requests.api 模块中的 request；requests.request 是同一函数的另一引用
+        requests.api.request = _pooled_request
+        requests.request = _pooled_request
+    return _installed_pool
+
+
+def uninstall_http_pool():
+    """恢复 requests 原来的行为并关闭连接池"""
+    global _installed_pool
+    with _install_lock:
+        pool, _installed_pool = _installed_pool, None
+        requests.api.request = _original_request
+        requests.request = _original_request
+    if pool is not None:
+        pool.close()
+
+
+def get_http_pool():
+    """当前安装的连接池，未安装时为 None"""
+    return _installed_pool
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+增量运行
+
+两次运行之间，真正变化的只有最新一期报告期的ROE（仍在披露期内）和随股价变化的
+估值字段（市盈率、市净率、股息率）。增量模式把每次运行的结果保存在本地缓存中：
+  - 每只通过ROE筛选的股票：ROE列表、估值、当时的最新价、估值获取时间、性价比、名次
+下次运行时：
+  - 已完成的报告期从缓存读取，只重新获取最新一期
+  - 估值优先用全市场快照；快照中没有的股票按最新价换算上次的估值
+    （市盈率、市净率与股价成正比，股息率与股价成反比），只有新股票或估值过旧的才逐只查询
+  - ROE 和估值都没变化的股票沿用上次的性价比和相对名次，只对变化的股票重新打分后归并排序
+并输出与上次排名相比的变化：新进入、掉出前 N 名的股票和名次变化。
+"""
+
+import math
+import time
+
+# 逐只查询得到的估值最多按股价换算多少天，超过后重新查询（期间可能有新财报、新分红）
+QUOTE_MAX_AGE_DAYS = 7
+
+DEFAULT_DELTA_PATH = "stock_analysis_delta.txt"
+
+# 名次变化列表最多输出的条数
+DELTA_MAX_MOVES = 200
+
+
+def _nan(value):
+    return float('nan') if value is None else value
+
+
+class StateEntry:
+    """
+    一只股票的上次运行状态
+
+    Parameters:
+    roe (list): 各期ROE + 平均ROE
+    metrics (tuple): (市盈率, 股息率, 市净率, 名称)，未获取到时为 None
+    price (float): 获取估值时的最新价，未知为 None
+    quoted_at (float): 估值实际查询的时间（按股价换算不更新），未知为 None
+    score (float): 性价比，未通过估值筛选为 None
+    rank (int): 名次（从 1 开始），未通过估值筛选为 None
+    """
+
+    __slots__ = ('roe', 'metrics', 'price', 'quoted_at', 'score', 'rank')
+
+    def __init__(self, roe, metrics=None, price=None, quoted_at=None, score=None, rank=None):
+        self.roe = roe
+        self.metrics = metrics
+        self.price = price
+        self.quoted_at = quoted_at
+        self.score = score
+        self.rank = rank
+
+
+class RunState:
+    """
+    上次运行的状态，保存在 ROECache 的 run_state / run_meta 表中
+
+    Parameters:
+    periods (list): 报告期列表
+    entries (dict): 股票代码为key，StateEntry 为value
+    finished_at (float): 运行完成时间
+    rules (str): 打分时使用的选股规则（ScreenSpec.fingerprint），规则变化后上次的性价比不能沿用
+    """
+
+    def __init__(self, periods, entries, finished_at=None, rules=None):
+        self.periods = list(periods)
+        self.entries = entries
+        self.finished_at = time.time() if finished_at is None else finished_at
+        self.rules = rules
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, code):
+        return self.entries.get(code)
+
+    def ranks(self):
+        """股票代码 -> 名次，只包含通过估值筛选的股票"""
+        return {code: entry.rank for code, entry in self.entries.items() if entry.rank is not None}
+
+    @classmethod
+    def load(cls, cache):
+        """
+        从缓存读取上次运行状态
+
+        Returns:
+        RunState: 没有保存过状态时返回 None
+        """
+        meta, rows = cache.load_run_state()
+        if meta is None:
+            return None
+        entries = {}
+        for code, roe, metrics, price, quoted_at, score, rank in rows:
+            if metrics is not None:
+                metrics = tuple(value if isinstance(value, str) else _nan(value) for value in metrics)
+            entries[code] = StateEntry([_nan(value) for value in roe], metrics, price, quoted_at, score, rank)
+        return cls(meta.get('periods', []), entries, meta.get('finished_at'), meta.get('rules'))
+
+    def save(self, cache):
+        cache.save_run_state(
+            {'periods': self.periods, 'finished_at': self.finished_at, 'rules': self.rules},
+            [(code, entry.roe, entry.metrics, entry.price, entry.quoted_at, entry.score, entry.rank)
+             for code, entry in self.entries.items()],
+        )
+
+
+def same_values(left, right):
+    """逐项比较两个列表，NaN 与 NaN 视为相等"""
+    if left is None or right is None or len(left) != len(right):
+        return False
+    for a, b in zip(left, right):
+        if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+            continue
+        if a != b:
+            return False
+    return True
+
+
+def rescale_metrics(metrics, old_price, new_price):
+    """
+    按股价变化换算估值：市盈率、市净率与股价成正比，股息率与股价成反比
+
+    Parameters:
+    metrics (tuple): (市盈率, 股息率, 市净率, 名称)
+    old_price (float): 获取估值时的价格
+    new_price (float): 当前价格
+
+    Returns:
+    tuple: 换算后的 (市盈率, 股息率, 市净率, 名称)
+    """
+    pe_ratio, dividend_yield, pb_ratio, stockname = metrics
+    ratio = new_price / old_price
+    return pe_ratio * ratio, dividend_yield / ratio, pb_ratio * ratio, stockname
+
+
+def compute_delta(previous_ranks, ranks, roe_selected, top_n):
+    """
+    与上次排名相比的变化（只看前 top_n 名）
+
+    Parameters:
+    previous_ranks (dict): 上次 股票代码 -> 名次
+    ranks (dict): 本次 股票代码 -> 名次
+    roe_selected (set): 本次通过ROE筛选的股票代码
+    top_n (int): 报告输出的名次数
+
+    Returns:
+    dict: entrants   新进入前 top_n 名 [(代码, 本次名次, 上次名次或 None)]
+          dropouts   掉出前 top_n 名 [(代码, 上次名次, 本次名次或 None, 原因)]
+          moves      仍在前 top_n 名但名次变化 [(代码, 上次名次, 本次名次)]，按变化幅度从大到小
+    """
+    previous_top = {code for code, rank in previous_ranks.items() if rank <= top_n}
+    current_top = {code for code, rank in ranks.items() if rank <= top_n}
+
+    entrants = sorted(((code, ranks[code], previous_ranks.get(code)) for code in current_top - previous_top),
+                      key=lambda item: item[1])
+
+    dropouts = []
+    for code in previous_top - current_top:
+        if code in ranks:
+            reason = f"排名降至 {ranks[code]}"
+        elif code in roe_selected:
+            reason = "未通过估值筛选"
+        else:
+            reason = "未通过ROE筛选"
+        dropouts.append((code, previous_ranks[code], ranks.get(code), reason))
+    dropouts.sort(key=lambda item: item[1])
+
+    moves = [(code, previous_ranks[code], ranks[code]) for code in current_top & previous_top
+             if previous_ranks[code] != ranks[code]]
+    moves.sort(key=lambda item: (-abs(item[1] - item[2]), item[2]))
+    return {'entrants': entrants, 'dropouts': dropouts, 'moves': moves}
+
+
+def write_delta_report(delta, names, previous_time, output_filename=DEFAULT_DELTA_PATH,
+                       top_n=None, max_moves=DELTA_MAX_MOVES):
+    """
+    把排名变化写入文本报告
+
+    Parameters:
+    delta (dict): compute_delta 的返回
+    names (dict): 股票代码 -> 名称
+    previous_time (float): 上次运行完成时间
+    """
+    def name(code):
+        return str(names.get(code, ''))
+
+    with open(output_filename, 'w', encoding='utf-8') as f:
+        f.write("=" * 80 + "\n")
+        f.write("排名变化 - 与上次运行相比\n")
+        f.write("=" * 80 + "\n")
+        f.write(f"分析时间: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+        f.write(f"上次运行: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(previous_time))}\n")
+        if top_n is not None:
+            f.write(f"比较范围: 前{top_n}名\n")
+        f.write(f"新进入 {len(delta['entrants'])} 只，掉出 {len(delta['dropouts'])} 只，"
+                f"名次变化 {len(delta['moves'])} 只\n")
+        f.write("=" * 80 + "\n\n")
+
+        f.write("[新进入]\n")
+        f.write("本次排名,代码,公司名称,上次排名\n")
+        for code, rank, previous in delta['entrants']:
+            f.write(f"{rank},'{code},{name(code)},{previous if previous is not None else '-'}\n")
+
+        f.write("\n[掉出]\n")
+        f.write("上次排名,代码,公司名称,原因\n")
+        for code, previous, rank, reason in delta['dropouts']:
+            f.write(f"{previous},'{code},{name(code)},{reason}\n")
+
+        f.write("\n[名次变化]\n")
+        f.write("本次排名,代码,公司名称,上次排名,变化\n")
+        for code, previous, rank in delta['moves'][:max_moves]:
+            f.write(f"{rank},'{code},{name(code)},{previous},{previous - rank:+d}\n")
+        if len(delta['moves']) > max_moves:
+            f.write(f"... 另有 {len(delta['moves']) - max_moves} 只股票名次变化\n")
+
+    print(f"排名变化已保存到文件: {output_filename}")
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+股票行业映射
+
+按东方财富行业板块批量获取 股票代码 -> 行业：
+  - ak.stock_board_industry_name_em()          行业板块列表（1 次）
+  - ak.stock_board_industry_cons_em(板块名称)   每个行业的成分股（每个行业 1 次）
+行业名称与 ak.stock_individual_info_em 返回的 '行业' 字段同属东方财富行业分类。
+结果带 TTL 保存在本地缓存中；批量映射中缺失的股票才并发逐只查询。
+"""
+
+import concurrent.futures
+import time
+
+from roe_datasource import get_data_source
+from roe_metrics import report_missing
+
+
+# 行业映射有效期（天）
+INDUSTRY_MAX_AGE_DAYS = 7
+
+# 批量获取成分股的线程数
+BOARD_WORKERS = 4
+
+
+def _fetch_board_constituents(board_name):
+    df = get_data_source().stock_board_industry_cons_em(symbol=board_name)
+    return board_name, df['代码'].astype(str).tolist()
+
+
+def fetch_industry_map_bulk(max_workers=BOARD_WORKERS):
+    """
+    按行业板块成分股构建 股票代码 -> 行业 映射
+
+    Returns:
+    dict: 股票代码为key，行业名称为value；板块列表获取失败时返回空字典
+    """
+    try:
+        boards = get_data_source().stock_board_industry_name_em()['板块名称'].tolist()
+    except Exception as e:
+        print(f"获取行业板块列表失败: {e}")
+        return {}
+
+    industry_map = {}
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_fetch_board_constituents, board): board for board in boards}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                board_name, codes = future.result()
+            except Exception:
+                failed.append(futures[future])
+                continue
+            for code in codes:
+                industry_map.setdefault(code, board_name)
+
+    print(f"行业板块 {len(boards)} 个（失败 {len(failed)} 个），覆盖 {len(industry_map)} 只股票")
+    return industry_map
+
+
+def lookup_industries(codes, lookup, max_workers=10, deadline=None):
+    """
+    并发逐只查询行业
+
+    Parameters:
+    codes (list): 股票代码
+    lookup (callable): 单只股票查询函数，返回行业名称，失败返回 NaN
+    max_workers (int): 线程数
+    deadline (Deadline): 截止时间，到期后不再等待，未完成的股票记入运行指标
+
+    Returns:
+    dict: 查询成功的 股票代码 -> 行业
+    """
+    found = {}
+    if not codes:
+        return found
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    futures = {executor.submit(lookup, code): code for code in codes}
+    remaining = dict(futures)
+    try:
+        timeout = deadline.remaining() if deadline is not None else None
+        for future in concurrent.futures.as_completed(futures, timeout=timeout):
+            code = remaining.pop(future)
+            try:
+                industry = future.result()
+            except Exception:
+                continue
+            if isinstance(industry, str) and industry not in ('', 'nan', 'None'):
+                found[code] = industry
+    except concurrent.futures.TimeoutError:
+        report_missing('industry_lookup', remaining.values())
+    finally:
+        # 截止时间已到时排队的查询取消，在途的查询不再等待
+        executor.shutdown(wait=False, cancel_futures=True)
+    return found
+
+
+def load_industry_map_bulk(cache=None, max_age_days=INDUSTRY_MAX_AGE_DAYS, refresh=False):
+    """
+    读取完整的批量行业映射，缓存不存在或过期时按行业板块重新获取
+
+    Returns:
+    dict: 股票代码 -> 行业
+    """
+    if cache is not None and not refresh:
+        industry_map, updated_at = cache.load_industries()
+        if industry_map and time.time() - updated_at < max_age_days * 86400:
+            return industry_map
+    else:
+        industry_map = {}
+
+    bulk = fetch_industry_map_bulk()
+    if bulk:
+        industry_map = bulk
+        if cache is not None:
+            cache.save_industries(bulk, replace=True)
+    return industry_map
+
+
+def load_industry_map(codes, lookup, cache=None, max_age_days=INDUSTRY_MAX_AGE_DAYS, refresh=False,
+                      deadline=None):
+    """
+    为 codes 准备好行业映射，之后写报告时不再需要网络请求
+
+    Parameters:
+    codes (list): 需要行业信息的股票代码
+    lookup (callable): 批量映射缺失时使用的单只查询函数
+    cache (ROECache): 本地缓存，为 None 时每次都重新获取
+    max_age_days (float): 缓存有效期（天）
+    refresh (bool): 强制刷新
+    deadline (Deadline): 逐只查询的截止时间
+
+    Returns:
+    dict: 股票代码 -> 行业；仍查不到的股票不在字典中
+    """
+    industry_map = dict(load_industry_map_bulk(cache, max_age_days, refresh))
+
+    missing = [code for code in codes if code not in industry_map]
+    if missing:
+        print(f"行业映射缺少 {len(missing)} 只股票，逐只查询...")
+        found = lookup_industries(missing, lookup, deadline=deadline)
+        industry_map.update(found)
+        if cache is not None and found:
+            cache.save_industries(found)
+
+    return {code: industry_map[code] for code in codes if code in industry_map}
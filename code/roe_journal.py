@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+运行日志（断点续跑）
+
+每获取到一个报告期的ROE数据、每完成一只股票的估值查询，就往本地 JSON Lines
+文件追加一行并立即写出。任务中途失败后用 --resume 重新运行时，先读回日志，
+只请求缺失或已过期的数据。
+
+每行格式：
+  {"type": "period",  "ts": 时间戳, "date": "20241231", "data": {代码: ROE}}
+  {"type": "metrics", "ts": 时间戳, "code": "600000", "metrics": [市盈率, 股息率, 市净率, 名称]}
+"""
+
+import json
+import os
+import threading
+import time
+
+from roe_cache import is_period_finished
+
+DEFAULT_JOURNAL_PATH = os.path.join(".roe_cache", "journal.jsonl")
+
+# 日志中估值数据的有效时长（小时），超过后续跑时重新请求
+DEFAULT_MAX_AGE_HOURS = 12
+
+
+class RunJournal:
+    """
+    追加写入的运行日志，线程安全
+
+    Parameters:
+    path (str): 日志文件路径
+    resume (bool): True 时读回已有日志并继续追加；False 时清空重新开始
+    max_age_hours (float): 估值数据和未完成报告期的有效时长（小时）
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH, resume=False, max_age_hours=DEFAULT_MAX_AGE_HOURS):
+        self.path = path
+        self.max_age_hours = max_age_hours
+        self._periods = {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        truncated = self._load() if resume else False
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        if truncated:
+            # 半行记录之后另起一行，新追加的记录不会接在它后面一起损坏
+            self._file.write("\n")
+
+    def _load(self):
+        """读回已有日志；返回最后一行是否没有写完（缺少换行符）"""
+        if not os.path.exists(self.path):
+            return False
+        skipped = 0
+        line = ""
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 进程被杀时最后一行可能只写了一半
+                    skipped += 1
+                    continue
+                if entry.get('type') == 'period':
+                    self._periods[entry['date']] = (entry['ts'], entry['data'])
+                elif entry.get('type') == 'metrics':
+                    self._metrics[entry['code']] = (entry['ts'], tuple(entry['metrics']))
+        print(f"读取运行日志 {self.path}: {len(self._periods)} 个报告期，"
+              f"{len(self._metrics)} 只股票的估值数据" + (f"，跳过 {skipped} 行损坏记录" if skipped else ""))
+        return bool(line) and not line.endswith("\n")
+
+    def _is_fresh(self, ts):
+        return time.time() - ts < self.max_age_hours * 3600
+
+    def _append(self, entry):
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            # 关闭后在后台结束的请求不再记录
+            if self._file.closed:
+                return
+            self._file.write(line + "\n")
+            # 只 flush 不 fsync：进程被杀时已写入的行不会丢，且不拖慢查询线程
+            self._file.flush()
+
+    def get_period(self, date):
+        """日志中的报告期数据；不存在或已过期返回 None"""
+        with self._lock:
+            entry = self._periods.get(date)
+        if entry is None:
+            return None
+        ts, data = entry
+        if is_period_finished(date) or self._is_fresh(ts):
+            return data
+        return None
+
+    def record_period(self, date, roe_dict):
+        ts = time.time()
+        data = {str(code): _json_number(roe) for code, roe in roe_dict.items()}
+        with self._lock:
+            self._periods[date] = (ts, data)
+        self._append({'type': 'period', 'ts': ts, 'date': date, 'data': data})
+
+    def get_metrics(self, code):
+        """日志中的估值数据 (市盈率, 股息率, 市净率, 名称)；不存在或已过期返回 None"""
+        with self._lock:
+            entry = self._metrics.get(code)
+        if entry is None or not self._is_fresh(entry[0]):
+            return None
+        return tuple(float('nan') if value is None else value for value in entry[1])
+
+    def record_metrics(self, code, metrics):
+        ts = time.time()
+        values = [_json_number(value) if not isinstance(value, str) else value for value in metrics]
+        with self._lock:
+            self._metrics[code] = (ts, tuple(values))
+        self._append({'type': 'metrics', 'ts': ts, 'code': code, 'metrics': values})
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+def _json_number(value):
+    """NaN、None、无法转换的值写成 null，保证日志是标准 JSON"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if value != value else value
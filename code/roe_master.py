@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+证券主表
+
+股票代码 -> 交易所、板块、名称、上市状态。
+交易所和板块按沪深北交易所的代码段规则确定，名称和上市状态来自
+全市场行情列表 ak.stock_zh_a_spot_em()（一次请求），定期刷新后保存在本地缓存中。
+query_stock_metrics 据此直接拼出正确的雪球代码，不再按首位数字逐个猜测交易所。
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from roe_datasource import get_data_source
+
+# 代码段规则：(前缀, 交易所, 板块)，按前缀长度从长到短匹配
+BOARD_RULES = [
+    ('920', 'BJ', 'bse'),       # 北交所新代码段
+    ('600', 'SH', 'main'), ('601', 'SH', 'main'), ('603', 'SH', 'main'), ('605', 'SH', 'main'),
+    ('688', 'SH', 'star'), ('689', 'SH', 'star'),
+    ('000', 'SZ', 'main'), ('001', 'SZ', 'main'), ('002', 'SZ', 'main'), ('003', 'SZ', 'main'),
+    ('300', 'SZ', 'chinext'), ('301', 'SZ', 'chinext'), ('302', 'SZ', 'chinext'),
+    ('200', 'SZ', 'b_share'), ('201', 'SZ', 'b_share'),
+    ('900', 'SH', 'b_share'),
+    ('8', 'BJ', 'bse'), ('4', 'BJ', 'bse'),  # 北交所 / 新三板
+    # 其余 2 / 9 开头的代码与原来的规则一致，整段按 B 股排除
+    ('2', 'SZ', 'b_share'), ('9', 'SH', 'b_share'),
+]
+
+# 不参与选股的板块：北交所、新三板、B股
+EXCLUDED_BOARDS = ('bse', 'b_share')
+
+# 主表有效期（天）
+MASTER_MAX_AGE_DAYS = 7
+
+LISTED = 'listed'
+SUSPENDED = 'suspended'
+
+
+def classify_code(code):
+    """
+    按代码段判断交易所和板块
+
+    Returns:
+    tuple: (交易所, 板块)；无法识别的代码为 ('SH', 'unknown')
+    """
+    code = str(code)
+    for prefix, exchange, board in BOARD_RULES:
+        if code.startswith(prefix):
+            return exchange, board
+    return 'SH', 'unknown'
+
+
+class SecuritiesMaster:
+    """
+    证券主表
+
+    Parameters:
+    records (dict): 股票代码为key，(交易所, 板块, 名称, 上市状态) 为value
+    updated_at (float): 刷新时间（时间戳）
+    """
+
+    def __init__(self, records, updated_at=None):
+        self.records = records
+        self.updated_at = time.time() if updated_at is None else updated_at
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, code):
+        return code in self.records
+
+    def exchange(self, code):
+        record = self.records.get(code)
+        return record[0] if record else classify_code(code)[0]
+
+    def board(self, code):
+        record = self.records.get(code)
+        return record[1] if record else classify_code(code)[1]
+
+    def name(self, code):
+        record = self.records.get(code)
+        return record[2] if record else None
+
+    def symbol(self, code):
+        """雪球格式的代码，例如 SH600000、SZ000001、BJ830799"""
+        return f"{self.exchange(code)}{code}"
+
+    def is_stale(self, max_age_days=MASTER_MAX_AGE_DAYS):
+        return time.time() - self.updated_at > max_age_days * 86400
+
+    def board_mask(self, codes, excluded=EXCLUDED_BOARDS):
+        """
+        保留的股票掩码：板块不在 excluded 中，且主表非空时必须在主表中（已退市的不再保留）
+        """
+        codes = np.asarray(codes, dtype=str)
+        boards = np.array([self.board(code) for code in codes.tolist()], dtype=object)
+        mask = ~np.isin(boards, list(excluded))
+        if self.records:
+            mask &= np.array([code in self.records for code in codes.tolist()], dtype=bool)
+        return mask
+
+    @classmethod
+    def from_spot(cls, spot_df):
+        """
+        由 ak.stock_zh_a_spot_em() 的结果构建主表；最新价为空的视为停牌
+        """
+        prices = pd.to_numeric(spot_df['最新价'], errors='coerce')
+        records = {}
+        for code, name, price in zip(spot_df['代码'].astype(str), spot_df['名称'], prices):
+            exchange, board = classify_code(code)
+            status = SUSPENDED if np.isnan(price) else LISTED
+            records[code] = (exchange, board, str(name), status)
+        return cls(records)
+
+
+def load_securities_master(cache=None, max_age_days=MASTER_MAX_AGE_DAYS, refresh=False):
+    """
+    读取证券主表，缓存不存在或过期时从全市场行情列表刷新
+
+    Parameters:
+    cache (ROECache): 本地缓存，为 None 时每次都重新获取
+    max_age_days (float): 主表有效期（天）
+    refresh (bool): 强制刷新
+
+    Returns:
+    SecuritiesMaster: 获取失败且无缓存时返回空主表（此时交易所按代码段规则判断）
+    """
+    cached = None
+    if cache is not None:
+        records, updated_at = cache.load_securities()
+        if records:
+            # 交易所和板块按当前的代码段规则重新判断，不沿用缓存中的（规则可能已更新）
+            records = {code: (*classify_code(code), name, status)
+                       for code, (_, _, name, status) in records.items()}
+            cached = SecuritiesMaster(records, updated_at)
+            if not refresh and not cached.is_stale(max_age_days):
+                print(f"从本地缓存读取证券主表，共 {len(cached)} 只股票")
+                return cached
+
+    try:
+        master = SecuritiesMaster.from_spot(get_data_source().stock_zh_a_spot_em())
+    except Exception as e:
+        print(f"刷新证券主表失败: {e}")
+        return cached if cached is not None else SecuritiesMaster({})
+
+    print(f"证券主表已刷新，共 {len(master)} 只股票")
+    if cache is not None and len(master):
+        cache.save_securities(master.records)
+    return master
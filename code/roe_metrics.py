@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+运行指标
+
+记录一次运行中各阶段的耗时、各上游接口的调用情况，运行结束后写成 JSON：
+  - 阶段：墙钟时间、CPU 时间、执行次数（报告期下载、ROE筛选、估值查询、行业查询、写报告…）
+  - 接口：调用次数、失败次数（按异常类型）、重试次数、延迟直方图和分位数
+另外提供限频的进度输出，替代逐只股票打印。
+
+全局实例由 get_run_metrics() 取得，各模块直接记录，不需要层层传参。
+"""
+
+import bisect
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+DEFAULT_METRICS_PATH = "run_metrics.json"
+
+# 延迟直方图的桶上界（秒），最后一个桶收集超过 60 秒的调用
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 进度输出的最小间隔（秒）
+DEFAULT_PROGRESS_INTERVAL = 5.0
+
+
+class LatencyHistogram:
+    """
+    固定桶的延迟直方图；另保留全部样本用于计算分位数（单次运行的调用量在几万次以内）
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.samples = []
+        self.total = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.samples.append(seconds)
+        self.total += seconds
+
+    def quantile(self, q):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def to_dict(self):
+        labels = [f"<={bound}" for bound in self.buckets] + [f">{self.buckets[-1]}"]
+        count = len(self.samples)
+        return {
+            'count': count,
+            'mean': self.total / count if count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': max(self.samples) if self.samples else None,
+            'buckets': dict(zip(labels, self.counts)),
+        }
+
+
+class RunMetrics:
+    """
+    一次运行的指标，线程安全
+
+    阶段的 CPU 时间默认取进程 CPU 时间（包含该阶段期间其他线程的工作）；
+    在线程池中并发执行的子阶段用 per_thread=True 只统计本线程。
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._endpoints = {}
+        self._counters = {}
+        self._missing = {}
+
+    @contextlib.contextmanager
+    def stage(self, name, per_thread=False):
+        """
+        统计一个阶段的墙钟时间和 CPU 时间，同名阶段累加
+
+        用法:
+            with get_run_metrics().stage('roe_screen'):
+                ...
+        """
+        cpu_clock = time.thread_time if per_thread else time.process_time
+        wall_start, cpu_start = time.perf_counter(), cpu_clock()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall_start, cpu_clock() - cpu_start
+            with self._lock:
+                stage = self._stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'count': 0})
+                stage['wall'] += wall
+                stage['cpu'] += cpu
+                stage['count'] += 1
+
+    def _endpoint(self, endpoint):
+        # 调用方已持有锁
+        if endpoint not in self._endpoints:
+            self._endpoints[endpoint] = {
+                'calls': 0, 'failures': 0, 'retries': 0, 'errors': {},
+                'latency': LatencyHistogram(),
+            }
+        return self._endpoints[endpoint]
+
+    def record_call(self, endpoint, latency, error=None):
+        """记录一次上游调用；error 为调用抛出的异常"""
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats['calls'] += 1
+            stats['latency'].add(latency)
+            if error is not None:
+                stats['failures'] += 1
+                kind = type(error).__name__
+                stats['errors'][kind] = stats['errors'].get(kind, 0) + 1
+
+    def record_retry(self, endpoint, count=1):
+        """记录一次（或 count 次）重试"""
+        with self._lock:
+            self._endpoint(endpoint)['retries'] += count
+
+    def increment(self, name, count=1):
+        """其他计数，例如缓存命中、快照命中"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + count
+
+    def record_missing(self, stage, items):
+        """记录阶段截止时间已到时没有完成的项目（例如股票代码），同一阶段累加"""
+        with self._lock:
+            self._missing.setdefault(stage, []).extend(items)
+
+    def to_dict(self):
+        with self._lock:
+            stages = {name: dict(stage) for name, stage in self._stages.items()}
+            endpoints = {}
+            for name, stats in self._endpoints.items():
+                endpoints[name] = {key: value for key, value in stats.items() if key != 'latency'}
+                endpoints[name]['errors'] = dict(stats['errors'])
+                endpoints[name]['latency'] = stats['latency'].to_dict()
+            counters = dict(self._counters)
+            missing = {stage: list(items) for stage, items in self._missing.items()}
+        return {
+            'started_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at)),
+            'elapsed': time.perf_counter() - self._start,
+            'stages': stages,
+            'endpoints': endpoints,
+            'counters': counters,
+            'missing': missing,
+        }
+
+    def write_json(self, path, **extra):
+        """
+        写出指标文件
+
+        Parameters:
+        path (str): 输出路径
+        extra: 追加到顶层的字段，例如运行参数、退出状态
+        """
+        data = self.to_dict()
+        data.update(extra)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        print(f"运行指标已保存到文件: {path}")
+
+    def summary(self):
+        """各阶段耗时的简短文字汇总"""
+        with self._lock:
+            parts = [f"{name} {stage['wall']:.1f}s" for name, stage in self._stages.items()
+                     if '/' not in name]
+        return "阶段耗时: " + ", ".join(parts) if parts else "阶段耗时: 无"
+
+
+class ProgressReporter:
+    """
+    限频的进度输出：多线程调用 update()，至多每 interval 秒打印一行
+
+    Parameters:
+    label (str): 进度说明，例如 "估值查询"
+    total (int): 总数，未知时为 None
+    interval (float): 两次输出之间的最小间隔（秒）
+    """
+
+    def __init__(self, label, total=None, interval=None):
+        self.label = label
+        self.total = total
+        self.interval = DEFAULT_PROGRESS_INTERVAL if interval is None else interval
+        self.done = 0
+        self.failed = 0
+        self._start = time.monotonic()
+        self._last = self._start
+        self._lock = threading.Lock()
+
+    def update(self, count=1, failed=0):
+        with self._lock:
+            self.done += count
+            self.failed += failed
+            now = time.monotonic()
+            if now - self._last < self.interval:
+                return
+            self._last = now
+            line = self._line(now)
+        print(line)
+
+    def _line(self, now):
+        elapsed = now - self._start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        total = f"/{self.total}" if self.total is not None else ""
+        failed = f"，失败 {self.failed}" if self.failed else ""
+        return f"{self.label}: {self.done}{total}{failed}，{rate:.1f} 个/秒，已用 {elapsed:.0f} 秒"
+
+    def close(self):
+        """打印最终进度"""
+        with self._lock:
+            line = self._line(time.monotonic())
+        print(line)
+
+
+_run_metrics = RunMetrics()
+_progress_interval = DEFAULT_PROGRESS_INTERVAL
+
+
+def get_run_metrics():
+    """当前运行的指标"""
+    return _run_metrics
+
+
+def reset_run_metrics():
+    """重新开始记录，返回新的指标对象"""
+    global _run_metrics
+    _run_metrics = RunMetrics()
+    return _run_metrics
+
+
+def set_progress_interval(seconds):
+    """设置 progress() 创建的进度输出的间隔"""
+    global _progress_interval
+    _progress_interval = seconds
+
+
+def progress(label, total=None):
+    """按全局间隔创建进度输出"""
+    return ProgressReporter(label, total, interval=_progress_interval)
+
+
+def report_missing(stage, items):
+    """打印并记录阶段截止时间已到时没有完成的项目"""
+    if not items:
+        return
+    items = sorted(items)
+    print(f"{stage} 截止时间已到，{len(items)} 只股票未完成: {', '.join(items)}")
+    _run_metrics.record_missing(stage, items)
+
+
+def peak_memory_mb():
+    """进程的峰值常驻内存（MB），不支持的平台（Windows）返回 None"""
+    # Linux 优先读 VmHWM：ru_maxrss 在 exec 后仍保留 fork 出的父进程的内存，子进程中偏大
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+结果输出
+
+排名结果统一整理成带类型的行（dict），再交给不同的输出：
+  - 文本报告 stock_analysis_results.txt（原有格式，前 REPORT_TOP_N 名）
+  - CSV：标准表头，每列一个字段，可直接用 pandas.read_csv / Excel 打开
+  - Parquet / Arrow IPC：带类型的列式文件，包含全部通过估值筛选的股票，可只读部分列；
+    需要安装 pyarrow（可选依赖，未安装时跳过并提示）
+  - JSON Lines：打分完成一只写一行并立即写出，运行结束前即可开始读取
+
+增强数据列表的格式为 各期ROE + [平均ROE, 市盈率, 股息率, 市净率, 性价比, 名称]。
+"""
+
+import csv
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_CSV_PATH = "stock_analysis_results.csv"
+
+# 除各期ROE外的列：(列名, 类型)
+BASE_COLUMNS = [
+    ('rank', 'int'),
+    ('code', 'str'),
+    ('name', 'str'),
+    ('industry', 'str'),
+]
+VALUE_COLUMNS = [
+    ('avg_roe', 'float'),
+    ('pe', 'float'),
+    ('dividend_yield', 'float'),
+    ('pb', 'float'),
+    ('value_ratio', 'float'),
+]
+
+
+def roe_column(period):
+    """报告期对应的列名，例如 roe_20250930"""
+    return f"roe_{period}"
+
+
+def result_columns(periods):
+    """
+    输出的列
+
+    Parameters:
+    periods (list): 报告期列表
+
+    Returns:
+    list: [(列名, 类型), ...]，类型为 'int' / 'str' / 'float'
+    """
+    return BASE_COLUMNS + [(roe_column(period), 'float') for period in periods] + VALUE_COLUMNS
+
+
+def _float_or_none(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+def _str_or_none(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    value = str(value)
+    return None if value in ('', 'nan', 'None') else value
+
+
+def result_row(code, data, periods, rank=None, industry=None):
+    """
+    一只股票的输出行
+
+    Parameters:
+    code (str): 股票代码
+    data (list): 增强数据列表
+    periods (list): 报告期列表，与 data 中各期ROE一一对应
+    rank (int): 名次，未排名时为 None
+    industry (str): 行业
+
+    Returns:
+    dict: 列名为key；NaN、无效字符串为 None
+    """
+    row = {
+        'rank': rank,
+        'code': str(code),
+        'name': _str_or_none(data[-1]),
+        'industry': _str_or_none(industry),
+    }
+    for period, roe in zip(periods, data[:len(periods)]):
+        row[roe_column(period)] = _float_or_none(roe)
+    avg_roe, pe_ratio, dividend_yield, pb_ratio, value_ratio = data[-6:-1]
+    row.update({
+        'avg_roe': _float_or_none(avg_roe),
+        'pe': _float_or_none(pe_ratio),
+        'dividend_yield': _float_or_none(dividend_yield),
+        'pb': _float_or_none(pb_ratio),
+        'value_ratio': _float_or_none(value_ratio),
+    })
+    return row
+
+
+def result_rows(ranked, periods, industry_map=None):
+    """
+    排名结果的输出行
+
+    Parameters:
+    ranked (list): 按名次排好的 [(股票代码, 增强数据列表), ...]
+    periods (list): 报告期列表
+    industry_map (dict): 股票代码 -> 行业
+
+    Yields:
+    dict: result_row 的返回，rank 从 1 开始
+    """
+    industry_map = industry_map or {}
+    for rank, (code, data) in enumerate(ranked, start=1):
+        yield result_row(code, data, periods, rank=rank, industry=industry_map.get(code))
+
+
+# 原来的文本报告表头中 6 个报告期的列名
+TEXT_REPORT_ROE_HEADER = "ROE20年报,ROE21年报,ROE22年报,ROE23年报,ROE24年报,ROE25半年报"
+
+
+def write_text_report(ranked, original_count, passed_count, industry_map,
+                      output_filename, top_n, value_rules=None, periods=None):
+    """
+    文本报告：前 top_n 名，格式与原来的 stock_analysis_results.txt 相同；
+    报告期不是 6 个时各期ROE的列数随之变化，表头按报告期命名
+
+    Parameters:
+    ranked (list): 按名次排好的 [(股票代码, 增强数据列表), ...]
+    original_count (int): 通过ROE清洗的股票数量
+    passed_count (int): 通过估值筛选的股票数量
+    industry_map (dict): 股票代码 -> 行业，写入过程不访问网络
+    value_rules (str): 自定义估值筛选规则的说明，为 None 时为默认规则
+    periods (list): 报告期列表，用于表头；为 None 时按数据中的ROE个数编号
+    """
+    n_periods = len(periods) if periods is not None else (len(ranked[0][1]) - 6 if ranked else 6)
+    if n_periods == 6:
+        roe_header = TEXT_REPORT_ROE_HEADER
+    elif periods is not None:
+        roe_header = ",".join(f"ROE{period}" for period in periods)
+    else:
+        roe_header = ",".join(f"ROE{i + 1}" for i in range(n_periods))
+
+    with open(output_filename, 'w', encoding='utf-8') as f:
+        # 写入文件头信息
+        f.write("=" * 80 + "\n")
+        f.write("股票分析结果 - 按性价比排序\n")
+        f.write("=" * 80 + "\n")
+        f.write(f"分析时间: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+        f.write(f"总股票数量: {original_count} (沪深: 持续五年盈利， 平均ROE大于3% )  \n")
+        if value_rules is None:
+            f.write(f"筛选后股票数量: {passed_count} (市盈率 小于 200 ; 股息率 大于 0.1% ;  市净率 小于33  ) \n")
+        else:
+            f.write(f"筛选后股票数量: {passed_count} ({value_rules}) \n")
+        f.write(f"输出排名{top_n}只股票\n")
+        f.write("=" * 80 + "\n\n")
+
+        # 写入表头
+        f.write(f"排名,代码,公司名称,行业,{roe_header},,平均ROE,,市盈率动,,股息率TTM,,市净率,,性价比\n")
+
+        # 写入前1500个结果
+        for i, (code, data) in enumerate(ranked[:top_n]):
+            # 增强数据列表从末尾数：各期ROE之后依次为 平均ROE、市盈率、股息率、市净率、性价比、名称
+            company_name = data[-1] if len(data) > 6 else "未知公司"
+            company_hangye = industry_map.get(code, np.nan)
+            avg_roe, pe_ratio, dividend_yield, pb_ratio, value_ratio = data[-6:-1]
+
+            # 格式化数据行
+            row_data = [
+                f"{i+1}",  # 排名
+                "'"+str(code),  # 代码
+                str(company_name),  # 公司名称
+                str(company_hangye),  # 公司行业
+                *[f"{x:.2f}" if not np.isnan(x) else "NaN" for x in data[:-6]],  # 各期ROE
+                f"平均,{avg_roe:.2f}" if not np.isnan(avg_roe) else "NaN",  # 平均ROE
+                f"市盈,{pe_ratio:.2f}" if not np.isnan(pe_ratio) else "NaN",  # 市盈率
+                f"股息,{dividend_yield:.2f}" if not np.isnan(dividend_yield) else "NaN",  # 股息率
+                f"市净,{pb_ratio:.2f}" if not np.isnan(pb_ratio) else "NaN",  # 市净率
+                f"价值,{value_ratio:.3f}" if not np.isnan(value_ratio) else "NaN"   # 性价比
+            ]
+
+            # 写入文件
+            f.write(",".join(row_data) + "\n")
+
+    print(f"\n结果已保存到文件: {output_filename}")
+
+
+def write_csv(rows, columns, output_filename=DEFAULT_CSV_PATH):
+    """
+    标准 CSV：第一行为列名，缺失值为空；UTF-8 带 BOM，Excel 可直接打开
+
+    Parameters:
+    rows (iterable): result_row 的返回
+    columns (list): result_columns 的返回
+
+    Returns:
+    int: 写入的行数
+    """
+    names = [name for name, _ in columns]
+    count = 0
+    with open(output_filename, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=names, extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({name: ('' if row.get(name) is None else row[name]) for name in names})
+            count += 1
+    print(f"CSV 已保存到文件: {output_filename}（{count} 行）")
+    return count
+
+
+def _arrow_schema(pa, columns):
+    types = {'int': pa.int32(), 'str': pa.string(), 'float': pa.float64()}
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+def write_columnar(rows, columns, output_filename):
+    """
+    带类型的列式文件：扩展名为 .parquet 时写 Parquet，.arrow / .feather 时写 Arrow IPC
+
+    Parameters:
+    rows (iterable): result_row 的返回
+    columns (list): result_columns 的返回
+
+    Returns:
+    int: 写入的行数；未安装 pyarrow 时返回 None
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        print(f"未安装 pyarrow，跳过 {output_filename}（pip install pyarrow）")
+        return None
+
+    schema = _arrow_schema(pa, columns)
+    table = pa.Table.from_pylist(list(rows), schema=schema)
+    extension = os.path.splitext(output_filename)[1].lower()
+    if extension in ('.arrow', '.feather', '.ipc'):
+        import pyarrow.feather as feather
+        feather.write_feather(table, output_filename, compression='uncompressed')
+    else:
+        import pyarrow.parquet as pq
+        pq.write_table(table, output_filename)
+    print(f"列式结果已保存到文件: {output_filename}（{table.num_rows} 行）")
+    return table.num_rows
+
+
+class JsonLinesWriter:
+    """
+    逐行写出打分结果的 JSON Lines 文件，线程安全
+
+    每只股票打分完成（通过估值筛选）时写一行并立即 flush，读取方可以边写边读；
+    最终名次在运行结束后才确定，因此行中没有 rank，需要时按 value_ratio 排序。
+
+    Parameters:
+    path (str): 输出路径
+    periods (list): 报告期列表
+    """
+
+    def __init__(self, path, periods):
+        self.path = path
+        self.periods = list(periods)
+        self.count = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def write(self, code, data, industry=None):
+        row = result_row(code, data, self.periods, industry=industry)
+        del row['rank']
+        line = json.dumps(row, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+                print(f"JSON Lines 已保存到文件: {self.path}（{self.count} 行）")
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+ROE 面板数据
+
+把多个报告期的 {股票代码: ROE} 字典整理成：
+  - codes:  股票代码数组，形状 (股票数,)
+  - values: float64 矩阵，形状 (股票数, 报告期数)，缺失为 NaN
+年化、均值、最小值都用数组运算完成，不再对每只股票做 Python 循环；
+阈值筛选见 roe_rules。
+"""
+
+import numpy as np
+
+
+class ROEPanel:
+    """
+    股票 x 报告期 的 ROE 矩阵
+
+    Parameters:
+    codes (array-like): 股票代码
+    periods (list): 报告期列表，格式为YYYYMMDD，与 values 的列一一对应
+    values (np.ndarray): float64 矩阵，形状 (len(codes), len(periods))
+    """
+
+    def __init__(self, codes, periods, values):
+        self.codes = np.asarray(codes, dtype=str)
+        self.periods = list(periods)
+        self.values = np.asarray(values, dtype=np.float64)
+        if self.values.shape != (len(self.codes), len(self.periods)):
+            raise ValueError(
+                f"values 形状 {self.values.shape} 与 codes/periods "
+                f"({len(self.codes)}, {len(self.periods)}) 不一致"
+            )
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def from_period_dicts(cls, roe_data_by_year, periods):
+        """
+        由 get_ROE 返回的各报告期字典构建面板
+
+        Parameters:
+        roe_data_by_year (dict): 报告期为key，{股票代码: ROE} 为value
+        periods (list): 报告期顺序
+
+        Returns:
+        ROEPanel: 股票代码为全部报告期的并集（已排序），缺失数据为 NaN
+        """
+        code_parts = []
+        value_parts = []
+        column_parts = []
+        for column, period in enumerate(periods):
+            data = roe_data_by_year.get(period, {})
+            code_parts.append(np.array(list(data.keys()), dtype=str))
+            value_parts.append(_to_float_array(list(data.values())))
+            column_parts.append(np.full(len(data), column, dtype=np.intp))
+
+        if not code_parts or sum(len(part) for part in code_parts) == 0:
+            return cls(np.array([], dtype=str), periods, np.empty((0, len(periods))))
+
+        all_codes = np.concatenate(code_parts)
+        codes, rows = np.unique(all_codes, return_inverse=True)
+        values = np.full((len(codes), len(periods)), np.nan)
+        values[rows, np.concatenate(column_parts)] = np.concatenate(value_parts)
+        return cls(codes, periods, values)
+
+    def select(self, mask):
+        """按布尔掩码或下标取子集"""
+        return ROEPanel(self.codes[mask], self.periods, self.values[mask])
+
+    def annualize_last(self):
+        """
+        最新一期按报告期换算成全年：一季报 ROE / 1 * 4，半年报 / 2 * 4，三季报 / 3 * 4，年报不变
+
+        Returns:
+        ROEPanel: 新面板，原面板不变
+        """
+        values = self.values.copy()
+        values[:, -1] = annualize(values[:, -1], self.periods[-1])
+        return ROEPanel(self.codes, self.periods, values)
+
+    def valid_count(self):
+        """每只股票的有效（非 NaN）报告期数"""
+        return np.count_nonzero(~np.isnan(self.values), axis=1)
+
+    def mean(self):
+        """忽略 NaN 的逐行均值，全部缺失的行为 NaN"""
+        count = self.valid_count()
+        total = np.where(np.isnan(self.values), 0.0, self.values).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+    def min(self):
+        """忽略 NaN 的逐行最小值，全部缺失的行为 NaN"""
+        filled = np.where(np.isnan(self.values), np.inf, self.values).min(axis=1, initial=np.inf)
+        return np.where(self.valid_count() > 0, filled, np.nan)
+
+    def to_dict(self, extra=None):
+        """
+        转回旧接口的字典：股票代码 -> [各期ROE..., *extra]
+
+        Parameters:
+        extra (list): 追加在每行末尾的列（每个元素为与 codes 等长的数组）
+        """
+        columns = [self.values] + [np.asarray(col, dtype=np.float64)[:, None] for col in (extra or [])]
+        rows = np.hstack(columns).tolist()
+        return dict(zip(self.codes.tolist(), rows))
+
+
+def reported_quarters(period):
+    """
+    报告期覆盖的季度数（财报数据为年初至报告期末的累计值）
+
+    例如 '20250331' -> 1，'20250630' -> 2，'20250930' -> 3，'20251231' -> 4
+    """
+    month = int(str(period)[4:6])
+    if month not in (3, 6, 9, 12):
+        raise ValueError(f"不是季度末报告期: {period}")
+    return month // 3
+
+
+def annualize(values, period):
+    """
+    把报告期的累计值换算成全年：values / 季度数 * 4
+
+    Parameters:
+    values (np.ndarray or float): ROE、每股收益等累计值
+    period (str or np.ndarray): 报告期，或与 values 可广播的季度数数组
+    """
+    quarters = reported_quarters(period) if isinstance(period, str) else period
+    return values / quarters * 4
+
+
+def _to_float_array(values):
+    """转换为 float64 数组，无法转换的值（None、'-' 等）为 NaN"""
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        out = np.empty(len(values))
+        for i, value in enumerate(values):
+            try:
+                out[i] = float(value)
+            except (TypeError, ValueError):
+                out[i] = np.nan
+        return out
+
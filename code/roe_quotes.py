@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+全市场行情快照
+
+用少量全市场接口一次取回所有 A 股的 市盈率(动)、市净率、股息率(TTM) 和名称，
+替代逐只股票调用 ak.stock_individual_spot_xq：
+  - ak.stock_zh_a_spot_em()       名称、最新价、市盈率-动态、市净率（1 次）
+  - ak.stock_fhps_em(date)        最近几个报告期的分红方案（每期 1 次）
+股息率(TTM) = 除权除息日在最近一年内的每股现金分红之和 / 最新价 * 100，
+与雪球 股息率(TTM) 的口径一致。
+"""
+
+import datetime
+import time
+
+import numpy as np
+import pandas as pd
+
+from roe_datasource import get_data_source
+from roe_metrics import get_run_metrics
+
+# 东方财富全市场行情表的列名
+SPOT_CODE = '代码'
+SPOT_NAME = '名称'
+SPOT_PRICE = '最新价'
+SPOT_PE = '市盈率-动态'
+SPOT_PB = '市净率'
+
+# 分红送配表的列名：现金分红比例为 每10股派现（元）
+FHPS_CODE = '代码'
+FHPS_CASH = '现金分红-现金分红比例'
+FHPS_EX_DATE = '除权除息日'
+
+# 取最近几个半年报/年报的分红方案，覆盖一整年的除权除息日
+DIVIDEND_PERIODS = 4
+
+
+def fetch_with_retry(func, *args, retries=3, wait=2.0):
+    """全市场接口失败时简单重试，最后一次的异常向上抛出"""
+    for attempt in range(retries):
+        try:
+            return func(*args)
+        except Exception as e:
+            if attempt + 1 >= retries:
+                raise
+            print(f"{func.__name__} 第 {attempt + 1} 次失败: {e}，{wait} 秒后重试")
+            get_run_metrics().record_retry(func.__name__)
+            time.sleep(wait)
+
+
+def recent_dividend_periods(today=None, count=DIVIDEND_PERIODS):
+    """
+    today 之前最近的 count 个半年报/年报报告期，新的在前
+
+    例如 2026-10-18 -> ['20260630', '20251231', '20250630', '20241231']
+    """
+    today = today or datetime.date.today()
+    periods = []
+    year = today.year
+    while len(periods) < count:
+        for month_day in ('1231', '0630'):
+            period = f"{year}{month_day}"
+            if datetime.datetime.strptime(period, "%Y%m%d").date() <= today:
+                periods.append(period)
+                if len(periods) >= count:
+                    break
+        year -= 1
+    return periods
+
+
+def fetch_dividend_ttm(prices, today=None):
+    """
+    按最近一年的现金分红计算股息率(TTM)
+
+    Parameters:
+    prices (pd.Series): 股票代码为索引的最新价
+    today (datetime.date): 当前日期，默认为今天
+
+    Returns:
+    pd.Series: 股票代码为索引的股息率(%)，一年内无分红为 0；
+               分红数据全部获取失败时返回 None
+    """
+    today = pd.Timestamp(today or datetime.date.today())
+    frames = []
+    for period in recent_dividend_periods(today.date()):
+        try:
+            df = fetch_with_retry(get_data_source().stock_fhps_em, period)
+        except Exception as e:
+            print(f"获取 {period} 分红方案失败: {e}")
+            continue
+        if df is None or df.empty or FHPS_CASH not in df or FHPS_EX_DATE not in df:
+            continue
+        frames.append(df[[FHPS_CODE, FHPS_CASH, FHPS_EX_DATE]])
+
+    if not frames:
+        return None
+
+    plans = pd.concat(frames, ignore_index=True)
+    plans[FHPS_EX_DATE] = pd.to_datetime(plans[FHPS_EX_DATE], errors='coerce')
+    plans[FHPS_CASH] = pd.to_numeric(plans[FHPS_CASH], errors='coerce')
+    # 同一方案可能出现在多个报告期的查询结果中
+    plans = plans.drop_duplicates(subset=[FHPS_CODE, FHPS_EX_DATE])
+    in_window = (plans[FHPS_EX_DATE] > today - pd.Timedelta(days=365)) & (plans[FHPS_EX_DATE] <= today)
+    cash_per_share = plans[in_window].groupby(FHPS_CODE)[FHPS_CASH].sum() / 10
+
+    cash_per_share = cash_per_share.reindex(prices.index).fillna(0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return cash_per_share / prices * 100
+
+
+def fetch_spot():
+    """
+    获取全市场行情表 ak.stock_zh_a_spot_em()
+
+    Returns:
+    pd.DataFrame: 获取失败或为空时返回 None
+    """
+    try:
+        spot = fetch_with_retry(get_data_source().stock_zh_a_spot_em)
+    except Exception as e:
+        print(f"获取全市场行情快照失败: {e}")
+        return None
+    if spot is None or spot.empty:
+        return None
+    return spot
+
+
+def spot_prices(spot):
+    """
+    行情表中的最新价
+
+    Returns:
+    dict: 股票代码为key，最新价为value；停牌等无最新价的股票不包含在内
+    """
+    if spot is None:
+        return {}
+    prices = pd.to_numeric(spot[SPOT_PRICE], errors='coerce')
+    return {str(code): float(price) for code, price in zip(spot[SPOT_CODE], prices)
+            if not np.isnan(price)}
+
+
+def get_quote_snapshot(today=None, spot=None):
+    """
+    获取全市场 A 股行情快照
+
+    Parameters:
+    today (datetime.date): 计算股息率(TTM)的日期，默认为今天
+    spot (pd.DataFrame): 已获取的全市场行情表，为 None 时重新获取
+
+    Returns:
+    dict: 股票代码为key，(市盈率, 股息率, 市净率, 名称) 为value，
+          与 query_stock_metrics 的返回格式相同；获取失败返回空字典
+    """
+    if spot is None:
+        spot = fetch_spot()
+    if spot is None:
+        return {}
+
+    spot = spot.drop_duplicates(subset=[SPOT_CODE]).set_index(SPOT_CODE)
+    prices = pd.to_numeric(spot[SPOT_PRICE], errors='coerce')
+    pe = pd.to_numeric(spot[SPOT_PE], errors='coerce')
+    pb = pd.to_numeric(spot[SPOT_PB], errors='coerce')
+
+    dividend_yield = fetch_dividend_ttm(prices, today=today)
+    if dividend_yield is None:
+        print("分红数据获取失败，股息率将由逐只查询补齐")
+        dividend_yield = pd.Series(np.nan, index=spot.index)
+
+    snapshot = {}
+    for code, pe_ratio, dy, pb_ratio, name, price in zip(
+            spot.index, pe, dividend_yield, pb, spot[SPOT_NAME], prices):
+        # 停牌、未上市等无最新价的股票估值不可靠，交给逐只查询
+        if np.isnan(price) or np.isnan(dy):
+            continue
+        snapshot[str(code)] = (float(pe_ratio), float(dy), float(pb_ratio), str(name))
+
+    print(f"全市场行情快照包含 {len(snapshot)} 只股票")
+    return snapshot
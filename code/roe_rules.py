@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+选股规则
+
+筛选条件和性价比公式写成表达式，运行前编译一次，之后对整个股票池做数组运算：
+  - roe_filter:   ROE 筛选，可用变量 avg_roe、min_roe、latest_roe、roe_count、roe_1 ... roe_N
+  - value_filter: 估值筛选，另外可用 pe、dividend_yield、pb
+  - score:        性价比，可用变量同 value_filter
+多条条件之间为"且"。表达式语法是 Python 表达式的子集：
+  数字、变量、+ - * / **、比较（可连写，如 0 < pb < 33）、and / or / not、
+  函数 abs、min、max、log、sqrt、isnan、isfinite
+NaN 参与的比较结果为 False，因此缺失数据的股票不会通过筛选。
+
+规则可以放在 JSON 文件中（--screen-spec），缺省的字段沿用 DEFAULT_SPEC，例如：
+  {"value_filter": ["pe > 0", "dividend_yield > 0", "pb > 0", "pe < 100", "pb < 10"],
+   "score": "avg_roe / pb / 12 + 100 / pe / 12"}
+"""
+
+import ast
+import json
+import re
+
+import numpy as np
+
+# 与原来 clean_data_ROE_v2 / append_pb 中写死的条件一致
+DEFAULT_SPEC = {
+    'roe_filter': [
+        "avg_roe > 1",
+        "min_roe > -5",
+        "abs(min_roe) * 80 > avg_roe or min_roe * 80 > avg_roe",
+    ],
+    'value_filter': [
+        "pe > 0", "dividend_yield > 0", "pb > 0",       # 数据有效
+        "pe < 200", "dividend_yield > 0.1", "pb < 33",
+    ],
+    'score': "(avg_roe / 12) / pb + (100 / pe) / 12",
+}
+
+ROE_NAMES = ('avg_roe', 'min_roe', 'latest_roe', 'roe_count')
+VALUE_NAMES = ('pe', 'dividend_yield', 'pb')
+_PERIOD_NAME = re.compile(r"^roe_\d+$")
+
+_BINARY = {
+    ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply,
+    ast.Div: np.true_divide, ast.Pow: np.power,
+}
+_COMPARE = {
+    ast.Gt: np.greater, ast.GtE: np.greater_equal, ast.Lt: np.less,
+    ast.LtE: np.less_equal, ast.Eq: np.equal, ast.NotEq: np.not_equal,
+}
+# 函数名 -> (实现, 参数个数)；min / max 为两个数组逐元素比较
+_FUNCTIONS = {
+    'abs': (np.abs, 1), 'min': (np.minimum, 2), 'max': (np.maximum, 2), 'log': (np.log, 1),
+    'sqrt': (np.sqrt, 1), 'isnan': (np.isnan, 1), 'isfinite': (np.isfinite, 1),
+}
+
+
+class RuleError(ValueError):
+    """规则表达式无法解析或使用了不支持的语法、变量"""
+
+
+def _compile_node(node, names, source):
+    """把语法树节点编译成 env -> 数组 的函数"""
+    if isinstance(node, ast.Expression):
+        return _compile_node(node.body, names, source)
+
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) \
+            and not isinstance(node.value, bool):
+        value = float(node.value)
+        return lambda env: value
+
+    if isinstance(node, ast.Name):
+        name = node.id
+        if name not in names and not (_PERIOD_NAME.match(name) and 'roe_1' in names):
+            raise RuleError(f"规则 '{source}' 中的变量 {name} 不可用，可用变量: {', '.join(sorted(names))}")
+        return lambda env: env[name]
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+        func = _BINARY[type(node.op)]
+        left, right = _compile_node(node.left, names, source), _compile_node(node.right, names, source)
+        return lambda env: func(left(env), right(env))
+
+    if isinstance(node, ast.UnaryOp):
+        operand = _compile_node(node.operand, names, source)
+        if isinstance(node.op, ast.USub):
+            return lambda env: np.negative(operand(env))
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        if isinstance(node.op, ast.Not):
+            return lambda env: np.logical_not(operand(env))
+
+    if isinstance(node, ast.BoolOp):
+        func = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        parts = [_compile_node(value, names, source) for value in node.values]
+
+        def boolean(env):
+            result = parts[0](env)
+            for part in parts[1:]:
+                result = func(result, part(env))
+            return result
+        return boolean
+
+    if isinstance(node, ast.Compare) and all(type(op) in _COMPARE for op in node.ops):
+        operands = [_compile_node(node.left, names, source)] + \
+                   [_compile_node(value, names, source) for value in node.comparators]
+        funcs = [_COMPARE[type(op)] for op in node.ops]
+
+        def compare(env):
+            values = [operand(env) for operand in operands]
+            result = funcs[0](values[0], values[1])
+            for i in range(1, len(funcs)):
+                result = np.logical_and(result, funcs[i](values[i], values[i + 1]))
+            return result
+        return compare
+
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+            and node.func.id in _FUNCTIONS and not node.keywords:
+        func, arity = _FUNCTIONS[node.func.id]
+        if len(node.args) != arity:
+            raise RuleError(f"规则 '{source}' 中 {node.func.id}() 需要 {arity} 个参数，"
+                            f"实际 {len(node.args)} 个")
+        args = [_compile_node(arg, names, source) for arg in node.args]
+        return lambda env: func(*[arg(env) for arg in args])
+
+    raise RuleError(f"规则 '{source}' 中有不支持的语法: {type(node).__name__}")
+
+
+def compile_expression(source, names):
+    """
+    编译一条表达式
+
+    Parameters:
+    source (str): 表达式
+    names (collection): 可用的变量名；包含 'roe_1' 时 roe_<数字> 均可用
+
+    Returns:
+    function: env(dict: 变量名 -> 数组或数值) -> 数组
+    """
+    try:
+        tree = ast.parse(source.strip(), mode='eval')
+    except SyntaxError as e:
+        raise RuleError(f"规则 '{source}' 无法解析: {e.msg}") from e
+    return _compile_node(tree, set(names), source)
+
+
+class ScreenSpec:
+    """
+    编译好的选股规则
+
+    Parameters:
+    spec (dict): roe_filter / value_filter（表达式列表）、score（表达式），缺省字段取 DEFAULT_SPEC
+    """
+
+    def __init__(self, spec=None):
+        unknown = set(spec or {}) - set(DEFAULT_SPEC)
+        if unknown:
+            raise RuleError(f"未知的规则字段: {', '.join(sorted(unknown))}，可用字段: {', '.join(DEFAULT_SPEC)}")
+        spec = {**DEFAULT_SPEC, **(spec or {})}
+        for key in ('roe_filter', 'value_filter'):
+            if isinstance(spec[key], str):
+                spec[key] = [spec[key]]
+        self.spec = spec
+        roe_names = set(ROE_NAMES) | {'roe_1'}
+        value_names = roe_names | set(VALUE_NAMES)
+        self._roe_rules = [compile_expression(rule, roe_names) for rule in spec['roe_filter']]
+        self._value_rules = [compile_expression(rule, value_names) for rule in spec['value_filter']]
+        self._score = compile_expression(spec['score'], value_names)
+
+    @classmethod
+    def from_file(cls, path):
+        """从 JSON 文件读取规则"""
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def is_default(self):
+        """是否为内置规则"""
+        return self.spec == DEFAULT_SPEC
+
+    def describe_value_filter(self):
+        """估值筛选规则的一行说明，用于报告表头"""
+        return " ; ".join(self.spec['value_filter'])
+
+    def fingerprint(self):
+        """规则的规范化文本，用于判断两次运行的规则是否相同"""
+        return json.dumps(self.spec, sort_keys=True, ensure_ascii=False)
+
+    @staticmethod
+    def _all(rules, env, shape):
+        mask = np.ones(shape, dtype=bool)
+        with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+            for rule in rules:
+                mask &= np.asarray(rule(env), dtype=bool)
+        return mask
+
+    def roe_mask(self, env):
+        """ROE 筛选掩码；env 由 roe_env 构建"""
+        return self._all(self._roe_rules, env, np.shape(env['avg_roe']))
+
+    def value_mask(self, env):
+        """估值筛选掩码（不含 ROE 条件）"""
+        return self._all(self._value_rules, env, np.shape(env['avg_roe']))
+
+    def score(self, env):
+        """性价比；无法计算的为 NaN"""
+        with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+            score = np.asarray(self._score(env), dtype=np.float64)
+        # 常数表达式（例如 "1"）广播为每只股票一个值
+        return np.broadcast_to(score, np.shape(env['avg_roe']))
+
+    def evaluate(self, env):
+        """
+        估值筛选 + 性价比
+
+        Returns:
+        np.ndarray: 通过估值筛选且性价比不为 NaN 的掩码
+        np.ndarray: 性价比
+        """
+        score = self.score(env)
+        return self.value_mask(env) & ~np.isnan(score), score
+
+
+def roe_env(values, avg_roe=None, min_roe=None):
+    """
+    ROE 相关变量
+
+    Parameters:
+    values (np.ndarray): 各期ROE（最新一期已年化），形状 (..., 报告期数)
+    avg_roe, min_roe (np.ndarray): 已算好的均值、最小值，为 None 时忽略 NaN 计算
+
+    Returns:
+    dict: 变量名 -> 数组，形状为 values 去掉最后一维
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=-1)
+    if avg_roe is None:
+        total = np.where(valid, values, 0.0).sum(axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            avg_roe = np.where(count > 0, total / np.maximum(count, 1), np.nan)
+    if min_roe is None:
+        min_roe = np.where(count > 0, np.where(valid, values, np.inf).min(axis=-1), np.nan)
+    env = {'avg_roe': avg_roe, 'min_roe': min_roe, 'latest_roe': values[..., -1], 'roe_count': count}
+    for i in range(values.shape[-1]):
+        env[f"roe_{i + 1}"] = values[..., i]
+    return env
+
+
+def top_k_indices(scores, k, mask=None):
+    """
+    按分数从高到低取前 k 个下标，同分按下标顺序（与稳定排序的结果相同）
+
+    用 np.argpartition 先选出前 k 个，只对这 k 个排序，不对全部股票排序。
+
+    Parameters:
+    scores (np.ndarray): 一维分数
+    k (int): 取前几个，为 None 时取全部
+    mask (np.ndarray): 参与排名的掩码，默认为分数不为 NaN 的
+
+    Returns:
+    np.ndarray: 下标
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    candidates = np.flatnonzero(~np.isnan(scores) if mask is None else mask & ~np.isnan(scores))
+    if k is None or k >= len(candidates):
+        chosen = candidates
+    elif k <= 0:
+        return candidates[:0]
+    else:
+        values = scores[candidates]
+        threshold = values[np.argpartition(-values, k - 1)[k - 1]]
+        # 分数高于第 k 名的全部入选，等于第 k 名的按下标顺序补足
+        above = candidates[values > threshold]
+        ties = candidates[values == threshold][:k - len(above)]
+        chosen = np.concatenate([above, ties])
+    # 按 (-分数, 下标) 排序
+    return chosen[np.lexsort((chosen, -scores[chosen]))]
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""
+选股服务
+
+常驻进程：ROE 面板、行情估值和行业映射只加载一次放在内存中，后台按间隔刷新，
+通过本地 HTTP/JSON 接口回答排名和筛选查询，查询只做数组运算，不访问网络。
+
+接口（GET，返回 JSON）：
+  /rank        排名。参数：
+                 top=100                    返回前几名
+                 pe_max / pe_min / pb_max / pb_min / dy_min / avg_roe_min / min_roe_min
+                                            在当前规则之上追加的估值、ROE 条件
+                 filter=<表达式>            追加的筛选表达式（roe_rules 语法），可重复
+                 score=<表达式>             替换性价比公式
+                 base=none                  不使用当前规则的估值筛选，只用本次查询的条件
+                 industry=银行,保险          只保留这些行业
+  /stock/<代码>  一只股票的数据、是否通过筛选和名次（参数同 /rank）
+  /industries  各行业的股票数和通过筛选的股票数
+  /status      数据加载时间、刷新次数、最近一次刷新错误、缓存命中
+
+相同的查询直接返回缓存的结果；后台刷新完成、数据替换后缓存清空。
+例如：curl "http://127.0.0.1:8765/rank?pb_max=3&top=20&industry=银行"
+"""
+
+import collections
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import numpy as np
+
+from roe_output import result_row
+from roe_rules import RuleError, ScreenSpec, roe_env, top_k_indices
+
+DEFAULT_SERVICE_HOST = "127.0.0.1"
+DEFAULT_SERVICE_PORT = 8765
+# 后台刷新间隔（分钟）
+DEFAULT_REFRESH_MINUTES = 30
+# 缓存的查询结果数
+DEFAULT_CACHE_SIZE = 256
+DEFAULT_QUERY_TOP = 100
+
+# 查询参数 -> 追加的规则
+QUERY_FILTERS = {
+    'pe_max': "pe < {}",
+    'pe_min': "pe > {}",
+    'pb_max': "pb < {}",
+    'pb_min': "pb > {}",
+    'dy_min': "dividend_yield > {}",
+    'avg_roe_min': "avg_roe > {}",
+    'min_roe_min': "min_roe > {}",
+}
+
+
+class QueryError(ValueError):
+    """查询参数有误，返回 400"""
+
+
+class ServiceDataset:
+    """
+    一次加载的全部数据，加载完成后只读，刷新时整体替换
+
+    Parameters:
+    codes (list): 股票代码
+    periods (list): 报告期
+    values (np.ndarray): 各期ROE（最新一期已年化），形状 (股票数, 报告期数)
+    quotes (dict): 股票代码 -> (市盈率, 股息率, 市净率, 名称)，缺失的股票估值为 NaN
+    industry_map (dict): 股票代码 -> 行业
+    """
+
+    def __init__(self, codes, periods, values, quotes, industry_map):
+        self.codes = list(codes)
+        self.periods = list(periods)
+        self.loaded_at = time.time()
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        missing = (np.nan,) * 3 + (None,)
+        rows = [quotes.get(code, missing) for code in self.codes]
+        self.names = [row[3] if isinstance(row[3], str) and row[3] not in ('', 'None') else None
+                      for row in rows]
+        self.industries = np.array([industry_map.get(code) for code in self.codes], dtype=object)
+
+        self.env = roe_env(values)
+        valuations = np.array([[_to_float(value) for value in row[:3]] for row in rows],
+                              dtype=np.float64).reshape(-1, 3)
+        self.env.update(pe=valuations[:, 0], dividend_yield=valuations[:, 1], pb=valuations[:, 2])
+        self.values = np.asarray(values, dtype=np.float64)
+        self.eligible = np.array([name is not None for name in self.names], dtype=bool)
+
+    def __len__(self):
+        return len(self.codes)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class ScreenService:
+    """
+    常驻的选股服务
+
+    Parameters:
+    loader (callable): 无参数，返回新的 ServiceDataset（访问网络，在后台线程中调用）
+    spec (ScreenSpec): 基础规则，查询条件在其上追加
+    refresh_interval (float): 后台刷新间隔（秒），为 0 时不刷新
+    cache_size (int): 缓存的查询结果数
+    """
+
+    def __init__(self, loader, spec=None, refresh_interval=DEFAULT_REFRESH_MINUTES * 60,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        self.loader = loader
+        self.spec = spec or ScreenSpec()
+        self.refresh_interval = refresh_interval
+        self.cache_size = cache_size
+        self.dataset = None
+        self.version = 0
+        self.refresh_count = 0
+        self.last_error = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache = collections.OrderedDict()
+        self._specs = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresh_thread = None
+        self._server = None
+
+    # ---------------- 数据加载 ----------------
+
+    def load(self):
+        """加载一次数据并替换当前数据集，清空查询缓存"""
+        start = time.time()
+        dataset = self.loader()
+        with self._lock:
+            self.dataset = dataset
+            self.version += 1
+            self.refresh_count += 1
+            self._cache.clear()
+        print(f"服务数据已加载: {len(dataset)} 只股票，耗时 {time.time() - start:.1f}s（版本 {self.version}）")
+        return dataset
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.load()
+                self.last_error = None
+            except Exception as e:
+                # 刷新失败时继续使用上一次的数据
+                self.last_error = f"{time.strftime('%Y-%m-%d %H:%M:%S')} {type(e).__name__}: {e}"
+                print(f"后台刷新失败，继续使用已加载的数据: {e}")
+
+    def start_refresh(self):
+        if self.refresh_interval and self._refresh_thread is None:
+            self._refresh_thread = threading.Thread(target=self._refresh_loop, name="roe-refresh", daemon=True)
+            self._refresh_thread.start()
+
+    # ---------------- 查询 ----------------
+
+    def _compile(self, params):
+        """查询参数对应的规则，编译结果按参数缓存"""
+        value_filter = [] if _single(params, 'base') == 'none' else list(self.spec.spec['value_filter'])
+        for name, template in QUERY_FILTERS.items():
+            value = _single(params, name)
+            if value is not None:
+                try:
+                    value_filter.append(template.format(float(value)))
+                except ValueError:
+                    raise QueryError(f"参数 {name} 不是数值: {value}") from None
+        value_filter += params.get('filter', [])
+        score = _single(params, 'score') or self.spec.spec['score']
+        key = (tuple(value_filter), score)
+
+        with self._lock:
+            spec = self._specs.get(key)
+        if spec is None:
+            try:
+                spec = ScreenSpec({'roe_filter': self.spec.spec['roe_filter'],
+                                   'value_filter': value_filter, 'score': score})
+            except RuleError as e:
+                raise QueryError(str(e)) from None
+            with self._lock:
+                self._specs[key] = spec
+                while len(self._specs) > self.cache_size:
+                    self._specs.popitem(last=False)
+        return spec
+
+    def _evaluate(self, dataset, params):
+        spec = self._compile(params)
+        roe_mask = spec.roe_mask(dataset.env)
+        value_passed, score = spec.evaluate(dataset.env)
+        passed = roe_mask & value_passed & dataset.eligible
+        industries = [item for value in params.get('industry', []) for item in value.split(',') if item]
+        if industries:
+            passed &= np.isin(dataset.industries, industries)
+        return roe_mask, passed, score
+
+    def _row(self, dataset, i, score, rank=None):
+        data = dataset.values[i].tolist() + [
+            dataset.env['avg_roe'][i], dataset.env['pe'][i], dataset.env['dividend_yield'][i],
+            dataset.env['pb'][i], score[i], dataset.names[i],
+        ]
+        return result_row(dataset.codes[i], data, dataset.periods, rank=rank, industry=dataset.industries[i])
+
+    def rank(self, params, dataset=None):
+        dataset = self._require_dataset(dataset)
+        top = _int_param(params, 'top', DEFAULT_QUERY_TOP)
+        roe_mask, passed, score = self._evaluate(dataset, params)
+        order = top_k_indices(score, top, passed)
+        return {
+            'roe_passed': int(roe_mask.sum()),
+            'passed': int(passed.sum()),
+            'results': [self._row(dataset, i, score, rank) for rank, i in enumerate(order.tolist(), start=1)],
+        }
+
+    def stock(self, code, params, dataset=None):
+        dataset = self._require_dataset(dataset)
+        if code not in dataset.index:
+            raise LookupError(f"没有股票 {code} 的数据")
+        i = dataset.index[code]
+        roe_mask, passed, score = self._evaluate(dataset, params)
+        rank = None
+        if passed[i]:
+            # 名次 = 分数更高的股票数 + 同分且排在前面的股票数 + 1
+            higher = passed & (score > score[i])
+            ties = passed[:i] & (score[:i] == score[i])
+            rank = int(higher.sum() + ties.sum()) + 1
+        row = self._row(dataset, i, score, rank)
+        row.update({'roe_passed': bool(roe_mask[i]), 'passed': bool(passed[i])})
+        return row
+
+    def industries(self, params, dataset=None):
+        dataset = self._require_dataset(dataset)
+        _, passed, _ = self._evaluate(dataset, {key: value for key, value in params.items() if key != 'industry'})
+        counts = collections.Counter(value for value in dataset.industries.tolist() if value)
+        passed_counts = collections.Counter(value for value in dataset.industries[passed].tolist() if value)
+        return {'industries': [{'industry': name, 'stocks': count, 'passed': passed_counts.get(name, 0)}
+                               for name, count in counts.most_common()]}
+
+    def status(self):
+        with self._lock:
+            dataset, version = self.dataset, self.version
+        return {
+            'loaded': dataset is not None,
+            'stocks': len(dataset) if dataset is not None else 0,
+            'periods': dataset.periods if dataset is not None else [],
+            'loaded_at': _format_time(dataset.loaded_at) if dataset is not None else None,
+            'version': version,
+            'refresh_count': self.refresh_count,
+            'refresh_interval_seconds': self.refresh_interval,
+            'last_error': self.last_error,
+            'cache_entries': len(self._cache),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'rules': self.spec.spec,
+        }
+
+    def _require_dataset(self, dataset=None):
+        """查询使用的数据集：handle 传入加锁时取到的数据集，否则为当前数据集"""
+        dataset = self.dataset if dataset is None else dataset
+        if dataset is None:
+            raise LookupError("数据尚未加载完成")
+        return dataset
+
+    def handle(self, path, query):
+        """
+        处理一个请求
+
+        Returns:
+        int: HTTP 状态码
+        bytes: JSON 响应
+        """
+        params = parse_qs(query, keep_blank_values=False)
+        if path == '/status':
+            return 200, _encode(self.status())
+
+        # 数据集和版本号在同一次加锁中取出，查询、缓存键和 loaded_at 都对应同一份数据
+        with self._lock:
+            dataset, version = self.dataset, self.version
+            key = (version, path, tuple(sorted((name, tuple(values)) for name, values in params.items())))
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return 200, cached
+            self.cache_misses += 1
+
+        try:
+            if path == '/rank':
+                body = self.rank(params, dataset)
+            elif path.startswith('/stock/'):
+                body = self.stock(unquote(path[len('/stock/'):]), params, dataset)
+            elif path == '/industries':
+                body = self.industries(params, dataset)
+            else:
+                return 404, _encode({'error': f"未知的接口: {path}"})
+        except QueryError as e:
+            return 400, _encode({'error': str(e)})
+        except LookupError as e:
+            return 404, _encode({'error': str(e).strip("'\"")})
+
+        body.update(version=version, loaded_at=_format_time(dataset.loaded_at))
+        encoded = _encode(body)
+        with self._lock:
+            # 查询期间数据已被替换时不缓存旧结果
+            if self.version == version:
+                self._cache[key] = encoded
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return 200, encoded
+
+    # ---------------- HTTP ----------------
+
+    def serve(self, host=DEFAULT_SERVICE_HOST, port=DEFAULT_SERVICE_PORT):
+        """加载数据、启动后台刷新并处理请求，直到 Ctrl+C 或 stop()"""
+        if self.dataset is None:
+            self.load()
+        self.start_refresh()
+        self._server = ThreadingHTTPServer((host, port), _handler(self))
+        self._server.daemon_threads = True
+        print(f"选股服务已启动: http://{host}:{self._server.server_address[1]}/rank"
+              f"（后台每 {self.refresh_interval / 60:g} 分钟刷新）")
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            print("选股服务已停止")
+        finally:
+            self._stop.set()
+            self._server.server_close()
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def _handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            try:
+                status, body = service.handle(url.path.rstrip('/') or '/', url.query)
+            except Exception as e:
+                status, body = 500, _encode({'error': f"{type(e).__name__}: {e}"})
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def _single(params, name):
+    values = params.get(name)
+    return values[-1] if values else None
+
+
+def _int_param(params, name, default):
+    value = _single(params, name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise QueryError(f"参数 {name} 不是整数: {value}") from None
+    if value < 0:
+        raise QueryError(f"参数 {name} 不能为负数")
+    return value
+
+
+def _format_time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+
+def _clean(value):
+    """NaN 写成 null，numpy 数值转成 Python 数值"""
+    if isinstance(value, dict):
+        return {key: _clean(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_clean(item) for item in value]
+    if isinstance(value, (np.floating, np.integer, np.bool_)):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def _encode(body):
+    return json.dumps(_clean(body), ensure_ascii=False).encode('utf-8')
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+流式处理的基础组件
+
+  - bounded_map: 有界队列 + 工作线程的流水线阶段，输入和输出都是迭代器，
+                 同一时刻内存中只保留队列里的数据
+  - TopK:        增量维护前 K 名，只保留 K 条记录
+"""
+
+import heapq
+import queue
+import threading
+
+_DONE = object()
+
+
+def bounded_map(func, items, workers=8, queue_size=64):
+    """
+    用 workers 个线程对 items 逐个调用 func，按完成顺序产出结果
+
+    items 可以是生成器，只在输入队列有空位时才继续取下一个；
+    消费者处理得慢时，输出队列满了工作线程也会停下来等待。
+    消费者提前停止（break、异常或关闭生成器）时，不再读取 items，队列中未开始的元素丢弃，
+    等正在执行的 func 返回、线程全部退出后才结束。
+
+    Parameters:
+    func (callable): 处理单个元素的函数
+    items (iterable): 输入元素
+    workers (int): 工作线程数
+    queue_size (int): 输入、输出队列的容量
+
+    Yields:
+    tuple: (元素, 结果, 异常)，func 抛出异常时结果为 None
+    """
+    in_queue = queue.Queue(maxsize=queue_size)
+    out_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def feed():
+        try:
+            for item in items:
+                if stop.is_set():
+                    break
+                in_queue.put(item)
+        finally:
+            for _ in range(workers):
+                in_queue.put(_DONE)
+
+    def work():
+        while True:
+            item = in_queue.get()
+            if item is _DONE:
+                out_queue.put(_DONE)
+                return
+            if stop.is_set():
+                continue
+            try:
+                out_queue.put((item, func(item), None))
+            except Exception as e:
+                out_queue.put((item, None, e))
+
+    threads = [threading.Thread(target=feed, name="bounded-map-feed", daemon=True)]
+    threads += [threading.Thread(target=work, name="bounded-map-worker", daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    finished = 0
+    try:
+        while finished < workers:
+            entry = out_queue.get()
+            if entry is _DONE:
+                finished += 1
+                continue
+            yield entry
+    finally:
+        if finished < workers:
+            # 提前停止：工作线程丢弃剩余输入，这里取走输出让阻塞的线程退出
+            stop.set()
+            while finished < workers:
+                if out_queue.get() is _DONE:
+                    finished += 1
+        for thread in threads:
+            thread.join()
+
+
+class TopK:
+    """
+    按分数从高到低保留前 k 名
+
+    分数相同时先加入（order 较小）的排在前面，与对全量数据做稳定排序的结果一致。
+
+    Parameters:
+    k (int): 保留的名次数
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self._heap = []  # 小顶堆，堆顶是当前最差的一条
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, score, order, item):
+        """
+        加入一条记录
+
+        Returns:
+        tuple: (是否进入前 k 名, 被挤出的记录或 None)
+        """
+        entry = (score, -order, item)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+            return True, None
+        if entry[:2] > self._heap[0][:2]:
+            evicted = heapq.heapreplace(self._heap, entry)
+            return True, evicted[2]
+        return False, None
+
+    def ranked(self):
+        """按名次排好的记录列表"""
+        return [item for _, _, item in sorted(self._heap, key=lambda e: (-e[0], -e[1]))]
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+参数扫描
+
+数据（各期ROE、估值、名称是否有效）只获取一次，整理成 变量 x 股票 的矩阵放入共享内存，
+再由进程池对一组参数组合分别做 ROE 筛选、估值筛选和打分，与基准规则（SCREEN_SPEC）比较：
+  - roe_survivors   通过 ROE 筛选的股票数
+  - passed          通过估值筛选的股票数
+  - top_overlap     前 N 名中与基准前 N 名相同的股票数及比例
+  - rank_corr       任一方通过筛选的股票（并集）名次的 Spearman 相关系数，没有通过一方筛选的
+                    股票在该方记为并列最后，因此只改变筛选条件的组合被筛掉的股票也会降低相关系数
+
+参数组合由规则模板和参数网格生成：模板是 roe_rules 的规则，其中 {参数名} 在每个组合中
+替换为取值；网格中没有的参数取 SWEEP_DEFAULTS。可以用 JSON 文件（--sweep-spec）指定：
+  {"template": {...可选，缺省字段取 SWEEP_TEMPLATE...},
+   "defaults": {"min_ratio": 80},
+   "grid": {"avg_floor": [0, 1, 3], "pe_max": [50, 100, 200], "pb_max": [10, 33]}}
+只出现在性价比公式中、且只按比例缩放性价比的参数（例如模板中的 {hurdle}）不改变筛选结果和名次，
+扫描这种参数没有意义：网格中只有这种参数变化时报错，否则打印提示。
+"""
+
+import concurrent.futures
+import itertools
+import json
+import math
+import time
+
+import numpy as np
+from multiprocessing import shared_memory
+
+from roe_rules import ScreenSpec, roe_env, top_k_indices
+
+DEFAULT_SWEEP_PATH = "sweep_results.csv"
+DEFAULT_SWEEP_TOP_N = 100
+
+# 参数取 SWEEP_DEFAULTS 时与 DEFAULT_SPEC 相同
+SWEEP_TEMPLATE = {
+    'roe_filter': [
+        "avg_roe > {avg_floor}",
+        "min_roe > {min_floor}",
+        "abs(min_roe) * {min_ratio} > avg_roe or min_roe * {min_ratio} > avg_roe",
+    ],
+    'value_filter': [
+        "pe > 0", "dividend_yield > 0", "pb > 0",
+        "pe < {pe_max}", "dividend_yield > {dy_min}", "pb < {pb_max}",
+    ],
+    'score': "(avg_roe / {hurdle}) / pb + (100 / pe) / {hurdle}",
+}
+SWEEP_DEFAULTS = {
+    'avg_floor': 1, 'min_floor': -5, 'min_ratio': 80,
+    'pe_max': 200, 'dy_min': 0.1, 'pb_max': 33, 'hurdle': 12,
+}
+# 5 x 3 x 4 x 3 = 180 个组合；hurdle 同时除两项，只缩放性价比，不在默认网格中
+DEFAULT_GRID = {
+    'avg_floor': [0, 1, 3, 5, 8],
+    'min_floor': [-10, -5, 0],
+    'pe_max': [30, 50, 100, 200],
+    'pb_max': [5, 10, 33],
+}
+
+# 工作进程中挂载的共享内存和变量视图
+_shared = None
+_env = None
+
+
+class SweepGrid:
+    """
+    规则模板 + 参数网格
+
+    Parameters:
+    template (dict): 规则模板，缺省字段取 SWEEP_TEMPLATE
+    defaults (dict): 网格中没有的参数的取值，缺省的取 SWEEP_DEFAULTS
+    grid (dict): 参数名 -> 取值列表，默认为 DEFAULT_GRID
+    """
+
+    def __init__(self, template=None, defaults=None, grid=None):
+        self.template = {**SWEEP_TEMPLATE, **(template or {})}
+        self.defaults = {**SWEEP_DEFAULTS, **(defaults or {})}
+        self.grid = dict(DEFAULT_GRID if grid is None else grid)
+        unknown = set(self.grid) - set(self.defaults)
+        if unknown:
+            raise ValueError(f"参数网格中的参数没有默认值: {', '.join(sorted(unknown))}")
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data.get('template'), data.get('defaults'), data.get('grid'))
+
+    def override(self, assignments):
+        """
+        用命令行的 NAME=v1,v2,... 替换网格中的参数
+
+        Parameters:
+        assignments (list): 形如 'pe_max=50,100,200' 的字符串
+        """
+        for item in assignments or ():
+            name, _, values = item.partition('=')
+            name = name.strip()
+            if name not in self.defaults or not values:
+                raise ValueError(f"无法识别的扫描参数: {item}（可用参数: {', '.join(self.defaults)}）")
+            self.grid[name] = [float(value) for value in values.split(',') if value.strip()]
+        return self
+
+    def rank_invariant_params(self):
+        """
+        网格中只出现在性价比公式里、且各取值下名次完全相同的参数（只缩放性价比）；
+        用固定种子的随机股票池检验，与实际数据无关
+
+        Returns:
+        list: 参数名
+        """
+        filters = " ".join(rule for key, rules in self.template.items() if key != 'score'
+                           for rule in (rules if isinstance(rules, list) else [rules]))
+        env = _probe_env()
+        invariant = []
+        for name, values in self.grid.items():
+            placeholder = "{" + name + "}"
+            if len(set(values)) < 2 or placeholder in filters or placeholder not in self.template['score']:
+                continue
+            orders = set()
+            for value in values:
+                score = self.template['score'].format(**{**self.defaults, name: value})
+                try:
+                    orders.add(tuple(top_k_indices(ScreenSpec({'score': score}).score(env), None)))
+                except KeyError:
+                    # 用到了随机股票池中没有的变量（例如更多期的 roe_N），不做检验
+                    break
+            else:
+                if len(orders) == 1:
+                    invariant.append(name)
+        return invariant
+
+    def validate(self):
+        """
+        网格中只有不改变名次的参数变化时抛出 ValueError；部分参数如此时打印提示
+
+        Returns:
+        list: 不改变名次的参数名
+        """
+        invariant = self.rank_invariant_params()
+        varying = [name for name, values in self.grid.items() if len(set(values)) > 1]
+        if invariant and set(varying) <= set(invariant):
+            raise ValueError(f"参数 {', '.join(invariant)} 只按比例缩放性价比，不改变筛选结果和名次，"
+                             f"扫描没有意义")
+        if invariant:
+            print(f"提示: 参数 {', '.join(invariant)} 只按比例缩放性价比，不改变筛选结果和名次，"
+                  f"这些取值的结果相同")
+        return invariant
+
+    @property
+    def names(self):
+        return list(self.grid)
+
+    def __len__(self):
+        return math.prod(len(values) for values in self.grid.values())
+
+    def configs(self):
+        """
+        Yields:
+        dict: 参数名 -> 取值（只包含网格中的参数）
+        dict: 替换参数后的规则
+        """
+        for values in itertools.product(*self.grid.values()):
+            params = dict(zip(self.grid, values))
+            substitution = {**self.defaults, **params}
+            spec = {
+                key: ([rule.format(**substitution) for rule in rules] if isinstance(rules, list)
+                      else rules.format(**substitution))
+                for key, rules in self.template.items()
+            }
+            yield params, spec
+
+
+def _probe_env(n_stocks=500, n_periods=6, seed=0):
+    """检验参数用的随机股票池：各期ROE、市盈率、股息率、市净率均为正常范围内的值"""
+    rng = np.random.default_rng(seed)
+    env = roe_env(rng.uniform(-5, 40, (n_stocks, n_periods)))
+    env.update(pe=rng.uniform(1, 300, n_stocks), dividend_yield=rng.uniform(0, 8, n_stocks),
+               pb=rng.uniform(0.1, 40, n_stocks))
+    return env
+
+
+def rank_positions(scores, mask):
+    """
+    按性价比从高到低的名次（从 0 开始），未通过筛选的为 -1
+    """
+    positions = np.full(len(scores), -1, dtype=np.int64)
+    order = top_k_indices(scores, None, mask)
+    positions[order] = np.arange(len(order))
+    return positions
+
+
+def _average_ranks(values):
+    """名次（从 0 开始），相同的值取平均名次"""
+    values = np.asarray(values)
+    order = np.argsort(values, kind='stable')
+    ranks = np.empty(len(values), dtype=np.float64)
+    ranks[order] = np.arange(len(values))
+    _, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    sums = np.bincount(inverse, weights=ranks)
+    return sums[inverse] / counts[inverse]
+
+
+def spearman(left, right):
+    """
+    两组名次的 Spearman 相关系数（允许并列，并列取平均名次）；
+    少于两只股票或某一组全部并列时为 NaN
+    """
+    if len(left) < 2:
+        return float('nan')
+    left, right = _average_ranks(left), _average_ranks(right)
+    left, right = left - left.mean(), right - right.mean()
+    denominator = math.sqrt(np.square(left).sum() * np.square(right).sum())
+    return float((left * right).sum() / denominator) if denominator > 0 else float('nan')
+
+
+def evaluate_config(env, eligible, base_positions, spec, top_n):
+    """
+    一组参数的筛选结果与基准比较
+
+    Parameters:
+    env (dict): 变量名 -> 数组（全部股票）
+    eligible (np.ndarray): 有估值数据且名称有效的股票
+    base_positions (np.ndarray): 基准规则下的名次，未通过为 -1
+    spec (dict): 规则
+    top_n (int): 比较前几名
+
+    Returns:
+    dict: roe_survivors / passed / top_overlap / top_overlap_ratio / rank_corr / common
+    """
+    screen = ScreenSpec(spec)
+    roe_mask = screen.roe_mask(env)
+    value_passed, score = screen.evaluate(env)
+    passed = roe_mask & value_passed & eligible
+    positions = rank_positions(score, passed)
+
+    base_top = (base_positions >= 0) & (base_positions < top_n)
+    top = (positions >= 0) & (positions < top_n)
+    common = (base_positions >= 0) & passed
+    # 名次相关按并集计算：没有通过一方筛选的股票在该方并列最后
+    union = (base_positions >= 0) | passed
+    last = len(positions)
+    return {
+        'roe_survivors': int(roe_mask.sum()),
+        'passed': int(passed.sum()),
+        'top_overlap': int((base_top & top).sum()),
+        'top_overlap_ratio': float((base_top & top).sum() / max(1, base_top.sum())),
+        'rank_corr': spearman(np.where(base_positions[union] >= 0, base_positions[union], last),
+                              np.where(positions[union] >= 0, positions[union], last)),
+        'common': int(common.sum()),
+    }
+
+
+def _attach(name, shape, columns):
+    """工作进程初始化：挂载共享内存，建立各变量的只读视图"""
+    global _shared, _env
+    _shared = shared_memory.SharedMemory(name=name)
+    matrix = np.ndarray(shape, dtype=np.float64, buffer=_shared.buf)
+    matrix.flags.writeable = False
+    _env = {column: matrix[i] for i, column in enumerate(columns)}
+
+
+def _split(env):
+    env = dict(env)
+    eligible = env.pop('_eligible') > 0
+    base_positions = env.pop('_base_position').astype(np.int64)
+    return env, eligible, base_positions
+
+
+def _evaluate_chunk(chunk, top_n):
+    env, eligible, base_positions = _split(_env)
+    return [(index, evaluate_config(env, eligible, base_positions, spec, top_n))
+            for index, spec in chunk]
+
+
+def run_sweep(env, eligible, baseline, grid, top_n=DEFAULT_SWEEP_TOP_N, workers=None):
+    """
+    对参数网格中的每个组合筛选、打分，并与基准比较
+
+    Parameters:
+    env (dict): 变量名 -> 数组（全部股票，roe_env + pe / dividend_yield / pb）
+    eligible (np.ndarray): 有估值数据且名称有效的股票
+    baseline (ScreenSpec): 基准规则
+    grid (SweepGrid): 参数组合
+    top_n (int): 比较前几名
+    workers (int): 进程数，为 1 时在当前进程内计算，为 None 时取 CPU 核数
+
+    Returns:
+    list: 每个组合一行 dict：参数取值 + evaluate_config 的结果，按组合顺序
+    dict: 基准的 evaluate_config 结果
+    """
+    configs = list(grid.configs())
+    # 先在主进程编译一遍，规则有误时不必启动进程池
+    for _, spec in configs:
+        ScreenSpec(spec)
+
+    value_passed, base_score = baseline.evaluate(env)
+    base_mask = baseline.roe_mask(env) & value_passed & eligible
+    base_positions = rank_positions(base_score, base_mask)
+    base_result = evaluate_config(env, eligible, base_positions, baseline.spec, top_n)
+
+    columns = list(env) + ['_eligible', '_base_position']
+    n_stocks = len(eligible)
+    start = time.time()
+    results = [None] * len(configs)
+    tasks = [(index, spec) for index, (_, spec) in enumerate(configs)]
+
+    if workers == 1:
+        for index, spec in tasks:
+            results[index] = evaluate_config(env, eligible, base_positions, spec, top_n)
+    else:
+        shared = shared_memory.SharedMemory(create=True, size=max(1, len(columns) * n_stocks * 8))
+        try:
+            matrix = np.ndarray((len(columns), n_stocks), dtype=np.float64, buffer=shared.buf)
+            for i, column in enumerate(columns[:-2]):
+                matrix[i] = np.broadcast_to(np.asarray(env[column], dtype=np.float64), (n_stocks,))
+            matrix[-2] = eligible
+            matrix[-1] = base_positions
+
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers, initializer=_attach,
+                    initargs=(shared.name, matrix.shape, columns)) as pool:
+                # 每个进程约分到 4 批，减少进程间传递的次数
+                n_workers = pool._max_workers
+                size = max(1, math.ceil(len(tasks) / (n_workers * 4)))
+                futures = [pool.submit(_evaluate_chunk, tasks[i:i + size], top_n)
+                           for i in range(0, len(tasks), size)]
+                for future in concurrent.futures.as_completed(futures):
+                    for index, result in future.result():
+                        results[index] = result
+            del matrix
+        finally:
+            shared.close()
+            shared.unlink()
+
+    rows = [{**params, **result} for (params, _), result in zip(configs, results)]
+    elapsed = time.time() - start
+    print(f"参数扫描完成: {len(rows)} 个组合，耗时 {elapsed:.2f}s"
+          f"（{len(rows) / max(elapsed, 1e-9):.0f} 个/秒）")
+    return rows, base_result
+
+
+def sweep_columns(grid):
+    """run_sweep 结果的列：(列名, 类型)"""
+    return [(name, 'float') for name in grid.names] + [
+        ('roe_survivors', 'int'), ('passed', 'int'), ('top_overlap', 'int'),
+        ('top_overlap_ratio', 'float'), ('rank_corr', 'float'), ('common', 'int'),
+    ]
+
+
+def print_sweep_summary(rows, base_result, grid, top_n, limit=10):
+    """打印基准结果和与基准差别最大的几个组合"""
+    print(f"\n基准: 通过ROE筛选 {base_result['roe_survivors']} 只，通过估值筛选 {base_result['passed']} 只")
+    print(f"与基准前{top_n}名重合最少的 {min(limit, len(rows))} 个组合:")
+    ordered = sorted(rows, key=lambda row: (row['top_overlap'], -row['passed']))
+    for row in ordered[:limit]:
+        params = ", ".join(f"{name}={row[name]:g}" for name in grid.names)
+        print(f"  {params}: ROE {row['roe_survivors']}，估值 {row['passed']}，"
+              f"前{top_n}名重合 {row['top_overlap']}，名次相关 {row['rank_corr']:.3f}")
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""
+对外请求的并发控制
+
+  - TokenBucket:   令牌桶，限制每秒请求数
+  - AIMDLimiter:   根据错误和延迟自适应调整同时在途的请求数
+                   （成功时加性增加，出错或变慢时乘性减少）
+  - Hedger:        对冲请求：单次请求超过近期延迟的 p95 仍未返回时再发一个相同的请求，
+                   取先成功返回的结果；对冲请求数按预算限制，并给每次调用加超时
+  - RateController: 以上组合，所有经过它的请求都被计数、计时
+  - Deadline:      阶段截止时间，过期后不再发起新请求
+"""
+
+import collections
+import concurrent.futures
+import functools
+import threading
+import time
+
+
+class DeadlineExceeded(TimeoutError):
+    """阶段截止时间已到，请求没有发出或没有完成"""
+
+
+class Deadline:
+    """
+    阶段截止时间
+
+    Parameters:
+    seconds (float): 从现在起的秒数，为 None 时不限时
+    """
+
+    def __init__(self, seconds=None):
+        self.seconds = seconds
+        self.expires = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self):
+        """剩余秒数，不限时为 None"""
+        return None if self.expires is None else max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def cap(self, timeout):
+        """timeout 与剩余时间取较小者（None 表示不限）"""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        return remaining if timeout is None else min(timeout, remaining)
+
+
+class TokenBucket:
+    """
+    令牌桶限速
+
+    Parameters:
+    rate (float): 每秒补充的令牌数，即长期平均请求速率
+    capacity (float): 桶容量，即允许的突发请求数，默认等于 rate
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取一个令牌，没有令牌时阻塞等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def borrow(self):
+        """
+        不等待、立即取一个令牌，没有令牌时预支（之后的 acquire 相应多等），长期平均速率不变；
+        已预支满一个桶容量时返回 False
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens - 1 < -self.capacity:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class AIMDLimiter:
+    """
+    AIMD 自适应并发上限
+
+    Parameters:
+    initial (int): 初始并发数
+    minimum (int): 并发下限
+    maximum (int): 并发上限
+    latency_target (float): 单次请求超过该耗时（秒）视为上游变慢
+    backoff (float): 出错或变慢时并发数乘以该系数
+    cooldown (float): 两次减少之间的最短间隔（秒），避免同一波失败连续减半
+    """
+
+    def __init__(self, initial=10, minimum=1, maximum=20, latency_target=2.0, backoff=0.5, cooldown=1.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, ok, latency):
+        """
+        请求结束后调用，根据结果调整并发上限
+
+        Parameters:
+        ok (bool): 请求是否成功
+        latency (float): 请求耗时（秒）
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if ok and latency <= self.latency_target:
+                # 加性增加：每个并发窗口大约 +1
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            else:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self._last_decrease = now
+            self._cond.notify_all()
+
+    def cancel(self):
+        """请求没有发出（例如截止时间已到），归还并发名额，不调整上限"""
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+
+class Hedger:
+    """
+    对冲请求 + 单次调用超时，线程安全
+
+    每次调用在独立线程中执行。超过近期成功请求延迟的 quantile 分位数仍未返回时，
+    若预算允许（对冲请求数不超过请求数的 budget 比例），从令牌桶预支一个令牌
+    （对冲请求优先于排队的请求发出，总请求速率不变），再发一个相同的请求，
+    取先成功返回的结果；另一个请求的结果丢弃。
+    超过 timeout 仍没有成功结果时抛出 TimeoutError，未完成的请求在后台自行结束
+    （由 HTTP 连接池的读取超时兜底），不再等待。没有底层超时兜底时不要使用：
+    挂起的请求线程会让解释器退出时一直等待。用完后调用 close()。
+
+    Parameters:
+    timeout (float): 单次调用的超时（秒），为 None 时不限
+    quantile (float): 触发对冲的延迟分位数
+    budget (float): 对冲请求数占请求数的比例上限，为 0 时不对冲
+    min_samples (int): 样本数达到后才开始对冲
+    window (int): 计算分位数使用的最近样本数
+    max_workers (int): 执行请求的线程数（包括已超时仍在后台运行的请求）
+    """
+
+    def __init__(self, timeout=None, quantile=0.95, budget=0.05, min_samples=20, window=500, max_workers=64):
+        self.timeout = timeout
+        self.quantile = quantile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.bucket = None
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+        self._latencies = collections.deque(maxlen=window)
+        self._delay = None
+        self._samples = 0
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix="hedge")
+
+    def hedge_delay(self):
+        """触发对冲的等待时间，样本不足时为 None"""
+        return self._delay
+
+    def _timed(self, func):
+        start = time.monotonic()
+        result = func()
+        latency = time.monotonic() - start
+        with self._lock:
+            self._latencies.append(latency)
+            self._samples += 1
+            # 每 10 个样本重新计算一次分位数
+            if self._samples >= self.min_samples and (self._delay is None or self._samples % 10 == 0):
+                ordered = sorted(self._latencies)
+                self._delay = ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+        return result
+
+    def _take_budget(self):
+        with self._lock:
+            if self.budget <= 0 or self.hedges >= self.budget * self.requests:
+                return False
+        if self.bucket is not None and not self.bucket.borrow():
+            return False
+        with self._lock:
+            self.hedges += 1
+        return True
+
+    def call(self, func, timeout=None):
+        """
+        调用 func()，异常原样抛出
+
+        Parameters:
+        func (callable): 无参数的请求函数
+        timeout (float): 本次调用的超时，默认为 self.timeout
+        """
+        timeout = self.timeout if timeout is None else timeout
+        expires = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self.requests += 1
+        primary = self._executor.submit(self._timed, func)
+        pending = {primary}
+
+        delay = self.hedge_delay()
+        if delay is not None and (timeout is None or delay < timeout):
+            done, _ = concurrent.futures.wait(pending, timeout=delay)
+            if not done and self._take_budget():
+                pending.add(self._executor.submit(self._timed, func))
+
+        error = None
+        while pending:
+            wait = None if expires is None else max(0.0, expires - time.monotonic())
+            done, pending = concurrent.futures.wait(pending, timeout=wait,
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                with self._lock:
+                    self.timeouts += 1
+                raise TimeoutError(f"请求超过 {timeout:.1f} 秒未返回")
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def close(self):
+        """取消排队的请求，不等待在途的请求"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'hedges': self.hedges,
+                    'hedge_wins': self.hedge_wins, 'timeouts': self.timeouts}
+
+    def summary(self):
+        delay = self.hedge_delay()
+        return (f"对冲 {self.hedges} 次（先返回 {self.hedge_wins} 次），超时 {self.timeouts} 次"
+                + (f"，对冲阈值 {delay:.2f}s" if delay is not None else ""))
+
+
+class RateController:
+    """
+    令牌桶 + AIMD 的请求控制器，线程安全
+
+    Parameters:
+    rate (float): 每秒请求数上限
+    burst (float): 允许的突发请求数
+    initial, minimum, maximum (int): AIMD 的初始/最小/最大并发数
+    latency_target (float): 判定上游变慢的耗时阈值（秒）
+    hedger (Hedger): 对冲请求和单次调用超时，为 None 时直接调用；对冲请求与正常请求共用令牌桶
+    """
+
+    def __init__(self, rate=20.0, burst=None, initial=10, minimum=1, maximum=20, latency_target=2.0,
+                 hedger=None):
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AIMDLimiter(initial, minimum, maximum, latency_target)
+        self.hedger = hedger
+        if hedger is not None:
+            hedger.bucket = self.bucket
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    @property
+    def max_workers(self):
+        """线程池大小：取并发上限，实际在途数由 AIMD 控制"""
+        return self.limiter.maximum
+
+    def call(self, func, *args, deadline=None, **kwargs):
+        """
+        限速后调用 func，异常原样抛出
+
+        Parameters:
+        deadline (Deadline): 阶段截止时间，已过期时不发请求，直接抛出 DeadlineExceeded；
+                             有 hedger 时单次调用的超时不超过剩余时间
+        """
+        if deadline is not None and deadline.expired():
+            raise DeadlineExceeded("阶段截止时间已到")
+        self.bucket.acquire()
+        self.limiter.acquire()
+        if deadline is not None and deadline.expired():
+            self.limiter.cancel()
+            raise DeadlineExceeded("阶段截止时间已到")
+        start = time.monotonic()
+        ok = False
+        try:
+            if self.hedger is not None:
+                timeout = self.hedger.timeout if deadline is None else deadline.cap(self.hedger.timeout)
+                result = self.hedger.call(functools.partial(func, *args, **kwargs), timeout=timeout)
+            else:
+                result = func(*args, **kwargs)
+            ok = True
+            return result
+        except TimeoutError:
+            if deadline is not None and deadline.expired():
+                # 截止时间到了才超时，不算上游出错
+                self.limiter.cancel()
+                start = None
+                raise DeadlineExceeded("阶段截止时间已到")
+            raise
+        finally:
+            if start is not None:
+                self.limiter.release(ok, time.monotonic() - start)
+                with self._lock:
+                    self.calls += 1
+                    if not ok:
+                        self.errors += 1
+
+    def close(self):
+        if self.hedger is not None:
+            self.hedger.close()
+
+    def summary(self):
+        text = f"请求 {self.calls} 次，失败 {self.errors} 次，当前并发上限 {int(self.limiter.limit)}"
+        if self.hedger is not None:
+            text += "；" + self.hedger.summary()
+        return text
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""测试从 code/ 目录导入模块（各模块之间按同目录方式互相导入）；公用的 fixture"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'code'))
+
+
+@pytest.fixture
+def synthetic_market(monkeypatch):
+    """
+    返回 make(n_periods, n_codes=2000, seed=1)：把 ROEselection 的数据源换成合成市场
+    （无缓存、无日志、不限速），测试结束后恢复全局状态
+    """
+    import ROEselection as roe
+    import roe_bench
+    from roe_datasource import set_data_source
+
+    for name in ('ROE_CACHE', 'RUN_JOURNAL', 'RESULT_STREAM', 'SECURITIES_MASTER', 'METRICS_RATE',
+                 'METRICS_RETRY_PASSES', 'REPORT_PERIODS', 'QUOTE_MODE', 'SCREEN_SPEC'):
+        monkeypatch.setattr(roe, name, getattr(roe, name))
+    previous = set_data_source(None)
+
+    def make(n_periods, n_codes=2000, seed=1):
+        periods = roe_bench.quarter_ends(n_periods)
+        market = roe_bench.SyntheticMarket(n_codes, periods, seed=seed)
+        roe_bench._prepare_module(market)
+        roe.REPORT_PERIODS = periods
+        roe.QUOTE_MODE = 'bulk'
+        return market
+
+    yield make
+    set_data_source(previous)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""回测：每个调仓日只使用当时已过披露截止日的报告期"""
+
+import csv
+import datetime
+import os
+
+import pandas as pd
+import pytest
+
+from roe_backtest import latest_available_period, point_in_time_periods, quarter_end_dates, run_backtest
+from roe_cache import period_deadline
+from roe_datasource import DataSource, set_data_source
+
+
+@pytest.mark.parametrize('date, expected', [
+    ('20250331', '20240930'),   # 2024 年报 4月30日 才截止
+    ('20250630', '20250331'),
+    ('20250930', '20250630'),
+    ('20251231', '20250930'),
+    ('20250430', '20250331'),   # 截止日当天可用
+    ('20250429', '20240930'),
+])
+def test_latest_available_period(date, expected):
+    assert latest_available_period(date) == expected
+
+
+def test_point_in_time_periods_never_look_ahead():
+    for date in quarter_end_dates('2010', '20261231'):
+        day = datetime.datetime.strptime(date, "%Y%m%d").date()
+        periods = point_in_time_periods(date)
+        assert len(periods) == 6 and periods == sorted(periods)
+        assert all(period_deadline(period) <= day for period in periods)
+        # 最新一期之后的报告期都还没有到截止日
+        later = [p for p in quarter_end_dates('2009', date) if p > periods[-1]]
+        assert all(period_deadline(period) > day for period in later)
+
+
+POISONED = '20240630'   # 该期 600002 的 ROE 为 -50，公布后（8月31日）该股不再通过ROE筛选
+
+
+class BacktestSource(DataSource):
+    """两只股票：ROE、每股收益按季度累计，股价恒定，每年 5 月派现"""
+
+    def __init__(self):
+        self.yjbb_periods = []
+
+    def call(self, endpoint, *args):
+        if endpoint == 'stock_yjbb_em':
+            period = args[0]
+            self.yjbb_periods.append(period)
+            quarters = int(period[4:6]) // 3
+            roe = {'600001': 2.5 * quarters, '600002': -50.0 if period == POISONED else 2.5 * quarters}
+            return pd.DataFrame({'股票代码': list(roe), '净资产收益率': list(roe.values()),
+                                 '每股收益': 0.25 * quarters, '每股净资产': 10.0})
+        if endpoint == 'stock_fhps_em':
+            period = args[0]
+            ex_date = f"{int(period[:4]) + 1}-05-15" if period.endswith('1231') else None
+            return pd.DataFrame({'代码': ['600001', '600002'], '现金分红-现金分红比例': 5.0,
+                                 '除权除息日': ex_date})
+        if endpoint == 'stock_zh_a_hist':
+            start, end = args[2], args[3]
+            months = pd.period_range(f"{start[:4]}-{start[4:6]}", f"{end[:4]}-{end[4:6]}", freq='M')
+            return pd.DataFrame({'日期': [month.end_time.strftime('%Y-%m-%d') for month in months],
+                                 '收盘': 10.0})
+        raise LookupError(endpoint)
+
+
+def _read_csv(path):
+    with open(path, encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+
+def test_backtest_uses_only_published_periods(tmp_path):
+    source = BacktestSource()
+    previous = set_data_source(source)
+    try:
+        run_backtest('2024', '20241231', top_n=5, horizons=(1,), out_dir=str(tmp_path))
+    finally:
+        set_data_source(previous)
+
+    last_day = datetime.date(2024, 12, 31)
+    assert source.yjbb_periods and all(period_deadline(p) <= last_day for p in source.yjbb_periods)
+
+    summary = _read_csv(os.path.join(str(tmp_path), "backtest_summary.csv"))
+    assert [row['latest_period'] for row in summary] == ['20230930', '20240331', '20240630', '20240930']
+    rankings = _read_csv(os.path.join(str(tmp_path), "backtest_rankings.csv"))
+    held = {}
+    for row in rankings:
+        assert row['latest_period'] == latest_available_period(row['date'])
+        held.setdefault(row['date'], []).append(row['code'].lstrip("'"))
+    # 20240630 时半年报尚未公布，600002 仍入选；9月30日起用到半年报，被剔除；年底最新一期为三季报，重新入选
+    assert held == {'20240331': ['600001', '600002'], '20240630': ['600001', '600002'],
+                    '20240930': ['600001'], '20241231': ['600001', '600002']}
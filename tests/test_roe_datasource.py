@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""roe_datasource：录制 -> 回放、缺失录制、按种子复现的模拟错误和两种限流模式"""
+
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from roe_datasource import (DataSource, RecordingDataSource, ReplayDataSource, ReplayMissError,
+                            ThrottledError)
+
+
+class _FakeSource(DataSource):
+    """按调用参数返回固定的 DataFrame，记录调用次数"""
+
+    def __init__(self):
+        self.calls = []
+
+    def call(self, endpoint, *args):
+        self.calls.append((endpoint, args))
+        return pd.DataFrame({'item': ['代码', '市盈率(TTM)', '名称'],
+                             'value': [f"{endpoint}:{'/'.join(map(str, args))}", '12.5', '浦发银行']})
+
+
+def _record(directory, calls):
+    recorder = RecordingDataSource(_FakeSource(), directory)
+    return {(endpoint, args): recorder.call(endpoint, *args) for endpoint, args in calls}
+
+
+def test_record_replay_round_trip(tmp_path):
+    calls = [('stock_individual_spot_xq', ('SH600000',)),
+             ('stock_zh_a_spot_em', ()),
+             ('stock_zh_a_hist', ('600000', 'monthly', '20200101', '20201231', 'qfq'))]
+    recorded = _record(str(tmp_path), calls)
+
+    replay = ReplayDataSource(str(tmp_path))
+    for (endpoint, args), df in recorded.items():
+        pd.testing.assert_frame_equal(replay.call(endpoint, *args), df)
+    # 具名方法与 call 走同一份录制
+    pd.testing.assert_frame_equal(replay.stock_individual_spot_xq('SH600000'), recorded[calls[0]])
+    assert replay.calls == 4 and replay.errors == 0
+
+
+def test_replay_miss(tmp_path):
+    _record(str(tmp_path), [('stock_individual_spot_xq', ('SH600000',))])
+    replay = ReplayDataSource(str(tmp_path))
+    with pytest.raises(ReplayMissError):
+        replay.stock_individual_spot_xq('SZ000001')
+    # 缺失录制不是模拟的网络错误
+    assert replay.errors == 0
+
+
+def _error_sequence(directory, seed, n=200):
+    replay = ReplayDataSource(directory, error_rate=0.3, seed=seed)
+    outcomes = []
+    for _ in range(n):
+        try:
+            replay.stock_individual_spot_xq('SH600000')
+            outcomes.append(True)
+        except ConnectionError:
+            outcomes.append(False)
+    return replay, outcomes
+
+
+def test_seeded_error_rate_is_reproducible(tmp_path):
+    _record(str(tmp_path), [('stock_individual_spot_xq', ('SH600000',))])
+    first, outcomes = _error_sequence(str(tmp_path), seed=7)
+    _, again = _error_sequence(str(tmp_path), seed=7)
+    _, other = _error_sequence(str(tmp_path), seed=8)
+
+    assert outcomes == again
+    assert outcomes != other
+    assert first.errors == outcomes.count(False)
+    assert 0.2 < first.errors / len(outcomes) < 0.4
+
+
+def test_throttle_error_mode(tmp_path):
+    _record(str(tmp_path), [('stock_individual_spot_xq', ('SH600000',))])
+
+    # 每秒 2 个请求：第 3 个立即被限流
+    replay = ReplayDataSource(str(tmp_path), rate_limit=2, throttle_mode='error', seed=0)
+    replay.stock_individual_spot_xq('SH600000')
+    replay.stock_individual_spot_xq('SH600000')
+    with pytest.raises(ThrottledError):
+        replay.stock_individual_spot_xq('SH600000')
+    assert replay.throttled == 1
+
+    # 并发上限 1：前一个请求在途时后一个被限流
+    replay = ReplayDataSource(str(tmp_path), latency=0.3, max_concurrency=1, throttle_mode='error', seed=0)
+    thread = threading.Thread(target=replay.stock_individual_spot_xq, args=('SH600000',))
+    thread.start()
+    while replay._in_flight == 0:
+        time.sleep(0.01)
+    with pytest.raises(ThrottledError):
+        replay.stock_individual_spot_xq('SH600000')
+    thread.join()
+    assert replay.throttled == 1
+
+
+def test_throttle_delay_mode(tmp_path):
+    _record(str(tmp_path), [('stock_individual_spot_xq', ('SH600000',))])
+
+    # 每秒 2 个请求：第 3 个排队到第 1 个请求 1 秒之后
+    replay = ReplayDataSource(str(tmp_path), rate_limit=2, throttle_mode='delay', seed=0)
+    start = time.monotonic()
+    for _ in range(3):
+        replay.stock_individual_spot_xq('SH600000')
+    assert time.monotonic() - start >= 0.95
+    assert replay.throttled == 0
+
+    # 并发上限 1：两个并发请求依次执行
+    replay = ReplayDataSource(str(tmp_path), latency=0.2, max_concurrency=1, throttle_mode='delay', seed=0)
+    start = time.monotonic()
+    threads = [threading.Thread(target=replay.stock_individual_spot_xq, args=('SH600000',)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - start >= 0.4
+    assert replay.calls == 2 and replay.throttled == 0
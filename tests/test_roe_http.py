@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""roe_http：本地 HTTP 服务上的连接复用、错误计数、默认超时和卸载"""
+
+import concurrent.futures
+import http.server
+import threading
+import time
+
+import pytest
+import requests
+import requests.api
+
+import roe_http
+from roe_http import HTTPPool, install_http_pool, uninstall_http_pool, get_http_pool
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    # HTTP/1.1 才保持连接
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.startswith('/slow'):
+            time.sleep(0.5)
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def pool():
+    pool = install_http_pool(HTTPPool(pool_size=4))
+    yield pool
+    uninstall_http_pool()
+
+
+def test_concurrent_requests_reuse_connections(server, pool):
+    url = f"http://{server}/ok"
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        bodies = list(executor.map(lambda _: requests.get(url).text, range(40)))
+    assert bodies == ['ok'] * 40
+
+    stats = get_http_pool().stats()[server]
+    assert stats['requests'] == 40
+    assert stats['connections'] <= 4
+    assert stats['reused'] == stats['requests'] - stats['connections']
+    assert stats['reuse_ratio'] >= 0.9
+    assert stats['errors'] == 0
+
+
+def test_errors_are_counted(server):
+    pool = install_http_pool(HTTPPool(read_timeout=0.1))
+    try:
+        with pytest.raises(requests.ReadTimeout):
+            requests.get(f"http://{server}/slow")
+        # 调用方指定的超时优先于默认超时
+        assert requests.get(f"http://{server}/slow", timeout=5).text == 'ok'
+        assert pool.stats()[server]['errors'] == 1
+    finally:
+        uninstall_http_pool()
+
+
+def test_default_timeout(server, pool, monkeypatch):
+    assert HTTPPool().timeout == (5.0, 30.0)
+    seen = []
+    original = requests.Session.request
+
+    def spy(self, method, url, **kwargs):
+        seen.append(kwargs.get('timeout'))
+        return original(self, method, url, **kwargs)
+    monkeypatch.setattr(requests.Session, 'request', spy)
+
+    requests.get(f"http://{server}/ok")
+    requests.get(f"http://{server}/ok", timeout=3)
+    assert seen == [(5.0, 30.0), 3]
+
+
+def test_uninstall_restores_requests(server):
+    install_http_pool()
+    assert requests.api.request is not roe_http._original_request
+    uninstall_http_pool()
+    assert requests.api.request is roe_http._original_request
+    assert requests.request is roe_http._original_request
+    assert get_http_pool() is None
+    # 卸载后的请求不经过连接池
+    assert requests.get(f"http://{server}/ok").text == 'ok'
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""增量模式：沿用上次的打分和名次，与完整排名一致"""
+
+import math
+
+import pytest
+
+import ROEselection as roe
+from roe_cache import ROECache
+from roe_incremental import compute_delta, rescale_metrics
+from test_roe_ranking import full_ranking
+
+
+def test_incremental_ranking_with_20_periods(synthetic_market, tmp_path):
+    synthetic_market(20)
+    cache = ROECache(str(tmp_path / 'cache.sqlite'))
+    roe.ROE_CACHE = cache
+    expected = [code for code, _ in full_ranking()]
+
+    first, _, _ = roe.run_incremental_pipeline(cache, delta_path=str(tmp_path / 'delta.txt'))
+    # 第二次全部沿用上次的性价比，按上次名次与变化的股票归并
+    second, _, _ = roe.run_incremental_pipeline(cache, delta_path=str(tmp_path / 'delta.txt'))
+    assert [code for code, _ in first] == expected
+    assert [code for code, _ in second] == expected
+    assert len(second[0][1]) == 20 + 6
+
+
+def test_finished_latest_period_served_from_cache(synthetic_market, tmp_path):
+    import roe_bench
+    from roe_datasource import set_data_source
+
+    market = synthetic_market(6)
+    cache = ROECache(str(tmp_path / 'cache.sqlite'))
+    roe.ROE_CACHE = cache
+    roe.run_incremental_pipeline(cache, delta_path=str(tmp_path / 'delta.txt'))
+
+    calls = []
+
+    class CountingSource(roe_bench.SyntheticDataSource):
+        def call(self, endpoint, *args):
+            calls.append((endpoint, args))
+            return super().call(endpoint, *args)
+
+    set_data_source(CountingSource(market))
+    # 最新一期 20250930 早已结束披露，第二次运行不再重新获取任何报告期
+    roe.run_incremental_pipeline(cache, delta_path=str(tmp_path / 'delta.txt'))
+    assert not [args for endpoint, args in calls if endpoint == 'stock_yjbb_em']
+
+
+def test_rescale_metrics():
+    pe, dy, pb, name = rescale_metrics((20.0, 3.0, 2.0, '浦发银行'), 10.0, 12.5)
+    assert (pe, dy, pb, name) == (pytest.approx(25.0), pytest.approx(2.4), pytest.approx(2.5), '浦发银行')
+    pe, dy, pb, _ = rescale_metrics((float('nan'), 3.0, 2.0, '浦发银行'), 10.0, 5.0)
+    assert math.isnan(pe) and dy == 6.0 and pb == 1.0
+
+
+def test_compute_delta():
+    previous = {'A': 1, 'B': 2, 'C': 3, 'D': 4, 'E': 5}
+    current = {'C': 1, 'A': 2, 'F': 3, 'B': 4, 'E': 9}
+    delta = compute_delta(previous, current, roe_selected={'A', 'B', 'C', 'D', 'E', 'F'}, top_n=4)
+    assert delta['entrants'] == [('F', 3, None)]
+    assert delta['dropouts'] == [('D', 4, None, "未通过估值筛选")]
+    # 按变化幅度从大到小，幅度相同按本次名次
+    assert delta['moves'] == [('C', 3, 1), ('B', 2, 4), ('A', 1, 2)]
+
+    delta = compute_delta(previous, current, roe_selected={'A', 'B', 'C', 'F'}, top_n=5)
+    assert delta['dropouts'] == [('D', 4, None, "未通过ROE筛选"), ('E', 5, 9, "排名降至 9")]
+    assert delta['entrants'] == [('F', 3, None)]
+
+
+def test_price_change_rescores_only_that_stock(synthetic_market, tmp_path, monkeypatch):
+    market = synthetic_market(6)
+    roe.QUOTE_MODE = 'xq'   # 没有全市场快照，估值按最新价换算
+    cache = ROECache(str(tmp_path / 'cache.sqlite'))
+    roe.ROE_CACHE = cache
+    delta_path = str(tmp_path / 'delta.txt')
+    first, _, _ = roe.run_incremental_pipeline(cache, delta_path=delta_path)
+
+    # 排名中间的一只股票价格减半：市盈率、市净率减半，股息率翻倍，性价比翻倍
+    code, data = first[len(first) // 2]
+    market.spot.loc[market.spot['代码'] == code, '最新价'] *= 0.5
+    rescored = []
+    score_stock = roe.score_stock
+
+    def spy(roe_list, metrics):
+        rescored.append(metrics[3])
+        return score_stock(roe_list, metrics)
+
+    monkeypatch.setattr(roe, 'score_stock', spy)
+    second, _, _ = roe.run_incremental_pipeline(cache, delta_path=delta_path)
+
+    assert rescored == [data[-1]]
+    new_score = dict(second)[code][-2]
+    assert new_score == pytest.approx(2 * data[-2])
+    others = [item for item in first if item[0] != code]
+    assert [c for c, _ in second if c != code] == [c for c, _ in others]
+    assert [c for c, _ in second].index(code) == sum(1 for _, d in others if d[-2] > new_score)
+    with open(delta_path, encoding='utf-8') as f:
+        assert f"'{code}," in f.read()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""运行日志：写入后读回、按 --journal-max-age 过期、半行记录，以及 --resume 续跑不再重复请求"""
+
+import json
+import math
+import time
+
+import ROEselection as roe
+import roe_bench
+from roe_datasource import set_data_source
+from roe_journal import RunJournal
+from test_roe_ranking import full_ranking
+
+UNFINISHED = "20991231"     # 仍在披露期内的报告期
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    journal = RunJournal(path)
+    journal.record_period("20241231", {'600000': 8.5, '000001': float('nan')})
+    journal.record_metrics('600000', (5.2, float('nan'), 0.6, '浦发银行'))
+    journal.close()
+
+    resumed = RunJournal(path, resume=True)
+    assert resumed.get_period("20241231")['600000'] == 8.5
+    assert resumed.get_period("20241231")['000001'] is None
+    pe, dy, pb, name = resumed.get_metrics('600000')
+    assert (pe, pb, name) == (5.2, 0.6, '浦发银行') and math.isnan(dy)
+    assert resumed.get_metrics('000001') is None
+    resumed.close()
+
+    # 不续跑时清空重新开始
+    RunJournal(path).close()
+    resumed = RunJournal(path, resume=True)
+    assert resumed.get_period("20241231") is None
+    resumed.close()
+
+
+def _write_lines(path, entries, tail=""):
+    with open(path, 'w', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        f.write(tail)
+
+
+def test_stale_entries_expire_per_max_age(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    now = time.time()
+    old, recent = now - 3 * 3600, now - 600
+    _write_lines(path, [
+        {'type': 'period', 'ts': old, 'date': "20241231", 'data': {'600000': 8.5}},
+        {'type': 'period', 'ts': old, 'date': UNFINISHED, 'data': {'600000': 2.0}},
+        {'type': 'period', 'ts': recent, 'date': "20981231", 'data': {'600000': 3.0}},
+        {'type': 'metrics', 'ts': old, 'code': '600000', 'metrics': [5.2, 4.0, 0.6, '浦发银行']},
+        {'type': 'metrics', 'ts': recent, 'code': '000001', 'metrics': [4.9, 5.0, 0.5, '平安银行']},
+    ])
+    args = roe.parse_args(['--resume', '--journal-path', path, '--journal-max-age', '1'])
+    journal = roe.setup_journal(args)
+    try:
+        assert journal.max_age_hours == 1
+        # 已结束披露的报告期不过期；未结束的和估值数据按有效时长过期
+        assert journal.get_period("20241231") == {'600000': 8.5}
+        assert journal.get_period(UNFINISHED) is None
+        assert journal.get_period("20981231") == {'600000': 3.0}
+        assert journal.get_metrics('600000') is None
+        assert journal.get_metrics('000001') == (4.9, 5.0, 0.5, '平安银行')
+    finally:
+        journal.close()
+        roe.RUN_JOURNAL = None
+
+
+def test_truncated_last_line(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    _write_lines(path, [{'type': 'metrics', 'ts': time.time(), 'code': '600000',
+                         'metrics': [5.2, 4.0, 0.6, '浦发银行']}],
+                 tail='{"type": "metrics", "ts": 1, "code": "0000')
+    journal = RunJournal(path, resume=True)
+    assert journal.get_metrics('600000') == (5.2, 4.0, 0.6, '浦发银行')
+    journal.record_metrics('000001', (4.9, 5.0, 0.5, '平安银行'))
+    journal.close()
+
+    # 半行之后追加的记录再次续跑时仍能读回
+    journal = RunJournal(path, resume=True)
+    assert journal.get_metrics('000001') == (4.9, 5.0, 0.5, '平安银行')
+    assert journal.get_metrics('600000') == (5.2, 4.0, 0.6, '浦发银行')
+    journal.close()
+
+
+def _codes_and_scores(ranked):
+    return [(code, data[-2]) for code, data in ranked]
+
+
+def test_resume_skips_journaled_requests(synthetic_market, tmp_path):
+    market = synthetic_market(6, n_codes=300)
+    roe.QUOTE_MODE = 'xq'
+    path = str(tmp_path / 'journal.jsonl')
+    roe.setup_journal(roe.parse_args(['--journal-path', path]))
+    expected = _codes_and_scores(full_ranking())
+    roe.RUN_JOURNAL.close()
+
+    calls = []
+
+    class CountingSource(roe_bench.SyntheticDataSource):
+        def call(self, endpoint, *args):
+            calls.append((endpoint, args))
+            return super().call(endpoint, *args)
+
+    set_data_source(CountingSource(market))
+    try:
+        roe.setup_journal(roe.parse_args(['--resume', '--journal-path', path]))
+        assert _codes_and_scores(full_ranking()) == expected
+        assert calls == []
+        roe.RUN_JOURNAL.close()
+
+        # 有效时长为 0 时估值全部重新请求，已结束披露的报告期仍从日志读取
+        roe.setup_journal(roe.parse_args(['--resume', '--journal-path', path, '--journal-max-age', '0']))
+        assert _codes_and_scores(full_ranking()) == expected
+        assert not [endpoint for endpoint, _ in calls if endpoint == 'stock_yjbb_em']
+        requested = {args[0][2:] for endpoint, args in calls if endpoint == 'stock_individual_spot_xq'}
+        assert {code for code, _ in expected} <= requested
+    finally:
+        roe.RUN_JOURNAL.close()
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""roe_master：代码段规则与不参与选股的板块"""
+
+import pytest
+
+from roe_master import classify_code, EXCLUDED_BOARDS
+
+
+@pytest.mark.parametrize('code, expected', [
+    ('600000', ('SH', 'main')), ('688001', ('SH', 'star')),
+    ('000001', ('SZ', 'main')), ('300750', ('SZ', 'chinext')),
+    ('920001', ('BJ', 'bse')), ('830799', ('BJ', 'bse')), ('430047', ('BJ', 'bse')),
+    ('200002', ('SZ', 'b_share')), ('900901', ('SH', 'b_share')),
+])
+def test_classify_code(code, expected):
+    assert classify_code(code) == expected
+
+
+@pytest.mark.parametrize('code', ['200002', '299999', '900901', '930000', '830799', '430047'])
+def test_codes_starting_with_2_4_8_9_are_excluded(code):
+    assert classify_code(code)[1] in EXCLUDED_BOARDS
+
+
+def test_cached_master_boards_follow_current_rules(tmp_path):
+    from roe_cache import ROECache
+    from roe_master import load_securities_master
+
+    cache = ROECache(str(tmp_path / 'cache.sqlite'))
+    # 旧规则写入缓存的板块：299999 为 unknown，会通过 board_mask
+    cache.save_securities({'299999': ('SH', 'unknown', '旧B股', 'listed'),
+                           '600000': ('SH', 'main', '浦发银行', 'listed')})
+    master = load_securities_master(cache)
+    assert master.board('299999') == 'b_share'
+    assert master.exchange('299999') == 'SZ'
+    assert master.name('299999') == '旧B股'
+    assert master.board_mask(['299999', '600000']).tolist() == [False, True]
+    cache.close()
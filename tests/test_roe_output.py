@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""roe_output：文本报告与输出行按报告期数取列"""
+
+import numpy as np
+
+from roe_output import result_row, write_text_report, TEXT_REPORT_ROE_HEADER
+
+
+def _data(n_periods):
+    roe = [float(i + 1) for i in range(n_periods)]
+    return roe + [float(np.mean(roe)), 15.0, 2.5, 1.2, 0.789, '测试股份']
+
+
+def _report_lines(tmp_path, ranked, periods):
+    path = tmp_path / 'report.txt'
+    write_text_report(ranked, 10, 5, {'600000': '银行'}, str(path), top_n=10, periods=periods)
+    lines = path.read_text(encoding='utf-8').splitlines()
+    header = next(i for i, line in enumerate(lines) if line.startswith("排名,"))
+    return lines[header], lines[header + 1]
+
+
+def test_text_report_with_20_periods(tmp_path):
+    periods = [f"2020{i:04d}" for i in range(20)]
+    header, row = _report_lines(tmp_path, [('600000', _data(20))], periods)
+    fields = row.split(",")
+    assert header.split(",")[4:24] == [f"ROE{period}" for period in periods]
+    assert fields[:4] == ['1', "'600000", '测试股份', '银行']
+    assert fields[4:24] == [f"{i + 1:.2f}" for i in range(20)]
+    assert fields[24:] == ['平均', '10.50', '市盈', '15.00', '股息', '2.50', '市净', '1.20', '价值', '0.789']
+
+
+def test_text_report_keeps_six_period_header(tmp_path):
+    header, row = _report_lines(tmp_path, [('600000', _data(6))], None)
+    assert TEXT_REPORT_ROE_HEADER in header
+    assert row.split(",")[-2:] == ['价值', '0.789']
+
+
+def test_result_row_with_20_periods():
+    periods = [f"2020{i:04d}" for i in range(20)]
+    row = result_row('600000', _data(20), periods, rank=1)
+    assert row['roe_20200019'] == 20.0
+    assert row['avg_roe'] == 10.5 and row['value_ratio'] == 0.789 and row['name'] == '测试股份'
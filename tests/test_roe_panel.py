@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""ROE 面板：向量化的获取 + 筛选与原来逐只股票的字典实现选出相同的股票和平均值"""
+
+import numpy as np
+import pandas as pd
+
+import ROEselection as roe
+from roe_datasource import DataSource, set_data_source
+from roe_master import SecuritiesMaster
+
+PERIODS = ["20201231", "20211231", "20221231", "20231231", "20241231", "20250930"]
+nan = np.nan
+
+# 每只股票各报告期的 ROE；None 表示该期的数据里没有这只股票
+ROE_TABLE = {
+    '600001': [12.0, 15.0, 14.0, 13.0, 16.0, 9.0],
+    '000002': [8.0, nan, 10.0, nan, 12.0, 7.5],           # 中间有缺失
+    '300003': [6.0, 7.0, 8.0, 9.0, 10.0, nan],            # 最新一期缺失
+    '688004': [None, None, 20.0, 22.0, 18.0, 15.0],       # 上市较晚
+    '600005': [1.0, 1.0, 1.0, 1.0, 1.0, 0.9],             # 年化后平均值才超过 1%
+    '000006': [0.5, 0.8, 1.0, 0.6, 0.7, 0.6],             # 平均值不足 1%
+    '000007': [10.0, -6.0, 12.0, 14.0, 15.0, 9.0],        # 最小值不超过 -5%
+    '600008': [-1.0, 10.0, 12.0, 11.0, 13.0, 9.0],        # 负的最小值，按绝对值判断条件2
+    '600009': [0.1, 12.0, 14.0, 13.0, 15.0, 12.0],        # 最小值乘以 80 不超过平均值
+    '000010': [nan, nan, nan, nan, nan, nan],             # 没有有效数据
+    '600011': [None, None, None, None, None, 6.0],        # 只有最新一期
+    '830012': [20.0, 20.0, 20.0, 20.0, 20.0, 15.0],       # 新三板/北交所
+    '430013': [20.0, 20.0, 20.0, 20.0, 20.0, 15.0],
+    '200014': [20.0, 20.0, 20.0, 20.0, 20.0, 15.0],       # B股
+    '900015': [20.0, 20.0, 20.0, 20.0, 20.0, 15.0],
+}
+
+
+class TableDataSource(DataSource):
+    def call(self, endpoint, *args):
+        assert endpoint == 'stock_yjbb_em'
+        column = PERIODS.index(args[0])
+        rows = [(code, values[column]) for code, values in ROE_TABLE.items() if values[column] is not None]
+        return pd.DataFrame(rows, columns=['股票代码', '净资产收益率'])
+
+
+def baseline_clean(roe_data_by_year, years):
+    """原来的 get_multi_year_ROE + clean_data_ROE_v2：逐只股票处理字典"""
+    all_codes = set()
+    for year_data in roe_data_by_year.values():
+        all_codes.update(year_data.keys())
+    filtered = {}
+    for code in all_codes:
+        if code[0] in '8294':
+            continue
+        roe_list = [roe_data_by_year[year].get(code, nan) for year in years]
+        roe_list[-1] = roe_list[-1] / 3 * 4
+        valid = [x for x in roe_list if not np.isnan(x)]
+        if not valid:
+            continue
+        avg_roe = sum(valid) / len(valid)
+        if avg_roe <= 1:
+            continue
+        min_roe = min(valid)
+        if min_roe <= -5:
+            continue
+        if abs(min_roe) * 80 > avg_roe or min_roe * 80 > avg_roe:
+            filtered[code] = roe_list + [avg_roe]
+    return filtered
+
+
+def test_panel_screen_matches_baseline_dict_path(synthetic_market):
+    synthetic_market(6, n_codes=10)
+    set_data_source(TableDataSource())
+    roe.SECURITIES_MASTER = SecuritiesMaster({})
+    roe.REPORT_PERIODS = PERIODS
+
+    expected = baseline_clean({year: roe.get_ROE(year) for year in PERIODS}, PERIODS)
+    assert set(expected) == {'600001', '000002', '300003', '688004', '600005', '600008', '600011'}
+
+    panel, years = roe.get_multi_year_ROE_panel()
+    selected, avg_roe = roe.screen_ROE_panel(panel)
+    assert years == PERIODS
+    assert sorted(selected.codes.tolist()) == sorted(expected)
+    for code, values, avg in zip(selected.codes.tolist(), selected.values, avg_roe):
+        np.testing.assert_allclose(values, expected[code][:-1], rtol=1e-12)
+        assert np.isclose(avg, expected[code][-1], rtol=1e-12, atol=0)
+
+    filtered, total, passed = roe.clean_data_ROE_v2()
+    assert total == len(ROE_TABLE) - 4 and passed == len(expected)
+    for code, roe_list in filtered.items():
+        np.testing.assert_allclose(roe_list, expected[code], rtol=1e-12)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""打分与排名：报告期数不是 6 时按性价比（而不是某一期 ROE）排名"""
+
+import numpy as np
+
+import ROEselection as roe
+
+
+def full_ranking():
+    """默认流程（clean_data_ROE_v2 + get_quotes + score_stocks + rank_stocks）的完整排名"""
+    filtered, _, _ = roe.clean_data_ROE_v2()
+    quotes = roe.get_quotes(list(filtered))
+    scored = roe.score_stocks([filtered[code] for code in filtered], [quotes[code] for code in filtered])
+    return roe.rank_stocks({code: data for code, data in zip(filtered, scored) if data is not None})
+
+
+def _scored(n_periods, n_stocks=300, seed=0):
+    rng = np.random.default_rng(seed)
+    roe_values = rng.uniform(2, 40, size=(n_stocks, n_periods))
+    roe_lists = [row.tolist() + [float(row.mean())] for row in roe_values]
+    metrics_list = [(float(pe), float(dy), float(pb), f"股票{i}")
+                    for i, (pe, dy, pb) in enumerate(zip(rng.uniform(3, 150, n_stocks),
+                                                         rng.uniform(0.2, 6, n_stocks),
+                                                         rng.uniform(0.3, 20, n_stocks)))]
+    codes = [f"{i:06d}" for i in range(n_stocks)]
+    scored = roe.score_stocks(roe_lists, metrics_list)
+    enhanced = {code: data for code, data in zip(codes, scored) if data is not None}
+    # 独立计算的性价比，按 (-性价比, 原顺序) 排序
+    expected = sorted(enhanced, key=lambda code: (-(roe_lists[int(code)][-1] / 12 / metrics_list[int(code)][2]
+                                                    + 100 / metrics_list[int(code)][0] / 12), int(code)))
+    return enhanced, expected
+
+
+def test_enhanced_list_layout_with_20_periods():
+    enhanced, _ = _scored(20)
+    data = next(iter(enhanced.values()))
+    assert len(data) == 20 + 6
+    assert isinstance(data[-1], str)
+    assert data[-6] == np.mean(data[:20])
+
+
+def test_rank_stocks_uses_value_ratio_for_any_period_count():
+    for n_periods in (6, 20):
+        enhanced, expected = _scored(n_periods)
+        assert [code for code, _ in roe.rank_stocks(enhanced)] == expected
+        assert [code for code, _ in roe.rank_stocks(enhanced, top_k=10)] == expected[:10]
+
+
+def test_stream_top_k_matches_full_ranking(synthetic_market):
+    synthetic_market(20)
+    ranked, _, _, _ = roe.run_stream_pipeline(top_k=20)
+    expected = full_ranking()[:20]
+
+    assert len(ranked[0][1]) == 20 + 6
+    assert [code for code, _ in ranked] == [code for code, _ in expected]
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""roe_rules：表达式白名单、默认规则与原来写死的条件一致、top_k_indices 的排序"""
+
+import numpy as np
+import pytest
+
+from roe_rules import DEFAULT_SPEC, RuleError, ScreenSpec, compile_expression, roe_env, top_k_indices
+
+VALUE_VARS = {'avg_roe', 'pe', 'dividend_yield', 'pb'}
+
+
+@pytest.mark.parametrize('source', [
+    "os",                               # 未知变量
+    "__import__('os')",                 # 不在白名单中的函数
+    "open('x')",
+    "pe.real",                          # 属性
+    "pb[0]",                            # 下标
+    "(lambda: 1)()",
+    "[pe for pe in pb]",
+    "max(pe, key=pb)",                  # 关键字参数
+    "abs(pe, pb)",                      # 参数个数不对
+    "'pe' > 1",                         # 字符串常量
+    "True",
+    "pe // 2",                          # 不支持的运算符
+    "pe in pb",
+    "pe >",                             # 无法解析
+])
+def test_compile_rejects_unsupported_names_and_calls(source):
+    with pytest.raises(RuleError):
+        compile_expression(source, VALUE_VARS)
+
+
+def test_period_names_only_allowed_with_roe_1():
+    env = roe_env([[1.0, 2.0, 3.0]])
+    assert compile_expression("roe_3 - roe_1", {'roe_1'})(env).tolist() == [2.0]
+    with pytest.raises(RuleError):
+        compile_expression("roe_3", {'avg_roe'})
+
+
+def test_unknown_spec_field_rejected():
+    with pytest.raises(RuleError):
+        ScreenSpec({'scroe': "pb"})
+
+
+def _baseline_value(avg_roe, pe, dividend_yield, pb):
+    """原来 append_pb 中写死的有效性检查、性价比和估值条件；不通过时返回 None"""
+    def is_valid_numeric(value):
+        return not np.isnan(float(value)) and float(value) > 0
+    if not (is_valid_numeric(pe) and is_valid_numeric(dividend_yield) and is_valid_numeric(pb)):
+        return None
+    value_ratio = (avg_roe / 12) / pb + (100 / pe) / 12 if pb > 0 else np.nan
+    if not np.isnan(value_ratio) and pe < 200 and dividend_yield > 0.1 and pb < 33:
+        return value_ratio
+    return None
+
+
+def test_default_spec_matches_baseline_value_thresholds():
+    # 边界值、0、负数、NaN 与随机值的组合
+    specials = np.array([np.nan, -1.0, 0.0, 0.05, 0.1, 0.11, 1.0, 32.99, 33.0, 150.0, 199.99, 200.0, 250.0])
+    rng = np.random.default_rng(0)
+    pe = np.concatenate([np.repeat(specials, len(specials) ** 2), rng.uniform(-10, 300, 2000)])
+    dy = np.concatenate([np.tile(np.repeat(specials, len(specials)), len(specials)), rng.uniform(-1, 8, 2000)])
+    pb = np.concatenate([np.tile(specials, len(specials) ** 2), rng.uniform(-1, 40, 2000)])
+    avg_roe = rng.uniform(1, 40, len(pe))
+
+    spec = ScreenSpec()
+    assert spec.is_default()
+    env = {'avg_roe': avg_roe, 'pe': pe, 'dividend_yield': dy, 'pb': pb}
+    mask, score = spec.evaluate(env)
+    for i in range(len(pe)):
+        expected = _baseline_value(avg_roe[i], pe[i], dy[i], pb[i])
+        assert mask[i] == (expected is not None), (pe[i], dy[i], pb[i])
+        if expected is not None:
+            assert score[i] == expected
+
+
+def test_default_spec_matches_baseline_roe_conditions():
+    rng = np.random.default_rng(1)
+    values = rng.uniform(-8, 30, size=(3000, 6))
+    values[rng.random(values.shape) < 0.2] = np.nan
+    values[:50] = rng.uniform(0, 0.02, size=(50, 6))   # 最小值乘以 80 不超过平均值
+    mask = ScreenSpec().roe_mask(roe_env(values))
+    for row, passed in zip(values, mask):
+        valid = [x for x in row if not np.isnan(x)]
+        expected = bool(valid)
+        if valid:
+            avg_roe, min_roe = sum(valid) / len(valid), min(valid)
+            expected = avg_roe > 1 and min_roe > -5 and (abs(min_roe) * 80 > avg_roe or min_roe * 80 > avg_roe)
+        assert passed == expected
+    assert DEFAULT_SPEC['roe_filter'][2] == "abs(min_roe) * 80 > avg_roe or min_roe * 80 > avg_roe"
+
+
+def test_top_k_ties_follow_index_order():
+    scores = np.array([1.0, 3.0, 2.0, 3.0, 2.0, 2.0, 3.0])
+    assert top_k_indices(scores, 2).tolist() == [1, 3]
+    assert top_k_indices(scores, 4).tolist() == [1, 3, 6, 2]
+    assert top_k_indices(scores, 5).tolist() == [1, 3, 6, 2, 4]
+    assert top_k_indices(scores, None).tolist() == [1, 3, 6, 2, 4, 5, 0]
+
+
+def test_top_k_skips_nan_and_masked():
+    scores = np.array([np.nan, 5.0, np.nan, 4.0, 6.0, 1.0])
+    assert top_k_indices(scores, 10).tolist() == [4, 1, 3, 5]
+    assert top_k_indices(scores, 2).tolist() == [4, 1]
+    mask = np.array([True, False, True, True, True, True])
+    assert top_k_indices(scores, 2, mask=mask).tolist() == [4, 3]
+    assert top_k_indices(scores, 0).tolist() == []
+    assert top_k_indices(np.full(3, np.nan), 2).tolist() == []
+
+
+def test_top_k_matches_stable_sort():
+    rng = np.random.default_rng(2)
+    scores = rng.integers(0, 20, 500).astype(np.float64)   # 大量同分
+    scores[rng.random(500) < 0.1] = np.nan
+    valid = np.flatnonzero(~np.isnan(scores))
+    expected = valid[np.argsort(-scores[valid], kind='stable')]
+    for k in (1, 7, 50, len(valid) - 1, len(valid), len(valid) + 5):
+        assert top_k_indices(scores, k).tolist() == expected[:k].tolist()
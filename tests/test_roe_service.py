@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""选股服务：查询缓存随数据刷新失效、参数错误返回 400、/stock 与 /rank 的名次一致"""
+
+import json
+import time
+
+import numpy as np
+import pytest
+
+from roe_service import ScreenService, ServiceDataset
+
+PERIODS = ["20201231", "20211231", "20221231", "20231231", "20241231", "20250930"]
+
+
+def make_dataset(n_stocks=60, seed=0, pb_scale=1.0):
+    rng = np.random.default_rng(seed)
+    codes = [f"{600000 + i}" for i in range(n_stocks)]
+    values = rng.uniform(2, 30, size=(n_stocks, len(PERIODS)))
+    values[rng.random(values.shape) < 0.1] = np.nan
+    pe = np.round(rng.uniform(3, 80, n_stocks))         # 取整后有同分
+    pb = np.round(rng.uniform(0.5, 8, n_stocks)) * pb_scale
+    quotes = {code: (float(pe[i]), float(rng.uniform(0.5, 6)), float(pb[i]), f"股票{i}")
+              for i, code in enumerate(codes)}
+    quotes[codes[0]] = (float('nan'), float('nan'), float('nan'), None)   # 未获取到估值
+    industries = {code: ('银行' if i % 3 == 0 else '医药') for i, code in enumerate(codes)}
+    return ServiceDataset(codes, PERIODS, values, quotes, industries)
+
+
+def make_service(*datasets):
+    queue = list(datasets)
+    service = ScreenService(lambda: queue.pop(0), refresh_interval=0)
+    service.load()
+    return service
+
+
+def get(service, path, query=''):
+    status, body = service.handle(path, query)
+    return status, json.loads(body.decode('utf-8'))
+
+
+def test_cache_invalidated_on_load():
+    first, second = make_dataset(), make_dataset(pb_scale=2.0)
+    service = make_service(first, second)
+    status, body = get(service, '/rank', 'top=5')
+    assert status == 200 and body['version'] == 1
+    assert get(service, '/rank', 'top=5')[1] == body
+    assert (service.cache_hits, service.cache_misses) == (1, 1)
+
+    service.load()
+    assert get(service, '/status')[1]['cache_entries'] == 0
+    status, refreshed = get(service, '/rank', 'top=5')
+    assert refreshed['version'] == 2 and service.cache_misses == 2
+    assert refreshed['results'] != body['results']
+    top = body['results'][0]
+    assert get(service, f"/stock/{top['code']}")[1]['pb'] == 2 * top['pb']
+
+
+@pytest.mark.parametrize('query', [
+    'top=abc', 'top=-1', 'top=1.5', 'pb_max=cheap',
+    'filter=__import__("os")', 'filter=pe.real > 1', 'filter=unknown > 1',
+    'score=open("x")', 'score=pe *',
+])
+def test_bad_query_returns_400(query):
+    service = make_service(make_dataset())
+    status, body = get(service, '/rank', query)
+    assert status == 400 and body['error']
+    if not query.startswith('top='):
+        assert get(service, '/stock/600001', query)[0] == 400
+
+
+def test_unknown_stock_and_path_return_404():
+    service = make_service(make_dataset())
+    assert get(service, '/stock/999999')[0] == 404
+    assert get(service, '/nothing')[0] == 404
+
+
+@pytest.mark.parametrize('query', ['', 'pb_max=4', 'industry=银行', 'score=1', 'base=none&filter=pe > 10'])
+def test_stock_rank_matches_rank(query):
+    service = make_service(make_dataset())
+    _, ranked = get(service, '/rank', (query + '&' if query else '') + 'top=1000')
+    assert ranked['results'] and len(ranked['results']) == ranked['passed']
+    for row in ranked['results']:
+        _, stock = get(service, f"/stock/{row['code']}", query)
+        assert stock['passed'] and stock['rank'] == row['rank']
+        assert stock['value_ratio'] == row['value_ratio']
+    listed = {row['code'] for row in ranked['results']}
+    for code in make_dataset().codes:
+        if code not in listed:
+            _, stock = get(service, f"/stock/{code}", query)
+            assert not stock['passed'] and stock['rank'] is None
+
+
+def test_query_uses_dataset_captured_with_version(monkeypatch):
+    first, second = make_dataset(), make_dataset(pb_scale=2.0)
+    first.loaded_at -= 3600
+    service = make_service(first, second)
+    require_dataset = service._require_dataset
+    reloaded = []
+
+    def reload_during_query(*args):
+        # 模拟取到版本号之后、查询开始之前后台刷新替换了数据
+        if not reloaded:
+            reloaded.append(service.load())
+        return require_dataset(*args)
+
+    monkeypatch.setattr(service, '_require_dataset', reload_during_query)
+    _, body = get(service, '/rank', 'top=3')
+    _, expected = get(make_service(make_dataset()), '/rank', 'top=3')
+    assert body['version'] == 1 and body['results'] == expected['results']
+    assert body['loaded_at'] == time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(first.loaded_at))
+    # 旧版本的结果不进入缓存
+    assert service.version == 2 and get(service, '/status')[1]['cache_entries'] == 0
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""roe_stream：bounded_map 在消费者提前停止时停止读取输入并结束工作线程"""
+
+import threading
+
+from roe_stream import bounded_map
+
+
+def _new_threads(before):
+    return [thread for thread in threading.enumerate() if thread not in before and thread.is_alive()]
+
+
+def test_bounded_map_yields_every_item():
+    before = threading.enumerate()
+    results = sorted(result for _, result, _ in bounded_map(lambda x: x * x, range(100), workers=4, queue_size=3))
+    assert results == [x * x for x in range(100)]
+    assert not _new_threads(before)
+
+
+def test_bounded_map_reports_errors():
+    def func(x):
+        if x % 10 == 0:
+            raise ValueError(x)
+        return x
+
+    entries = list(bounded_map(func, range(50), workers=3, queue_size=2))
+    assert sorted(item for item, _, error in entries if error is not None) == list(range(0, 50, 10))
+    assert all(result == item for item, result, error in entries if error is None)
+
+
+def test_bounded_map_stops_when_consumer_stops():
+    consumed, calls = [], []
+
+    def items():
+        for i in range(100000):
+            consumed.append(i)
+            yield i
+
+    def func(x):
+        calls.append(x)
+        return x
+
+    before = threading.enumerate()
+    stream = bounded_map(func, items(), workers=4, queue_size=8)
+    for count, _ in enumerate(stream, start=1):
+        if count == 5:
+            break
+    stream.close()
+    assert not _new_threads(before)
+    # 最多多读取两个队列的容量、在途的元素和已阻塞在 put 上的元素
+    assert len(consumed) < 5 + 2 * 8 + 2 * 4 + 2
+    assert len(calls) <= len(consumed)
+
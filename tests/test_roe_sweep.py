@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""roe_sweep：只缩放性价比的参数、按并集计算的名次相关"""
+
+import numpy as np
+import pytest
+
+from roe_rules import ScreenSpec, roe_env
+from roe_sweep import DEFAULT_GRID, SweepGrid, run_sweep, spearman
+
+
+def _env(n_stocks=400, seed=3):
+    rng = np.random.default_rng(seed)
+    env = roe_env(rng.uniform(-5, 40, (n_stocks, 6)))
+    env.update(pe=rng.uniform(1, 300, n_stocks), dividend_yield=rng.uniform(0, 8, n_stocks),
+               pb=rng.uniform(0.1, 40, n_stocks))
+    return env, np.ones(n_stocks, dtype=bool)
+
+
+def test_default_grid_has_no_scale_only_params():
+    assert 'hurdle' not in DEFAULT_GRID
+    assert SweepGrid().validate() == []
+
+
+def test_scale_only_param_is_rejected_or_flagged():
+    with pytest.raises(ValueError):
+        SweepGrid(grid={'hurdle': [8, 12, 15]}).validate()
+    assert SweepGrid(grid={'hurdle': [8, 12], 'pe_max': [50, 100]}).validate() == ['hurdle']
+    # 只除一项时会改变名次
+    template = {'score': "avg_roe / {hurdle} / pb + 100 / pe"}
+    assert SweepGrid(template=template, grid={'hurdle': [8, 12]}).validate() == []
+
+
+def test_hurdle_does_not_change_results():
+    env, eligible = _env()
+    rows, _ = run_sweep(env, eligible, ScreenSpec(), SweepGrid(grid={'hurdle': [8, 12, 15]}), workers=1)
+    results = [{key: value for key, value in row.items() if key != 'hurdle'} for row in rows]
+    assert results[0] == results[1] == results[2]
+
+
+def test_rank_corr_counts_dropped_stocks():
+    env, eligible = _env()
+    rows, base = run_sweep(env, eligible, ScreenSpec(), SweepGrid(grid={'pe_max': [200, 30]}), workers=1)
+    assert base['rank_corr'] == pytest.approx(1.0)
+    assert rows[0]['rank_corr'] == pytest.approx(1.0)
+    # 只收紧筛选条件：留下的股票相对名次不变，但被筛掉的股票让相关系数低于 1
+    assert rows[1]['passed'] < rows[0]['passed']
+    assert rows[1]['rank_corr'] < 0.99
+
+
+def test_spearman_with_ties():
+    assert spearman([0, 1, 2, 3], [0, 1, 2, 3]) == pytest.approx(1.0)
+    assert spearman([0, 1, 2, 3], [3, 2, 1, 0]) == pytest.approx(-1.0)
+    assert spearman([0, 1, 9, 9], [0, 1, 2, 3]) == pytest.approx(np.corrcoef([0, 1, 2.5, 2.5], [0, 1, 2, 3])[0, 1])
+    assert np.isnan(spearman([0], [0]))
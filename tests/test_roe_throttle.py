@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""roe_throttle：令牌桶、AIMD、截止时间用假时钟，不真正等待；对冲请求用事件控制请求返回的先后"""
+
+import threading
+import time
+
+import pytest
+
+import roe_throttle
+from roe_throttle import AIMDLimiter, Deadline, DeadlineExceeded, Hedger, RateController, TokenBucket
+
+
+class FakeClock:
+    """替换 roe_throttle 中的 time 模块：monotonic() 返回假时间，sleep() 只推进假时间"""
+
+    def __init__(self, start=1000.0):
+        self.now = start
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(roe_throttle, 'time', fake)
+    return fake
+
+
+def test_token_bucket_burst_then_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+    # 桶空后按每秒 2 个补充
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.5)]
+    clock.now += 10
+    for _ in range(3):
+        bucket.acquire()
+    assert len(clock.sleeps) == 1
+
+
+def test_token_bucket_borrow_limited_to_capacity(clock):
+    bucket = TokenBucket(rate=1, capacity=2)
+    assert [bucket.borrow() for _ in range(5)] == [True, True, True, True, False]
+    # 预支了 2 个，下一个令牌要等 3 秒
+    bucket.acquire()
+    assert sum(clock.sleeps) == pytest.approx(3.0)
+
+
+def test_aimd_additive_increase_multiplicative_decrease(clock):
+    limiter = AIMDLimiter(initial=4, minimum=1, maximum=5, latency_target=2.0, backoff=0.5, cooldown=1.0)
+    limiter.acquire()
+    limiter.release(True, 0.1)
+    assert limiter.limit == pytest.approx(4.25)
+    limiter.acquire()
+    limiter.release(False, 0.1)
+    assert limiter.limit == pytest.approx(2.125)
+    # 冷却期内的失败不再减少
+    limiter.acquire()
+    limiter.release(False, 0.1)
+    assert limiter.limit == pytest.approx(2.125)
+    # 变慢与出错一样减少
+    clock.now += 1.0
+    limiter.acquire()
+    limiter.release(True, 5.0)
+    assert limiter.limit == pytest.approx(1.0625)
+    clock.now += 1.0
+    limiter.acquire()
+    limiter.release(False, 0.1)
+    assert limiter.limit == 1
+    for _ in range(100):
+        limiter.acquire()
+        limiter.release(True, 0.1)
+    assert limiter.limit == 5
+    assert limiter.in_flight == 0
+
+
+def test_aimd_acquire_blocks_at_limit():
+    limiter = AIMDLimiter(initial=1, minimum=1, maximum=1)
+    limiter.acquire()
+    acquired = threading.Event()
+    worker = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+    worker.start()
+    assert not acquired.wait(0.05)
+    limiter.cancel()
+    assert acquired.wait(5)
+    worker.join()
+    assert limiter.in_flight == 1 and limiter.limit == 1
+
+
+def test_deadline_expiry(clock):
+    deadline = Deadline(5)
+    assert deadline.remaining() == 5 and not deadline.expired()
+    assert deadline.cap(10) == 5 and deadline.cap(2) == 2 and deadline.cap(None) == 5
+    clock.now += 5
+    assert deadline.expired() and deadline.remaining() == 0
+    unlimited = Deadline()
+    clock.now += 1e6
+    assert not unlimited.expired() and unlimited.remaining() is None and unlimited.cap(3) == 3
+
+
+def test_rate_controller_skips_calls_after_deadline(clock):
+    controller = RateController(rate=100, initial=2, maximum=2)
+    deadline = Deadline(1)
+    calls = []
+    assert controller.call(calls.append, 'a', deadline=deadline) is None
+    clock.now += 1
+    with pytest.raises(DeadlineExceeded):
+        controller.call(calls.append, 'b', deadline=deadline)
+    assert calls == ['a']
+    assert controller.calls == 1 and controller.limiter.in_flight == 0
+
+
+def _warm_up(hedger, count, latency=0.02):
+    # 对冲阈值约为 latency，足够让第一个请求先开始执行
+    for _ in range(count):
+        hedger.call(lambda: time.sleep(latency))
+
+
+def test_hedger_hedges_slow_primary():
+    hedger = Hedger(timeout=5, budget=1.0, min_samples=5)
+    _warm_up(hedger, 5)
+    assert hedger.hedge_delay() is not None
+    release = threading.Event()
+    attempts = []
+
+    def request():
+        attempts.append(len(attempts))
+        if len(attempts) == 1:
+            release.wait(5)     # 第一个请求挂起，对冲请求立即返回
+            return 'primary'
+        return 'hedge'
+
+    try:
+        assert hedger.call(request) == 'hedge'
+    finally:
+        release.set()
+        hedger.close()
+    assert hedger.stats() == {'requests': 6, 'hedges': 1, 'hedge_wins': 1, 'timeouts': 0}
+
+
+def test_hedger_respects_budget():
+    hedger = Hedger(timeout=5, budget=0.0, min_samples=5)
+    _warm_up(hedger, 5)
+    release = threading.Event()
+    threading.Timer(0.05, release.set).start()
+    try:
+        assert hedger.call(lambda: release.wait(5) and 'primary') == 'primary'
+    finally:
+        release.set()
+        hedger.close()
+    assert hedger.stats()['hedges'] == 0
+
+
+def test_hedger_timeout_is_counted():
+    hedger = Hedger(timeout=0.05, budget=0.0)
+    release = threading.Event()
+    try:
+        with pytest.raises(TimeoutError):
+            hedger.call(lambda: release.wait(5))
+    finally:
+        release.set()
+        hedger.close()
+    assert hedger.stats() == {'requests': 1, 'hedges': 0, 'hedge_wins': 0, 'timeouts': 1}
+
+
+def test_hedger_reraises_errors():
+    hedger = Hedger(timeout=5)
+
+    def fail():
+        raise ConnectionError("boom")
+
+    try:
+        with pytest.raises(ConnectionError):
+            hedger.call(fail)
+    finally:
+        hedger.close()
+    assert hedger.stats()['timeouts'] == 0